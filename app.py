@@ -1,41 +1,278 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify
+from flask import Flask, render_template, request, redirect, url_for, jsonify, g, send_file
+import functools
+import hashlib
 import os
-import pandas as pd
 import json
 
+import arranque
+import busqueda
+import catalogo
+import compresion
+from catalogo import BASE_DIR, CatalogoInvalido
+import exportar
+import flujos
+import metricas
+import indices
+import lote
+import resultados
+import sap
+import trabajos
+from indices import indice_ajuste, indice_tubing, indice_varillas
+from sesiones import crear_backend_desde_entorno, nuevo_token, token_valido
+
 
 app = Flask(__name__)
 
+# Latencia por ruta y por etapa, expuesta en /metrics (ver metricas.py)
+render_template = metricas.medido("render")(render_template)
+
+
+@app.before_request
+def iniciar_metricas():
+    metricas.iniciar_request(request.url_rule.rule if request.url_rule else metricas.SIN_RUTA)
+
+
+@app.after_request
+def registrar_metricas(response):
+    metricas.terminar_request(request.method, response.status_code)
+    return response
+
 
-# Directorio de archivos Excel
-BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "materiales")
 EXCEL_PATH = os.path.join(BASE_DIR, "baja varillas.xlsx")
 
-# Variable global para almacenar resultados de cada flujo
-materiales_finales = []
+# Resultados de cada flujo, separados por sesión (ver sesiones.py)
+SESION_COOKIE = "bm_sesion"
+almacen_sesiones = crear_backend_desde_entorno()
 
+# Archivos exportados, por huella de la lista de resultados
+cache_exportaciones = exportar.crear_cache_desde_entorno()
+
+
+@app.before_request
+def cargar_sesion():
+    token = request.cookies.get(SESION_COOKIE)
+    g.sesion_nueva = not token_valido(token)
+    g.sesion_token = nuevo_token() if g.sesion_nueva else token
+
+
+@app.after_request
+def guardar_cookie_sesion(response):
+    if g.get("sesion_nueva"):
+        response.set_cookie(SESION_COOKIE, g.sesion_token, httponly=True, samesite="Lax")
+    return response
+
+
+# Versión de cada catálogo fijada para la corrida actual (ver catalogo.py). La
+# vigilancia de materiales/ se lanza con el primer request de cada proceso.
+VERSIONES_COOKIE = "bm_versiones"
+
+
+@app.before_request
+def fijar_versiones_catalogos():
+    catalogo.iniciar_vigilancia()
+    catalogo.fijar_versiones(catalogo.decodificar_versiones(request.cookies.get(VERSIONES_COOKIE)))
+
+
+@app.after_request
+def guardar_versiones_catalogos(response):
+    firmas, cambio = catalogo.soltar_versiones()
+    if cambio:
+        response.set_cookie(VERSIONES_COOKIE, catalogo.codificar_versiones(firmas), httponly=True, samesite="Lax")
+    return response
+
+
+@app.teardown_request
+def soltar_versiones_catalogos(error=None):
+    catalogo.soltar_versiones()
+
+
+# ===================================
+# HTML por bloques, compresión y estáticos
+# ===================================
+# Las páginas grandes (flujo_final, selección del Flujo H) se generan con
+# render_por_bloques: el HTML sale a medida que Jinja lo produce. El primer
+# bloque (el <head> y la barra de navegación) se manda apenas pasa
+# PRIMER_BLOQUE bytes, así el navegador empieza a bajar el CSS mientras se
+# arma el resto; después se agrupa de a BLOQUE_HTML bytes. Todo lo que puede
+# fallar (sesión, resultados vencidos, búsqueda) se resuelve antes de empezar
+# a enviar, para poder responder con el código de error que corresponda.
+#
+# Las respuestas de texto se comprimen con brotli o gzip (ver compresion.py).
+#
+# url_for("static", ...) agrega ?v=<hash del archivo>; un pedido con la
+# versión vigente se guarda en el navegador por un año como inmutable, y al
+# cambiar el archivo cambia la URL.
+PRIMER_BLOQUE = 1024
+BLOQUE_HTML = 8 * 1024
+
+
+def _agrupar(pedazos):
+    buffer, tamanio, minimo = [], 0, PRIMER_BLOQUE
+    for pedazo in pedazos:
+        buffer.append(pedazo)
+        tamanio += len(pedazo)
+        if tamanio >= minimo:
+            yield "".join(buffer)
+            buffer, tamanio, minimo = [], 0, BLOQUE_HTML
+    if buffer:
+        yield "".join(buffer)
+
+
+def render_por_bloques(nombre, **contexto):
+    """Como render_template, pero la respuesta se envía por bloques mientras se genera."""
+    app.update_template_context(contexto)
+    plantilla = app.jinja_env.get_template(nombre)
+    entorno = request.environ
+
+    def generar():
+        # El cuerpo se genera después de que terminó el request y url_for
+        # necesita un contexto (stream_with_context de Flask 2.0 no restaura
+        # el de la app). Se activa sólo mientras se produce cada bloque, así
+        # no queda uno a medias si el cliente intercala otro request.
+        contexto_request = app.request_context(entorno)
+        bloques = _agrupar(plantilla.generate(contexto))
+        while True:
+            contexto_request.push()
+            try:
+                bloque = next(bloques, None)
+            finally:
+                contexto_request.pop()
+            if bloque is None:
+                return
+            yield bloque
+
+    return app.response_class(metricas.medir_bloques("render", generar), mimetype="text/html")
+
+
+@app.after_request
+def comprimir_respuesta(response):
+    return compresion.comprimir_respuesta(response, request.accept_encodings)
+
+
+@functools.lru_cache(maxsize=256)
+def _version_estatico(path, modificado):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()[:12]
+
+
+def version_estatico(filename):
+    path = os.path.join(app.static_folder, filename)
+    try:
+        return _version_estatico(path, os.path.getmtime(path))
+    except OSError:
+        return None
+
+
+@app.url_defaults
+def versionar_estaticos(endpoint, values):
+    if endpoint == "static" and "v" not in values:
+        version = version_estatico(values.get("filename", ""))
+        if version:
+            values["v"] = version
+
+
+@app.after_request
+def cachear_estaticos(response):
+    if request.endpoint == "static" and response.status_code in (200, 304):
+        version = request.args.get("v")
+        if version and version == version_estatico(request.view_args.get("filename", "")):
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
+
+
+# La sesión guarda {"resultados": [Resultado]}, un resultado compacto por
+# flujo (ver resultados.py): volver a un flujo desde flujo_final reemplaza su
+# resultado anterior. Lo que se arma a partir de ellos se guarda por proceso,
+# identificado por las claves de los resultados:
+#   - las páginas HTML de flujo_final (FILAS_POR_PAGINA filas cada una), por
+#     resultado, en un LRU de PAGINAS_EN_CACHE resultados;
+#   - el consolidado de la lista (ver flujos.Consolidado), en
+#     cache_exportaciones. Al guardar un flujo se guarda una copia del de la
+#     lista anterior con el aporte de ese flujo (lo que está en la caché no
+#     se modifica: lo comparten sesiones y requests); si este proceso no lo
+#     tiene, se arma completo la primera vez que se pide.
+FILAS_POR_PAGINA = 50
+PAGINAS_EN_CACHE = 512
+
+
+@functools.lru_cache(maxsize=PAGINAS_EN_CACHE)
+def _paginas_html(resultado):
+    df = resultado.materializar()
+    paginas = [
+        df.iloc[i:i + FILAS_POR_PAGINA].to_html(classes="table table-bordered", index=False)
+        for i in range(0, len(df), FILAS_POR_PAGINA)
+    ]
+    return paginas or [df.to_html(classes="table table-bordered", index=False)]
+
+
+def _clave_consolidado(lista):
+    return ("consolidado",) + tuple(resultado.clave for resultado in lista)
+
+
+def _guardar_consolidado(lista, consolidado):
+    # Tamaño estimado por clave: la tupla de textos, los dicts y la fila de la tabla
+    cache_exportaciones.guardar(_clave_consolidado(lista), consolidado, 1024 * max(1, len(consolidado)))
+
+
+def consolidado_sesion(lista):
+    consolidado = cache_exportaciones.obtener(_clave_consolidado(lista))
+    if consolidado is None:
+        consolidado = flujos.Consolidado.desde([(r.flujo, r.materializar()) for r in lista])
+        _guardar_consolidado(lista, consolidado)
+    return consolidado
+
+
+def _sesion(valor):
+    if valor is None:
+        return {"resultados": []}
+    if isinstance(valor, list):
+        # Sesiones guardadas antes de cachear las tablas: lista de (flujo, df)
+        valor = {"resultados": valor}
+    lista = valor["resultados"]
+    if lista and not isinstance(lista[0], resultados.Resultado):
+        # Sesiones guardadas antes de los resultados compactos: [(flujo, df)]
+        valor = {"resultados": [resultados.Resultado.desde(flujo, df) for flujo, df in lista]}
+    return valor
+
+
+def sesion_actual():
+    return _sesion(almacen_sesiones.obtener(g.sesion_token))
+
+
+def agregar_material(flujo, df):
+    resultado = resultados.Resultado.desde(flujo, df)
+    anterior = []
+
+    def agregar(actual):
+        lista = list(_sesion(actual)["resultados"])
+        anterior[:] = lista
+        guardados = [r.flujo for r in lista]
+        if flujo in guardados:
+            lista[guardados.index(flujo)] = resultado
+        else:
+            lista.append(resultado)
+        return {"resultados": lista}
+
+    lista = almacen_sesiones.actualizar(g.sesion_token, agregar)["resultados"]
+    if anterior:
+        consolidado = cache_exportaciones.obtener(_clave_consolidado(anterior))
+    else:
+        consolidado = flujos.Consolidado()
+    if consolidado is not None:
+        # El de la caché lo comparten las sesiones con la misma lista (y los
+        # requests que ya lo leyeron): se actualiza una copia
+        consolidado = consolidado.copiar()
+        consolidado.reemplazar(flujo, df)
+        _guardar_consolidado(lista, consolidado)
 
-# Función auxiliar para renombrar columnas
-def renombrar_columnas(df):
-    df_renombrado = df.rename(
-        columns={
-            "1. Cód.SAP": "Cód.SAP",
-            "2. MATERIAL": "MATERIAL",
-            "3. Descripción": "Descripción",
-            "5.CONDICIÓN": "CONDICIÓN"
-        }
-    )
-    columnas = ["Cód.SAP", "MATERIAL", "Descripción", "4.CANTIDAD", "CONDICIÓN"]
-    columnas_presentes = [col for col in columnas if col in df_renombrado.columns]
-    return df_renombrado[columnas_presentes]
 
 # ===================================
 # Página de Inicio
 # ===================================
 @app.route("/")
 def index():
-    global materiales_finales
-    materiales_finales = []  # Reinicia la lista para cada nueva corrida
+    almacen_sesiones.guardar(g.sesion_token, _sesion(None))  # Reinicia la lista para cada nueva corrida
+    catalogo.fijar_versiones({}, cambio=True)  # y las versiones de catálogo fijadas
     return render_template("index.html")
 
 
@@ -60,25 +297,37 @@ def flujo_a_decidir():
 
 
 # Paso 1: Selección de DIÁMETRO
+# Con JavaScript, esta página arma toda la cascada con el paquete de opciones
+# (ver paquete_opciones) y envía las elecciones de una vez con "cascada"; sin
+# JavaScript se sigue paso a paso.
 @app.route("/flujo_a/seleccion", methods=["GET", "POST"])
 def flujo_a_seleccion():
     try:
-        file_path = os.path.join(BASE_DIR, "ajuste de medida.xlsx")
-        df = pd.read_excel(file_path)
-        df.columns = df.columns.str.strip()
-        df["DIÁMETRO"] = df["DIÁMETRO"].astype(str).str.strip()
-        unique_diametros = sorted([x for x in df["DIÁMETRO"].dropna().unique() if x.upper() != "TODOS"])
+        unique_diametros = indice_ajuste().diametros
+        version = indices.paquete_opciones("ajuste")["version"]
     except Exception as e:
         return f"Error al cargar el Excel: {e}"
     if request.method == "POST":
         selected = request.form.getlist("diametros")
         if not selected:
             return "Seleccione al menos un DIÁMETRO.", 400
+        if request.form.get("cascada"):
+            filtros = {
+                diam: {
+                    "tipo": request.form.get(f"tipo_{diam}", "TODOS"),
+                    "acero": request.form.get(f"acero_{diam}", "Seleccionar"),
+                    "acero_cup": request.form.get(f"acero_cup_{diam}", "Seleccionar"),
+                    "tipo_cup": request.form.get(f"tipo_cup_{diam}", "Seleccionar"),
+                }
+                for diam in selected
+            }
+            return guardar_flujo_a(selected, filtros)
         diametros_str = ",".join(selected)
         # Redirige al siguiente paso: Selección de TIPO
         return redirect(url_for("flujo_a_seleccion_tipo", diametros=diametros_str))
     else:
-        return render_template("flujo_a_seleccion.html", unique_diametros=unique_diametros)
+        return render_template("flujo_a_seleccion.html", unique_diametros=unique_diametros,
+                               paquete_url=url_for("paquete_opciones", clave="ajuste", v=version))
 
 
 # Paso 2: Selección de TIPO
@@ -87,21 +336,12 @@ def flujo_a_seleccion_tipo():
     diametros_str = request.args.get("diametros", "")
     selected_diametros = diametros_str.split(",") if diametros_str else []
     try:
-        file_path = os.path.join(BASE_DIR, "ajuste de medida.xlsx")
-        df = pd.read_excel(file_path)
-        df.columns = df.columns.str.strip()
-        df["DIÁMETRO"] = df["DIÁMETRO"].astype(str).str.strip()
+        indice = indice_ajuste()
     except Exception as e:
         return f"Error al cargar el Excel: {e}"
     
     # Para cada DIÁMETRO, obtener los TIPOS disponibles (se consideran filas que tengan el valor de DIÁMETRO o "TODOS")
-    tipos_dict = {}
-    for diam in selected_diametros:
-        subset = df[df["DIÁMETRO"].isin([diam, "TODOS"])]
-        tipos = sorted([x for x in subset["TIPO"].dropna().unique() if x.upper() != "TODOS"])
-        if not tipos:
-            tipos = ["TODOS"]
-        tipos_dict[diam] = tipos
+    tipos_dict = {diam: indice.opciones(diam) for diam in selected_diametros}
 
     if request.method == "POST":
         filtros = {}
@@ -124,24 +364,15 @@ def flujo_a_seleccion_acero():
     filtros = json.loads(filtros_str)
     
     try:
-        file_path = os.path.join(BASE_DIR, "ajuste de medida.xlsx")
-        df = pd.read_excel(file_path)
-        df.columns = df.columns.str.strip()
-        df["DIÁMETRO"] = df["DIÁMETRO"].astype(str).str.strip()
+        indice = indice_ajuste()
     except Exception as e:
         return f"Error al cargar el Excel: {e}"
     
-    # Para cada DIÁMETRO, filtrar por DIÁMETRO y TIPO ya seleccionado, y obtener las opciones de GRADO DE ACERO
+    # Para cada DIÁMETRO, opciones de GRADO DE ACERO según DIÁMETRO y TIPO ya seleccionado
     acero_dict = {}
     for diam in selected_diametros:
         tipo_sel = filtros.get(diam, {}).get("tipo", "TODOS")
-        subset = df[df["DIÁMETRO"].isin([diam, "TODOS"])]
-        if tipo_sel != "TODOS":
-            subset = subset[subset["TIPO"].isin([tipo_sel, "TODOS"])]
-        opciones_acero = sorted([x for x in subset["GRADO DE ACERO"].dropna().unique() if str(x).upper() != "TODOS"]) if "GRADO DE ACERO" in subset.columns else ["Seleccionar"]
-        if not opciones_acero:
-            opciones_acero = ["TODOS"]
-        acero_dict[diam] = opciones_acero
+        acero_dict[diam] = indice.opciones(diam, tipo_sel)
 
     if request.method == "POST":
         for diam in selected_diametros:
@@ -165,27 +396,16 @@ def flujo_a_seleccion_acero_cup():
     filtros = json.loads(filtros_str)
     
     try:
-        file_path = os.path.join(BASE_DIR, "ajuste de medida.xlsx")
-        df = pd.read_excel(file_path)
-        df.columns = df.columns.str.strip()
-        df["DIÁMETRO"] = df["DIÁMETRO"].astype(str).str.strip()
+        indice = indice_ajuste()
     except Exception as e:
         return f"Error al cargar el Excel: {e}"
     
-    # Para cada DIÁMETRO, filtrar por DIÁMETRO, TIPO y GRADO DE ACERO para obtener opciones de GRADO DE ACERO CUPLA
+    # Para cada DIÁMETRO, opciones de GRADO DE ACERO CUPLA según DIÁMETRO, TIPO y GRADO DE ACERO
     acero_cup_dict = {}
     for diam in selected_diametros:
         tipo_sel = filtros.get(diam, {}).get("tipo", "TODOS")
         ac_sel = filtros.get(diam, {}).get("acero", "Seleccionar")
-        subset = df[df["DIÁMETRO"].isin([diam, "TODOS"])]
-        if tipo_sel != "TODOS":
-            subset = subset[subset["TIPO"].isin([tipo_sel, "TODOS"])]
-        if ac_sel != "Seleccionar":
-            subset = subset[subset["GRADO DE ACERO"].isin([ac_sel, "TODOS"])]
-        opciones_acero_cup = sorted([x for x in subset["GRADO DE ACERO CUPLA"].dropna().unique() if str(x).upper() != "TODOS"]) if "GRADO DE ACERO CUPLA" in subset.columns else ["Seleccionar"]
-        if not opciones_acero_cup:
-            opciones_acero_cup = ["TODOS"]
-        acero_cup_dict[diam] = opciones_acero_cup
+        acero_cup_dict[diam] = indice.opciones(diam, tipo_sel, ac_sel)
 
     if request.method == "POST":
         for diam in selected_diametros:
@@ -209,30 +429,17 @@ def flujo_a_seleccion_tipo_cup():
     filtros = json.loads(filtros_str)
     
     try:
-        file_path = os.path.join(BASE_DIR, "ajuste de medida.xlsx")
-        df = pd.read_excel(file_path)
-        df.columns = df.columns.str.strip()
-        df["DIÁMETRO"] = df["DIÁMETRO"].astype(str).str.strip()
+        indice = indice_ajuste()
     except Exception as e:
         return f"Error al cargar el Excel: {e}"
     
-    # Para cada DIÁMETRO, filtrar según DIÁMETRO, TIPO, GRADO DE ACERO y GRADO DE ACERO CUPLA para obtener opciones de TIPO DE CUPLA
+    # Para cada DIÁMETRO, opciones de TIPO DE CUPLA según DIÁMETRO, TIPO, GRADO DE ACERO y GRADO DE ACERO CUPLA
     tipo_cup_dict = {}
     for diam in selected_diametros:
         tipo_sel = filtros.get(diam, {}).get("tipo", "TODOS")
         ac_sel = filtros.get(diam, {}).get("acero", "Seleccionar")
         ac_cup_sel = filtros.get(diam, {}).get("acero_cup", "Seleccionar")
-        subset = df[df["DIÁMETRO"].isin([diam, "TODOS"])]
-        if tipo_sel != "TODOS":
-            subset = subset[subset["TIPO"].isin([tipo_sel, "TODOS"])]
-        if ac_sel != "Seleccionar":
-            subset = subset[subset["GRADO DE ACERO"].isin([ac_sel, "TODOS"])]
-        if ac_cup_sel != "Seleccionar":
-            subset = subset[subset["GRADO DE ACERO CUPLA"].isin([ac_cup_sel, "TODOS"])]
-        opciones_tipo_cup = sorted([x for x in subset["TIPO DE CUPLA"].dropna().unique() if str(x).upper() != "TODOS"]) if "TIPO DE CUPLA" in subset.columns else ["Seleccionar"]
-        if not opciones_tipo_cup:
-            opciones_tipo_cup = ["TODOS"]
-        tipo_cup_dict[diam] = opciones_tipo_cup
+        tipo_cup_dict[diam] = indice.opciones(diam, tipo_sel, ac_sel, ac_cup_sel)
 
     if request.method == "POST":
         for diam in selected_diametros:
@@ -254,32 +461,16 @@ def flujo_a_resumen():
     filtros_str = request.args.get("filtros", "{}")
     selected_diametros = diametros_str.split(",") if diametros_str else []
     filtros = json.loads(filtros_str)
-    
+    return guardar_flujo_a(selected_diametros, filtros)
+
+
+def guardar_flujo_a(selected_diametros, filtros):
+    # Combina los filtros de cada DIÁMETRO ("TODOS"/"Seleccionar" no filtran)
     try:
-        file_path = os.path.join(BASE_DIR, "ajuste de medida.xlsx")
-        df = pd.read_excel(file_path)
-        df.columns = df.columns.str.strip()
-        df["DIÁMETRO"] = df["DIÁMETRO"].astype(str).str.strip()
+        final_df_renombrado = flujos.flujo_a(selected_diametros, filtros)
     except Exception as e:
         return f"Error al cargar el Excel: {e}"
-    
-    # Construir la condición final combinando los filtros de cada DIÁMETRO
-    final_condition = pd.Series([False] * len(df))
-    for diam in selected_diametros:
-        cond = df["DIÁMETRO"].isin([diam, "TODOS"])
-        if filtros.get(diam, {}).get("tipo", "TODOS") != "TODOS":
-            cond = cond & df["TIPO"].isin([filtros[diam]["tipo"], "TODOS"])
-        if filtros.get(diam, {}).get("acero", "Seleccionar") != "Seleccionar":
-            cond = cond & df["GRADO DE ACERO"].isin([filtros[diam]["acero"], "TODOS"])
-        if filtros.get(diam, {}).get("acero_cup", "Seleccionar") != "Seleccionar":
-            cond = cond & df["GRADO DE ACERO CUPLA"].isin([filtros[diam]["acero_cup"], "TODOS"])
-        if filtros.get(diam, {}).get("tipo_cup", "Seleccionar") != "Seleccionar":
-            cond = cond & df["TIPO DE CUPLA"].isin([filtros[diam]["tipo_cup"], "TODOS"])
-        final_condition = final_condition | cond
-    
-    final_df = df[final_condition]
-    final_df_renombrado = renombrar_columnas(final_df)
-    materiales_finales.append(("FLUJO A", final_df_renombrado))
+    agregar_material("FLUJO A", final_df_renombrado)
     # Finalmente, redirigir al flujo siguiente (por ejemplo, flujo_h)
     return redirect(url_for("flujo_h"))
 
@@ -302,10 +493,7 @@ def flujo_b():
 @app.route("/flujo_b/seleccion", methods=["GET", "POST"])
 def flujo_b_seleccion():
     try:
-        file_path = os.path.join(BASE_DIR, "saca tubing.xlsx")
-        df = pd.read_excel(file_path)
-        df.columns = df.columns.str.strip()
-        unique_diametros = sorted([d for d in df["DIÁMETRO"].dropna().unique() if d.upper() != "TODOS"])
+        unique_diametros = indices.diametros_saca()
     except Exception as e:
         return f"Error al cargar el Excel: {e}"
     if request.method == "POST":
@@ -327,17 +515,10 @@ def flujo_b_cantidades():
             qty = request.form.get(f"qty_{diam}", type=float)
             quantities[diam] = qty
         try:
-            file_path = os.path.join(BASE_DIR, "saca tubing.xlsx")
-            df = pd.read_excel(file_path)
-            df.columns = df.columns.str.strip()
+            df_filtered_renombrado = flujos.flujo_b(selected, quantities)
         except Exception as e:
             return f"Error: {e}"
-        df_filtered = df[(df["DIÁMETRO"].isin(selected)) | (df["DIÁMETRO"].str.upper() == "TODOS")].copy()
-        for diam, qty in quantities.items():
-            mask = (df_filtered["DIÁMETRO"] == diam) & (df_filtered["4.CANTIDAD"].isna())
-            df_filtered.loc[mask, "4.CANTIDAD"] = qty
-        df_filtered_renombrado = renombrar_columnas(df_filtered)
-        materiales_finales.append(("FLUJO B", df_filtered_renombrado))
+        agregar_material("FLUJO B", df_filtered_renombrado)
         return redirect(url_for("flujo_c"))
     else:
         return render_template("flujo_b_cantidades.html", selected_diametros=selected)
@@ -366,11 +547,8 @@ def flujo_c_decidir():
 @app.route("/flujo_c/seleccion", methods=["GET", "POST"])
 def flujo_c_seleccion():
     try:
-        file_path = os.path.join(BASE_DIR, "baja tubing.xlsx")
-        df = pd.read_excel(file_path)
-        df.columns = df.columns.str.strip()
         # Se extraen los DIÁMETRO únicos (excluyendo "TODOS")
-        unique_diametros = sorted([x for x in df["DIÁMETRO"].dropna().unique() if x != "TODOS"])
+        unique_diametros = indice_tubing().diametros
     except Exception as e:
         return f"Error al cargar el Excel: {e}"
     
@@ -388,19 +566,11 @@ def flujo_c_tipo():
     diametros_str = request.args.get("diametros", "")
     selected_diametros = diametros_str.split(",") if diametros_str else []
     try:
-        file_path = os.path.join(BASE_DIR, "baja tubing.xlsx")
-        df = pd.read_excel(file_path)
-        df.columns = df.columns.str.strip()
+        indice = indice_tubing()
     except Exception as e:
         return f"Error: {e}"
     # Para cada DIÁMETRO, extraemos las opciones de TIPO (excluyendo "TODOS")
-    filtros = {}
-    for diam in selected_diametros:
-        subset = df[df["DIÁMETRO"] == diam]
-        tipos = sorted([x for x in subset["TIPO"].dropna().unique() if x != "TODOS"])
-        if not tipos:
-            tipos = ["TODOS"]
-        filtros[diam] = tipos
+    filtros = {diam: indice.tipos(diam) for diam in selected_diametros}
     if request.method == "POST":
         selected_tipos_dict = {}
         for diam in selected_diametros:
@@ -420,9 +590,7 @@ def flujo_c_diacsg():
     tipos_json = request.args.get("tipos", "{}")
     selected_tipos_dict = json.loads(tipos_json)
     try:
-        file_path = os.path.join(BASE_DIR, "baja tubing.xlsx")
-        df = pd.read_excel(file_path)
-        df.columns = df.columns.str.strip()
+        indice = indice_tubing()
     except Exception as e:
         return f"Error: {e}"
     # Se calcula la unión de los TIPO seleccionados, agregando "TODOS"
@@ -434,8 +602,7 @@ def flujo_c_diacsg():
             union_tipos.update(sel)
             union_tipos.add("TODOS")
     diam_filter = ["TODOS"] if selected_diametros == ["TODOS"] else selected_diametros + ["TODOS"]
-    df_filtered = df[df["DIÁMETRO"].isin(diam_filter) & df["TIPO"].isin(union_tipos)]
-    unique_csg = sorted([x for x in df_filtered["DIÁMETRO CSG"].dropna().unique() if x != "TODOS"])
+    unique_csg = indice.opciones_csg(diam_filter, union_tipos)
     if not unique_csg:
         # Si no hay valores para DIÁMETRO CSG, se continúa automáticamente usando "TODOS"
         return redirect(url_for("flujo_c_cantidades", diametros=diametros_str, tipos=tipos_json, diacsg="TODOS"))
@@ -450,19 +617,12 @@ def flujo_c_diacsg():
 
 @app.route("/flujo_c/cantidades", methods=["GET", "POST"])
 def flujo_c_cantidades():
-    global alertas
     diametros_str = request.args.get("diametros", "")
     selected_diametros = diametros_str.split(",") if diametros_str else []
     tipos_json = request.args.get("tipos", "{}")
     selected_tipos_dict = json.loads(tipos_json)
     # Aquí se recibe el valor seleccionado en DIÁMETRO CSG; se utiliza para filtrar
     diacsg = request.args.get("diacsg", "TODOS")
-    try:
-        file_path = os.path.join(BASE_DIR, "baja tubing.xlsx")
-        df = pd.read_excel(file_path)
-        df.columns = df.columns.str.strip()
-    except Exception as e:
-        return f"Error: {e}"
     if request.method == "POST":
         quantities = {}
         for diam in selected_diametros:
@@ -470,27 +630,11 @@ def flujo_c_cantidades():
                 qty = request.form.get(f"qty_{diam}_{tipo}", type=float)
                 quantities[(diam, tipo)] = qty
         # Ahora, se aplica el filtrado incluyendo DIÁMETRO, TIPO y DIÁMETRO CSG
-        for (diam, tipo), qty in quantities.items():
-            condition = (
-                df["DIÁMETRO"].isin([diam, "TODOS"]) &
-                df["TIPO"].isin([tipo, "TODOS"]) &
-                df["DIÁMETRO CSG"].isin([diacsg, "TODOS"])
-            )
-            df.loc[condition & df["4.CANTIDAD"].isna(), "4.CANTIDAD"] = qty
-        final_condition = pd.Series([False]*len(df))
-        for diam_value, fdict in selected_tipos_dict.items():
-            temp = pd.Series([False]*len(df))
-            for tipo_val in fdict:
-                cond = (
-                    df["DIÁMETRO"].isin([diam_value, "TODOS"]) &
-                    df["TIPO"].isin([tipo_val, "TODOS"]) &
-                    df["DIÁMETRO CSG"].isin([diacsg, "TODOS"])
-                )
-                temp = temp | cond
-            final_condition = final_condition | temp
-        final_df = df[final_condition]
-        final_df_renombrado = renombrar_columnas(final_df)
-        materiales_finales.append(("FLUJO C", final_df_renombrado))
+        try:
+            final_df_renombrado = flujos.flujo_c(selected_tipos_dict, diacsg, quantities)
+        except Exception as e:
+            return f"Error: {e}"
+        agregar_material("FLUJO C", final_df_renombrado)
         
         return redirect(url_for("flujo_d"))
     else:
@@ -520,30 +664,17 @@ def flujo_d_decidir():
 
 @app.route("/flujo_d/seleccion", methods=["GET", "POST"])
 def flujo_d_seleccion():
-    file_path = os.path.join(BASE_DIR, "profundiza.xlsx")
     try:
-        df = pd.read_excel(file_path)
-        df.columns = df.columns.str.strip()
-        for col in df.columns:
-            if df[col].dtype == object:
-                df[col] = df[col].astype(str).str.strip()
-        # Reemplazar valores 'nan'
-        if 'TIPO' in df.columns:
-            df['TIPO'] = df['TIPO'].replace('nan', '').fillna('')
-        if 'DIÁMETRO CSG' in df.columns:
-            df['DIÁMETRO CSG'] = df['DIÁMETRO CSG'].replace('nan', '').fillna('')
+        opciones = indices.opciones_profundiza()
     except Exception as e:
         return f"Error al cargar el Excel: {e}"
     
     # Elegir la columna a usar: si existe "DIÁMETRO", se usa; sino, "DIÁMETRO CSG"
-    if "DIÁMETRO" in df.columns:
-        col = "DIÁMETRO"
-    elif "DIÁMETRO CSG" in df.columns:
-        col = "DIÁMETRO CSG"
-    else:
+    col = opciones["columna"]
+    if col is None:
         return "La columna de DIÁMETRO no se encontró en el Excel."
     
-    unique_values = sorted(df[col].dropna().unique().tolist())
+    unique_values = opciones["valores"]
     if request.method == "POST":
         selected = request.form.getlist("valores")
         if not selected:
@@ -559,27 +690,24 @@ def flujo_d_cantidades():
     valores_str = request.args.get("valores", "")
     col = request.args.get("col", "")
     selected_values = valores_str.split(",") if valores_str else []
-    file_path = os.path.join(BASE_DIR, "profundiza.xlsx")
     try:
-        df = pd.read_excel(file_path)
-        df.columns = df.columns.str.strip()
-        for c in df.columns:
-            if df[c].dtype == object:
-                df[c] = df[c].astype(str).str.strip()
+        columna = indices.opciones_profundiza()["columna"]
     except Exception as e:
         return f"Error al cargar el Excel: {e}"
+    # La columna viaja en la URL: sólo vale la que ofreció la selección
+    if col != columna:
+        return f"Columna de profundiza inválida: {col!r}.", 400
     if request.method == "POST":
         quantities = {}
         for val in selected_values:
             qty = request.form.get(f"qty_{val}", type=float)
             quantities[val] = qty
         # Filtrar el DataFrame según la columna y los valores seleccionados
-        filtered_df = df[df[col].isin(selected_values)]
-        for val, qty in quantities.items():
-            mask = (filtered_df[col] == val) & (filtered_df["4.CANTIDAD"].isna())
-            filtered_df.loc[mask, "4.CANTIDAD"] = qty
-        final_df_renombrado = renombrar_columnas(filtered_df)
-        materiales_finales.append(("FLUJO D", final_df_renombrado))
+        try:
+            final_df_renombrado = flujos.flujo_d(col, selected_values, quantities)
+        except Exception as e:
+            return f"Error al cargar el Excel: {e}"
+        agregar_material("FLUJO D", final_df_renombrado)
         return redirect(url_for("flujo_e"))
     else:
         # Preparar lista de valores para mostrar los campos de cantidad
@@ -604,14 +732,12 @@ def flujo_e_decidir():
     else:
         return "Selecciona una opción.", 400
 
+# Como en el Flujo A: con JavaScript los filtros se eligen en esta misma página
 @app.route("/flujo_e/seleccion", methods=["GET", "POST"])
 def flujo_e_seleccion():
     try:
-        file_path = os.path.join(BASE_DIR, "baja varillas.xlsx")
-        df = pd.read_excel(file_path)
-        df.columns = df.columns.str.strip()
-        df["DIÁMETRO"] = df["DIÁMETRO"].astype(str).str.strip()
-        unique_diametros = sorted([x for x in df["DIÁMETRO"].dropna().unique() if x.upper() != "TODOS"])
+        unique_diametros = indice_varillas().diametros
+        version = indices.paquete_opciones("varillas")["version"]
     except Exception as e:
         return f"Error al cargar el Excel: {e}"
     if request.method == "POST":
@@ -619,70 +745,43 @@ def flujo_e_seleccion():
         if not selected:
             return "Selecciona al menos un DIÁMETRO.", 400
         diametros_str = ",".join(selected)
+        if request.form.get("cascada"):
+            all_filters = {
+                diam: flujos.filtros_varillas(
+                    request.form.getlist(f"tipo_{diam}"),
+                    request.form.get(f"acero_{diam}", ""),
+                    request.form.get(f"acero_cup_{diam}", ""),
+                    request.form.get(f"tipo_cup_{diam}", ""),
+                )
+                for diam in selected
+            }
+            return redirect(url_for("flujo_e_cantidades", diametros=diametros_str, filtros=json.dumps(all_filters)))
         return redirect(url_for("flujo_e_filtros", diametros=diametros_str))
     else:
-        return render_template("flujo_e_seleccion.html", unique_diametros=unique_diametros)
+        return render_template("flujo_e_seleccion.html", unique_diametros=unique_diametros,
+                               paquete_url=url_for("paquete_opciones", clave="varillas", v=version))
 
 @app.route("/flujo_e/filtros", methods=["GET", "POST"])
 def flujo_e_filtros():
     diametros_str = request.args.get("diametros", "")
     selected_diametros = diametros_str.split(",") if diametros_str else []
     try:
-        file_path = os.path.join(BASE_DIR, "baja varillas.xlsx")
-        df = pd.read_excel(file_path)
-        df.columns = df.columns.str.strip()
-        df["DIÁMETRO"] = df["DIÁMETRO"].astype(str).str.strip()
+        indice = indice_varillas()
     except Exception as e:
         return f"Error al cargar el Excel: {e}"
     # Para cada DIÁMETRO, se obtienen las opciones para los filtros en cascada
-    filtros = {}
-    for diam in selected_diametros:
-        subset = df[df["DIÁMETRO"] == diam]
-        # Filtro TIPO
-        tipos = sorted([x for x in subset["TIPO"].dropna().unique() if x.upper() != "TODOS"])
-        if not tipos:
-            tipos = ["TODOS"]
-        # Filtros para otras columnas (si existen)
-        acero = sorted([x for x in subset["GRADO DE ACERO"].dropna().unique() if str(x).upper() != "TODOS"]) if "GRADO DE ACERO" in subset.columns else ["Seleccionar"]
-        acero_cup = sorted([x for x in subset["GRADO DE ACERO CUPLA"].dropna().unique() if str(x).upper() != "TODOS"]) if "GRADO DE ACERO CUPLA" in subset.columns else ["Seleccionar"]
-        tipo_cup = sorted([x for x in subset["TIPO DE CUPLA"].dropna().unique() if str(x).upper() != "TODOS"]) if "TIPO DE CUPLA" in subset.columns else ["Seleccionar"]
-        filtros[diam] = {"tipos": tipos, "acero": acero, "acero_cup": acero_cup, "tipo_cup": tipo_cup}
+    filtros = {diam: indice.opciones(diam) for diam in selected_diametros}
     if request.method == "POST":
         # Se recogen los filtros seleccionados para cada DIÁMETRO
+        # (cada valor elegido se amplía con "TODOS"; sin selección no se filtra esa columna)
         all_filters = {}
         for diam in selected_diametros:
-            # Recoger el filtro de TIPO
-            tipo_sel = request.form.getlist(f"tipo_{diam}")
-            # Si se seleccionó algún valor, se crea la lista con el valor y "TODOS"
-            if tipo_sel:
-                tipo_list = tipo_sel + ["TODOS"]
-            else:
-                # Si no se seleccionó nada, dejamos la lista vacía para indicar que no se filtra por TIPO
-                tipo_list = []
-        
-            # Repetir para las otras columnas, comparando con "" o "Seleccionar"
-            ac = request.form.get(f"acero_{diam}", "")
-            if ac and ac != "Seleccionar":
-                acero_list = [ac, "TODOS"]
-            else:
-                acero_list = []
-        
-            ac_cup = request.form.get(f"acero_cup_{diam}", "")
-            if ac_cup and ac_cup != "Seleccionar":
-                acero_cup_list = [ac_cup, "TODOS"]
-            else:
-                acero_cup_list = []
-        
-            t_cup = request.form.get(f"tipo_cup_{diam}", "")
-            if t_cup and t_cup != "Seleccionar":
-                tipo_cup_list = [t_cup, "TODOS"]
-            else:
-                tipo_cup_list = []
-        
-            all_filters[diam] = {"tipo_list": tipo_list,
-                                 "acero_list": acero_list,
-                                 "acero_cup_list": acero_cup_list,
-                                 "tipo_cup_list": tipo_cup_list}
+            all_filters[diam] = flujos.filtros_varillas(
+                request.form.getlist(f"tipo_{diam}"),
+                request.form.get(f"acero_{diam}", ""),
+                request.form.get(f"acero_cup_{diam}", ""),
+                request.form.get(f"tipo_cup_{diam}", ""),
+            )
 
         # En lugar de procesar y mostrar el resultado, redirigimos a la etapa de ingreso de cantidades
         filtros_json = json.dumps(all_filters)
@@ -697,44 +796,17 @@ def flujo_e_cantidades():
     filtros_str = request.args.get("filtros", "{}")
     all_filters = json.loads(filtros_str)
     
-    try:
-        file_path = os.path.join(BASE_DIR, "baja varillas.xlsx")
-        df = pd.read_excel(file_path)
-        df.columns = df.columns.str.strip()
-        df["DIÁMETRO"] = df["DIÁMETRO"].astype(str).str.strip()  # Aseguramos la conversión y limpieza
-        df["4.CANTIDAD"] = pd.to_numeric(df["4.CANTIDAD"], errors="coerce")
-    except Exception as e:
-        return f"Error al cargar el Excel: {e}"
-    
-    # Aplicar los filtros adicionales de cada DIÁMETRO
-    filtered_df = pd.DataFrame()
-    for diam in selected_diametros:
-        # Aquí se incluye el valor "TODOS" junto con el diámetro seleccionado
-        subset = df[df["DIÁMETRO"].isin([diam, "TODOS"])]
-        if diam in all_filters:
-            filtros_diam = all_filters[diam]
-            if filtros_diam.get("tipo_list"):
-                subset = subset[subset["TIPO"].isin(filtros_diam["tipo_list"])]
-            if "GRADO DE ACERO" in subset.columns and filtros_diam.get("acero_list"):
-                subset = subset[subset["GRADO DE ACERO"].isin(filtros_diam["acero_list"])]
-            if "GRADO DE ACERO CUPLA" in subset.columns and filtros_diam.get("acero_cup_list"):
-                subset = subset[subset["GRADO DE ACERO CUPLA"].isin(filtros_diam["acero_cup_list"])]
-            if "TIPO DE CUPLA" in subset.columns and filtros_diam.get("tipo_cup_list"):
-                subset = subset[subset["TIPO DE CUPLA"].isin(filtros_diam["tipo_cup_list"])]
-        filtered_df = pd.concat([filtered_df, subset])
-    
-   
     if request.method == "POST":
         quantities = {}
         for diam in selected_diametros:
             qty = request.form.get(f"qty_{diam}", type=float)
             quantities[diam] = qty
-        # Actualizar la columna "4.CANTIDAD" donde la celda es NaN
-        for diam, qty in quantities.items():
-            mask = (filtered_df["DIÁMETRO"] == diam) & (filtered_df["4.CANTIDAD"].isna())
-            filtered_df.loc[mask, "4.CANTIDAD"] = qty
-        final_df_renombrado = renombrar_columnas(filtered_df)
-        materiales_finales.append(("FLUJO E", final_df_renombrado))
+        # Aplica los filtros de cada DIÁMETRO y completa "4.CANTIDAD" donde la celda es NaN
+        try:
+            final_df_renombrado = flujos.flujo_e(selected_diametros, all_filters, quantities)
+        except Exception as e:
+            return f"Error al cargar el Excel: {e}"
+        agregar_material("FLUJO E", final_df_renombrado)
         # No se muestra la lista aquí; se guarda para la consolidación final
         return redirect(url_for("flujo_h"))
     else:
@@ -765,23 +837,19 @@ def flujo_f_decidir():
 # Ruta para configurar los filtros (DIÁMETRO y DIÁMETRO CSG)
 @app.route("/flujo_f/filtros", methods=["GET", "POST"])
 def flujo_f_filtros():
-    file_path = os.path.join(BASE_DIR, "abandono-recupero.xlsx")
     try:
-        df = pd.read_excel(file_path)
-        df.columns = df.columns.str.strip()
+        opciones = indices.opciones_abandono()
     except Exception as e:
         return f"Error al cargar el Excel: {e}"
     # Verificar que existan las columnas requeridas
-    if "DIÁMETRO" not in df.columns:
+    if opciones["diametros"] is None:
         return "La columna 'DIÁMETRO' no se encontró en el Excel."
-    if "DIÁMETRO CSG" not in df.columns:
+    if opciones["diacsg"] is None:
         return "La columna 'DIÁMETRO CSG' no se encontró en el Excel."
-    # Construir opciones internas (con "TODOS") y opciones para mostrar (sin "TODOS")
-    all_diametros = list(df["DIÁMETRO"].dropna().unique())
-    opciones_diam = [d for d in all_diametros if d.upper() != "TODOS"]
-    # Para el filtrado interno se usa "TODOS" (si no se selecciona nada, se asume "TODOS")
-    all_diametros_csg = list(df["DIÁMETRO CSG"].dropna().unique())
-    opciones_diacsg = [d for d in all_diametros_csg if d.upper() != "TODOS"]
+    # Opciones para mostrar (sin "TODOS"); para el filtrado interno se usa
+    # "TODOS" (si no se selecciona nada, se asume "TODOS")
+    opciones_diam = opciones["diametros"]
+    opciones_diacsg = opciones["diacsg"]
     
     if request.method == "POST":
         selected_diametros = request.form.getlist("diametros")
@@ -812,24 +880,17 @@ def flujo_f_cantidades():
     selected_diametros = diametros_str.split(",") if diametros_str else []
     display_diametros = [d for d in selected_diametros if d.upper() != "TODOS"]
     filtros_json = request.args.get("filtros", "{}")
-    # Para este flujo se usará el Excel "abandono-recupero.xlsx"
-    file_path = os.path.join(BASE_DIR, "abandono-recupero.xlsx")
-    try:
-        df = pd.read_excel(file_path)
-        df.columns = df.columns.str.strip()
-    except Exception as e:
-        return f"Error al cargar el Excel: {e}"
     if request.method == "POST":
         quantities = {}
         for diam in display_diametros:
             qty = request.form.get(f"qty_{diam}", type=float)
             quantities[diam] = qty
-        filtered_df = df[df["DIÁMETRO"].isin(selected_diametros)]
-        for diam, qty in quantities.items():
-            mask = (filtered_df["DIÁMETRO"] == diam) & (filtered_df["4.CANTIDAD"].isna())
-            filtered_df.loc[mask, "4.CANTIDAD"] = qty
-        final_df_renombrado = renombrar_columnas(filtered_df)
-        materiales_finales.append(("FLUJO F", final_df_renombrado))
+        # Para este flujo se usará el Excel "abandono-recupero.xlsx"
+        try:
+            final_df_renombrado = flujos.flujo_f(selected_diametros, quantities)
+        except Exception as e:
+            return f"Error al cargar el Excel: {e}"
+        agregar_material("FLUJO F", final_df_renombrado)
         # En lugar de imprimir, se guarda para consolidar al final
         return redirect(url_for("flujo_g"))
     else:
@@ -844,14 +905,12 @@ def flujo_g():
     if request.method == "POST":
         wo = request.form.get("wo")
         if wo == "SI":
-            file_path = os.path.join(BASE_DIR, "WO.xlsx")
             try:
-                df = pd.read_excel(file_path)
+                df_renombrado = flujos.flujo_g()
             except Exception as e:
                 return f"Error al cargar Excel: {e}"
-            df_renombrado = renombrar_columnas(df)
             # Solo almacenamos los materiales, sin imprimirlos aún
-            materiales_finales.append(("FLUJO G", df_renombrado))
+            agregar_material("FLUJO G", df_renombrado)
             # Redirigimos al flujo H para continuar el proceso
             return redirect(url_for("flujo_h"))
         elif wo == "NO":
@@ -881,27 +940,25 @@ def flujo_h_decidir():
     else:
         return "Selecciona una opción.", 400
 
-@app.route("/flujo_h/seleccion", methods=["GET", "POST"])
-def flujo_h_seleccion():
-    file_path_H = os.path.join(BASE_DIR, "GENERAL(1).xlsx")
+def _buscar_materiales():
+    return indices.busqueda_general().buscar(
+        request.args.get("q", ""),
+        pagina=request.args.get("pagina", 1, type=int),
+        por_pagina=request.args.get("por_pagina", busqueda.POR_PAGINA, type=int),
+    )
+
+
+# Búsqueda de materiales de GENERAL(1).xlsx (ver busqueda.py)
+@app.route("/flujo_h/buscar")
+def flujo_h_buscar():
     try:
-        df_H = pd.read_excel(file_path_H)
-        df_H.columns = df_H.columns.str.strip()
-        # Si no existe la columna "4.CANTIDAD", se crea con 0
-        if "4.CANTIDAD" not in df_H.columns:
-            df_H["4.CANTIDAD"] = 0
-        else:
-            df_H["4.CANTIDAD"] = pd.to_numeric(df_H["4.CANTIDAD"], errors="coerce")
+        return jsonify(_buscar_materiales())
     except Exception as e:
-        return f"Error al cargar el Excel: {e}"
-    
-    # Extraer la lista de materiales de la columna "2. MATERIAL"
-    if "2. MATERIAL" in df_H.columns:
-        materiales = df_H["2. MATERIAL"].astype(str).unique().tolist()
-    else:
-        materiales = []
-    # Se genera la tabla HTML para que el usuario la consulte (opcional)
-    #df_html = df_H.to_html(classes="table table-bordered", index=False)
+        return jsonify({"error": f"Error al cargar el Excel: {e}"}), 500
+
+
+@app.route("/flujo_h/seleccion", methods=["GET", "POST"])
+def flujo_h_seleccion():
     if request.method == "POST":
         seleccionados = request.form.getlist("materiales")
         if not seleccionados:
@@ -909,40 +966,32 @@ def flujo_h_seleccion():
         seleccion_str = ",".join(seleccionados)
         return redirect(url_for("flujo_h_cantidades", materiales=seleccion_str))
     else:
-        return render_template("flujo_h_seleccion.html", materiales=materiales)
+        # Sin JavaScript, la búsqueda se hace con el mismo formulario (?q=...&pagina=N)
+        try:
+            resultado = _buscar_materiales()
+        except Exception as e:
+            return f"Error al cargar el Excel: {e}"
+        return render_por_bloques("flujo_h_seleccion.html", busqueda=resultado)
 
 @app.route("/flujo_h/cantidades", methods=["GET", "POST"])
 def flujo_h_cantidades():
     materiales_str = request.args.get("materiales", "")
     seleccionados = materiales_str.split(",") if materiales_str else []
-    file_path_H = os.path.join(BASE_DIR, "GENERAL(1).xlsx")
-    try:
-        df_H = pd.read_excel(file_path_H)
-        df_H.columns = df_H.columns.str.strip()
-        # Crear o convertir la columna "4.CANTIDAD"
-        if "4.CANTIDAD" not in df_H.columns:
-            df_H["4.CANTIDAD"] = 0
-        else:
-            df_H["4.CANTIDAD"] = pd.to_numeric(df_H["4.CANTIDAD"], errors="coerce")
-    except Exception as e:
-        return f"Error al cargar el Excel: {e}"
     if request.method == "POST":
         quantities = {}
         for mat in seleccionados:
             qty = request.form.get(f"qty_{mat}", type=float)
             quantities[mat] = qty
-        # Actualizamos el DataFrame: para cada material seleccionado, asignar la cantidad en filas sin valor
-        for mat, qty in quantities.items():
-            mask = (df_H["2. MATERIAL"].astype(str) == mat) & ((df_H["4.CANTIDAD"].isna()) | (df_H["4.CANTIDAD"] <= 0))
-            df_H.loc[mask, "4.CANTIDAD"] = qty
-        # Filtramos solo los materiales con cantidad mayor que 0
-        assigned_df = df_H[df_H["2. MATERIAL"].astype(str).isin(seleccionados) & (df_H["4.CANTIDAD"] > 0)]
-        if not assigned_df.empty:
-            assigned_df_renombrado = renombrar_columnas(assigned_df)
-            # Guardamos el resultado del Flujo H en la variable global
-            materiales_finales.append(("FLUJO H", assigned_df_renombrado))
+        # Para cada material seleccionado se asigna la cantidad y se conservan los que quedan con cantidad > 0
+        try:
+            assigned_df_renombrado = flujos.flujo_h(quantities)
+        except Exception as e:
+            return f"Error al cargar el Excel: {e}"
+        if assigned_df_renombrado is not None:
+            # Guardamos el resultado del Flujo H en la sesión
+            agregar_material("FLUJO H", assigned_df_renombrado)
         else:
-            print("No se asignaron cantidades (o todas fueron 0).")
+            return redirect(url_for("flujo_final", aviso="flujo_h_sin_cantidades"))
         return redirect(url_for("flujo_final"))
     else:
         if not seleccionados:
@@ -956,26 +1005,8 @@ def flujo_i():
     if request.method == "POST":
         valv = request.form.get("valvulas")
         if valv == "SI":
-            # agregamos las dos filas al global materiales_finales
-            rows = [
-                {
-                  "Cód.SAP":    "1000578615",
-                  "MATERIAL":   "VÁLVULA RETENCIÓN",
-                  "Descripción":"V.RET. 2\" NPTHH DURALIT.302009",
-                  "4.CANTIDAD": 2,
-                  "CONDICIÓN":  "NUEVO"
-                },
-                {
-                  "Cód.SAP":    "230100395",
-                  "MATERIAL":   "VÁLVULA",
-                  "Descripción":"V.ESF.ROS.2\" NPT  2000 A105/316   PT PAL",
-                  "4.CANTIDAD": 2,
-                  "CONDICIÓN":  "NUEVO"
-                }
-            ]
-            df_valv = pd.DataFrame(rows)
-            # renombrar columnas según tu helper y añadir flujo
-            materiales_finales.append(("FLUJO I", renombrar_columnas(df_valv)))
+            # agregamos las dos filas a los materiales de la sesión
+            agregar_material("FLUJO I", flujos.flujo_i())
         # cualquiera que sea la respuesta, vamos al flujo final
         return redirect(url_for("flujo_final"))
     # GET → renderizamos el formulario de Flujo I
@@ -984,10 +1015,72 @@ def flujo_i():
 # ===================================
 # FLUJO FINAL: Resultados Consolidados
 # ===================================
+# Filas del consolidado desde las que el botón de exportar de flujo_final usa
+# un trabajo en segundo plano (ver trabajos.py) en vez de /export_excel
+FILAS_EXPORTACION_EN_SEGUNDO_PLANO = 10000
+
+# Avisos que un flujo deja para flujo_final (?aviso=<clave>), sin estado en el servidor
+AVISOS = {
+    "flujo_h_sin_cantidades": "Flujo H: no se asignaron cantidades (o todas fueron 0); no se agregó ningún material.",
+}
+
+
 @app.route("/flujo_final", methods=["GET"])
 def flujo_final():
-    
-    return render_template("flujo_final.html", materiales_finales=materiales_finales)
+    # Sólo se muestra la primera página de cada tabla
+    lista = sesion_actual()["resultados"]
+    try:
+        tablas = [(r.flujo, _paginas_html(r)) for r in lista]
+        # Sólo una lista grande se exporta como trabajo en segundo plano; el
+        # resto usa la descarga directa (y su caché por ETag)
+        en_segundo_plano = len(consolidado_sesion(lista)) >= FILAS_EXPORTACION_EN_SEGUNDO_PLANO
+    except resultados.ResultadoVencido as e:
+        return str(e), 409
+    return render_por_bloques("flujo_final.html", tablas=tablas, en_segundo_plano=en_segundo_plano,
+                              aviso=AVISOS.get(request.args.get("aviso")))
+
+
+@app.route("/flujo_final/tabla/<int:indice>", methods=["GET"])
+def flujo_final_tabla(indice):
+    # Fragmento HTML con una página de la tabla del resultado `indice`
+    pagina = request.args.get("pagina", 1, type=int)
+    lista = sesion_actual()["resultados"]
+    if not 0 <= indice < len(lista):
+        return "Página no encontrada.", 404
+    try:
+        paginas = _paginas_html(lista[indice])
+    except resultados.ResultadoVencido as e:
+        return str(e), 409
+    if not 1 <= pagina <= len(paginas):
+        return "Página no encontrada.", 404
+    return paginas[pagina - 1]
+
+#====================================
+# API: lista de materiales en un solo paso
+#====================================
+
+def _registros(df):
+    # to_json convierte NaN en null y los tipos de numpy en tipos JSON
+    return json.loads(df.to_json(orient="records", force_ascii=False))
+
+
+@app.route("/api/materiales", methods=["POST"])
+def api_materiales():
+    spec = request.get_json(silent=True)
+    if spec is None:
+        return jsonify({"error": "Se esperaba un cuerpo JSON."}), 400
+    try:
+        resultados = flujos.calcular_materiales(spec)
+    except flujos.EspecificacionInvalida as e:
+        return jsonify({"error": str(e)}), 400
+    except CatalogoInvalido as e:
+        return jsonify({"error": f"Error al cargar el Excel: {e}"}), 500
+    except Exception as e:
+        return jsonify({"error": f"Error al calcular los materiales: {type(e).__name__}: {e}"}), 500
+    return jsonify({
+        "flujos": [{"flujo": flujo, "materiales": _registros(df)} for flujo, df in resultados],
+        "consolidado": _registros(flujos.consolidar(resultados)) if resultados else [],
+    })
 
 #====================================
 # EXPORTAR AL EXCEL
@@ -995,52 +1088,194 @@ def flujo_final():
 
 @app.route("/export_excel")
 def export_excel():
-    import io
-    from flask import send_file
-
-    # 1) Combina todos los DataFrames en uno solo, añadiendo la columna "Flujo"
-    combined_df = pd.concat(
-        [df.assign(Flujo=flow) for flow, df in materiales_finales],
-        ignore_index=True
+    # ?formato=xlsx (default) | csv | tsv; ?por_flujo=1 agrega una hoja por flujo al xlsx
+    formato = request.args.get("formato", "xlsx")
+    if formato not in exportar.FORMATOS:
+        return "Formato de exportación no soportado.", 400
+    por_flujo = request.args.get("por_flujo") in ("1", "si", "SI", "true")
+
+    # 1-3) El consolidado (flujos combinados, sin duplicados y con "4.CANTIDAD"
+    #      sumada) ya está en la sesión: se actualiza al guardar cada flujo
+    lista = sesion_actual()["resultados"]
+    clave = exportar.huella(lista)
+    etag = f"{clave}-{formato}{'-f' if por_flujo and formato == 'xlsx' else ''}"
+    if request.if_none_match.contains(etag):
+        return app.response_class(status=304, headers={"ETag": f'"{etag}"'})
+    try:
+        grouped = consolidado_sesion(lista).tabla
+        por_hoja = [(r.flujo, r.materializar()) for r in lista] if por_flujo and formato == "xlsx" else None
+    except resultados.ResultadoVencido as e:
+        return str(e), 409
+
+    # 4) Genera el archivo por bloques, sin armarlo entero en memoria
+    #    (o reutiliza el ya generado para la misma lista)
+    if formato == "xlsx":
+        cuerpo = cache_exportaciones.archivo(etag, lambda: metricas.medir_bloques(
+            "exportar", lambda: exportar.generar_xlsx(grouped, por_hoja)
+        ))
+    else:
+        separador = "," if formato == "csv" else "\t"
+        cuerpo = cache_exportaciones.archivo(etag, lambda: metricas.medir_bloques(
+            "exportar", lambda: exportar.generar_csv(grouped, separador)
+        ))
+
+    # 5) Envía el archivo al usuario a medida que se genera
+    mimetype, extension = exportar.FORMATOS[formato]
+    response = app.response_class(
+        cuerpo,
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=materiales_consolidados.{extension}"},
     )
+    response.set_etag(etag)
+    # El navegador puede guardar la descarga pero debe revalidarla con el ETag
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
 
-    # 2) Elimina duplicados según los campos clave (sin considerar "Flujo" ni "4.CANTIDAD")
-    deduped_df = combined_df.drop_duplicates(
-        subset=["Cód.SAP", "MATERIAL", "Descripción", "4.CANTIDAD", "CONDICIÓN"],
-        keep="last"
+#====================================
+# EXPORTACIONES EN SEGUNDO PLANO (ver trabajos.py)
+#====================================
+# POST /exportaciones lanza la exportación de la lista de la sesión (mismos
+# parámetros que /export_excel) y POST /exportaciones/lote la de una campaña
+# (cuerpo JSON como el de lote.py); ambas responden 202 con el id. El estado
+# se consulta en /exportaciones/<id> y el archivo terminado se descarga de
+# /exportaciones/<id>/archivo. Sólo la sesión que creó un trabajo lo ve.
+
+def _respuesta_trabajo(id_trabajo):
+    return jsonify({
+        "id": id_trabajo,
+        "estado_url": url_for("estado_exportacion", id_trabajo=id_trabajo),
+        "archivo_url": url_for("archivo_exportacion", id_trabajo=id_trabajo),
+    }), 202
+
+
+@app.route("/exportaciones", methods=["POST"])
+def crear_exportacion():
+    formato = request.values.get("formato", "xlsx")
+    if formato not in exportar.FORMATOS:
+        return jsonify({"error": "Formato de exportación no soportado."}), 400
+    por_flujo = request.values.get("por_flujo") in ("1", "si", "SI", "true") and formato == "xlsx"
+    lista = sesion_actual()["resultados"]
+    try:
+        consolidado = consolidado_sesion(lista).tabla
+        por_hoja = [(r.flujo, r.materializar()) for r in lista] if por_flujo else None
+    except resultados.ResultadoVencido as e:
+        return jsonify({"error": str(e)}), 409
+    mimetype, _ = exportar.FORMATOS[formato]
+    return _respuesta_trabajo(trabajos.crear_exportacion(g.sesion_token, formato, mimetype, consolidado, por_hoja))
+
+
+@app.route("/exportaciones/lote", methods=["POST"])
+def crear_exportacion_lote():
+    datos = request.get_json(silent=True)
+    if datos is None:
+        return jsonify({"error": "Se esperaba un cuerpo JSON."}), 400
+    try:
+        pozos = lote.especificaciones(datos)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    mimetype, _ = exportar.FORMATOS["xlsx"]
+    return _respuesta_trabajo(trabajos.crear_lote(g.sesion_token, pozos, mimetype))
+
+
+@app.route("/exportaciones/<id_trabajo>")
+def estado_exportacion(id_trabajo):
+    estado = trabajos.consultar(id_trabajo, g.sesion_token)
+    if estado is None:
+        return jsonify({"error": "Exportación inexistente o vencida."}), 404
+    datos = trabajos.publico(estado)
+    if estado["estado"] == trabajos.LISTO:
+        datos["archivo_url"] = url_for("archivo_exportacion", id_trabajo=id_trabajo)
+    response = jsonify(datos)
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+
+@app.route("/exportaciones/<id_trabajo>/archivo")
+def archivo_exportacion(id_trabajo):
+    estado = trabajos.consultar(id_trabajo, g.sesion_token)
+    if estado is None:
+        return "Exportación inexistente o vencida.", 404
+    if estado["estado"] != trabajos.LISTO:
+        return f"La exportación todavía no está lista ({estado['estado']}).", 409
+    response = send_file(
+        trabajos.archivo(estado),
+        mimetype=estado["mimetype"],
+        as_attachment=True,
+        download_name=estado["nombre_descarga"],
+        conditional=True,
     )
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
 
-    # 3) Agrupa sobre ese resultado y suma "4.CANTIDAD", tomando también el último "Flujo"
-    grouped = (
-        deduped_df
-        .groupby(
-            ["Cód.SAP", "MATERIAL", "Descripción", "CONDICIÓN"],
-            as_index=False,
-            dropna=False
-        )
-        .agg({
-            "4.CANTIDAD": "sum",
-            "Flujo":      "last"
-        })
-    )
+#====================================
+# API: Cód.SAP en todos los catálogos (ver sap.py)
+#====================================
+# /api/sap/<codigo> devuelve sus filas (material, descripción, condición,
+# cantidad y filtros) y /api/sap/<codigo>/flujos qué flujos lo incluyen y con
+# qué condiciones y selecciones.
 
-    # 4) Prepara el buffer de Excel
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        grouped.to_excel(
-            writer,
-            sheet_name="Materiales Consolidados",
-            index=False
-        )
-    output.seek(0)
-
-    # 5) Envía el archivo al usuario
-    return send_file(
-        output,
-        attachment_filename="materiales_consolidados.xlsx",
-        as_attachment=True,
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
+@app.route("/api/sap/<codigo>")
+def api_sap(codigo):
+    try:
+        encontrado = sap.buscar(codigo)
+    except Exception as e:
+        return jsonify({"error": f"Error al cargar el Excel: {e}"}), 500
+    if encontrado is None:
+        return jsonify({"error": f"El Cód.SAP {codigo} no aparece en ningún catálogo."}), 404
+    return jsonify(encontrado)
+
+
+@app.route("/api/sap/<codigo>/flujos")
+def api_sap_flujos(codigo):
+    try:
+        usos = sap.flujos_que_usan(codigo)
+    except Exception as e:
+        return jsonify({"error": f"Error al cargar el Excel: {e}"}), 500
+    if usos is None:
+        return jsonify({"error": f"El Cód.SAP {codigo} no aparece en ningún catálogo."}), 404
+    return jsonify(usos)
+
+#====================================
+# MÉTRICAS (formato de texto de Prometheus)
+#====================================
+
+@app.route("/metrics")
+def metrics():
+    return app.response_class(metricas.exposicion(), mimetype="text/plain; version=0.0.4")
+
+
+# Paquete de opciones de la cascada de los Flujos A y E (ver indices.py). Con
+# la versión vigente en la URL se guarda en el navegador por un año; sin ella,
+# o con otra, se revalida con el ETag.
+@app.route("/opciones/<clave>.json")
+def paquete_opciones(clave):
+    if clave not in indices.PAQUETES:
+        return "Paquete de opciones inexistente.", 404
+    try:
+        paquete = indices.paquete_opciones(clave)
+    except Exception as e:
+        return jsonify({"error": f"Error al cargar el Excel: {e}"}), 500
+    comprimido = "gzip" in request.accept_encodings
+    response = app.response_class(paquete["gzip"] if comprimido else paquete["json"], mimetype="application/json")
+    if comprimido:
+        response.headers["Content-Encoding"] = "gzip"
+    response.headers["Vary"] = "Accept-Encoding"
+    response.set_etag(f"{paquete['version']}{'-gz' if comprimido else ''}")
+    if request.args.get("v") == paquete["version"]:
+        response.headers["Cache-Control"] = "private, max-age=31536000, immutable"
+    else:
+        response.headers["Cache-Control"] = "private, no-cache"
+    return response.make_conditional(request)
+
+
+# Readiness: 503 hasta que terminó el precalentamiento (ver arranque.py)
+@app.route("/ready")
+def ready():
+    estado = arranque.estado_precalentamiento()
+    return jsonify(estado), 200 if estado["listo"] else 503
+
+
+arranque.iniciar_precalentamiento(app)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,303 @@
+import gc
+import importlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+
+# ===================================
+# Arranque liviano: imports pesados a demanda
+# ===================================
+# pandas, numpy, openpyxl y xlsxwriter se importan recién cuando una ruta los
+# usa por primera vez. Los módulos de datos los declaran con
+#   pd = importar_perezoso("pandas")
+# y el proxy carga el módulo real en el primer acceso a un atributo (con un
+# lock, así dos threads no lo cargan a la vez). Después copia los atributos
+# del módulo, de modo que los accesos siguientes no pasan por __getattr__.
+#
+# Las rutas que sólo deciden (SI/NO) no tocan datos y no cargan pandas. Las
+# páginas de selección se sirven del snapshot de opciones (ver indices.py)
+# sin pandas mientras el snapshot esté vigente.
+#
+# `python arranque.py` mide el arranque de un worker en procesos nuevos: import
+# de la app, primer request de decisión, de selección, de datos y exportación,
+# con el RSS y los módulos pesados cargados en cada paso (sin precalentamiento,
+# ver más abajo). Con --workers mide
+# además la memoria propia de cada worker con y sin catálogos compartidos.
+
+MODULOS_PESADOS = ("pandas", "numpy", "openpyxl", "xlsxwriter")
+
+
+class _ModuloPerezoso(types.ModuleType):
+    def __init__(self, nombre):
+        super().__init__(nombre)
+        self.__dict__["_lock_carga"] = threading.Lock()
+
+    def __getattr__(self, atributo):
+        with self.__dict__["_lock_carga"]:
+            modulo = importlib.import_module(self.__name__)
+            self.__dict__.update(
+                (k, v) for k, v in modulo.__dict__.items() if k not in ("__name__", "__spec__", "__loader__")
+            )
+        return getattr(modulo, atributo)
+
+
+def importar_perezoso(nombre):
+    """Módulo `nombre` que se importa recién al usar uno de sus atributos."""
+    if nombre in sys.modules:
+        return sys.modules[nombre]
+    return _ModuloPerezoso(nombre)
+
+
+def cargados():
+    return [nombre for nombre in MODULOS_PESADOS if nombre in sys.modules]
+
+
+# ===================================
+# Precalentamiento
+# ===================================
+# Al importar la app se lanza en un thread aparte la carga de todos los
+# catálogos, cada uno con sus índices, opciones, bitmaps de reglas y Cód.SAP, y la
+# compilación de las plantillas Jinja. Los libros se procesan en paralelo en
+# un pool de threads (cada catálogo tiene su propio lock de lectura). /ready
+# responde 503 hasta que termina, así el primer request real ya encuentra
+# todo en memoria. BM_PRECALENTAR=0 lo desactiva: los catálogos se cargan en
+# el primer uso, como antes, y /ready responde 200 desde el arranque.
+
+PRECALENTAR = os.environ.get("BM_PRECALENTAR", "1") != "0"
+HILOS_PRECALENTAR = int(os.environ.get("BM_PRECALENTAR_HILOS", 4))
+
+_listo = threading.Event()
+_lock_precalentar = threading.Lock()
+_hilo = None
+_resultado = {"segundos": None, "errores": []}
+
+
+def _calentar_catalogo(nombre):
+    import catalogo
+    import indices
+    import sap
+    import seleccion
+
+    catalogo.cargar_catalogo(nombre)
+    for clave in indices.OPCIONES.get(nombre, {}):
+        indices.opciones_catalogo(nombre, clave)
+    if nombre in seleccion.COLUMNAS_REGLAS:
+        seleccion.indice_reglas(nombre)
+    sap.indice_catalogo(nombre)
+
+
+def precalentar(app=None, hilos=HILOS_PRECALENTAR):
+    """Carga catálogos y derivados en paralelo y compila las plantillas de `app`."""
+    import catalogo
+
+    inicio = time.perf_counter()
+    errores = []
+    with ThreadPoolExecutor(max_workers=hilos) as pool:
+        tareas = {pool.submit(_calentar_catalogo, nombre): nombre for nombre in catalogo.CATALOGOS}
+        for tarea, nombre in tareas.items():
+            try:
+                tarea.result()
+            except Exception as e:
+                # El catálogo se vuelve a intentar (y se reporta) al pedirlo
+                errores.append(f"{nombre}: {e}")
+    if app is not None:
+        for plantilla in app.jinja_env.list_templates():
+            app.jinja_env.get_template(plantilla)
+    _resultado["segundos"] = round(time.perf_counter() - inicio, 3)
+    _resultado["errores"] = errores
+    _listo.set()
+    return errores
+
+
+def iniciar_precalentamiento(app):
+    global _hilo
+    if not PRECALENTAR:
+        _listo.set()
+        return
+    with _lock_precalentar:
+        if _hilo is None:
+            _hilo = threading.Thread(target=precalentar, args=(app,), name="precalentar", daemon=True)
+            _hilo.start()
+
+
+def esperar_precalentamiento(timeout=None):
+    return _listo.wait(timeout)
+
+
+def listo():
+    return _listo.is_set()
+
+
+def estado_precalentamiento():
+    return {"listo": listo(), **_resultado}
+
+
+# ===================================
+# Catálogos compartidos entre workers
+# ===================================
+# Con gunicorn.conf.py (preload_app) la app se importa en el master y
+# precargar() espera ahí al precalentamiento, antes de crear los workers. Los
+# workers heredan catálogos, índices, opciones y plantillas por fork y las
+# páginas se comparten copy-on-write mientras nadie las escriba.
+#
+# Lo que más las ensucia es el recolector de ciclos: cada pasada escribe en el
+# encabezado de todos los objetos rastreados, y eso copia la página entera en
+# cada worker. gc.freeze() mueve todo lo cargado a una generación permanente
+# que el recolector no recorre. Los buffers numéricos de numpy no tienen
+# refcount y no se tocan nunca; en las columnas de texto sólo se copian las
+# páginas de los strings que un request efectivamente lee.
+#
+# Si un xlsx cambia, el worker que lo detecta carga su propia copia (como
+# siempre); la compartida vuelve con el próximo reinicio de gunicorn.
+
+def precargar(app=None):
+    """Termina el precalentamiento (o lo corre acá si está desactivado) y congela el GC."""
+    if _hilo is not None:
+        esperar_precalentamiento()
+    else:
+        precalentar(app)
+    gc.collect()
+    gc.freeze()
+    return _resultado["errores"]
+
+
+# ===================================
+# Informe de arranque
+# ===================================
+
+_MEDICION = r"""
+import json, resource, sys, time
+inicio = time.perf_counter()
+import app as app_modulo
+pasos = []
+
+def paso(nombre, inicio):
+    pasos.append({
+        "paso": nombre,
+        "ms": round((time.perf_counter() - inicio) * 1000, 1),
+        "rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "cargados": [m for m in ("pandas", "numpy", "openpyxl", "xlsxwriter") if m in sys.modules],
+    })
+
+paso("import app", inicio)
+cliente = app_modulo.app.test_client()
+for nombre, metodo, url, datos in [
+    ("decisión (POST /flujo_b NO)", "post", "/flujo_b", {"saca_tubing": "NO"}),
+    ("selección (GET /flujo_e/seleccion)", "get", "/flujo_e/seleccion", None),
+    ("selección (GET /flujo_h/seleccion)", "get", "/flujo_h/seleccion", None),
+    ("datos (POST /flujo_g SI)", "post", "/flujo_g", {"wo": "SI"}),
+    ("exportación (GET /export_excel)", "get", "/export_excel", None),
+]:
+    inicio = time.perf_counter()
+    respuesta = getattr(cliente, metodo)(url, data=datos) if datos else getattr(cliente, metodo)(url)
+    respuesta.get_data()
+    paso(nombre, inicio)
+print(json.dumps(pasos))
+"""
+
+
+# Cada worker recorre todos los catálogos y reporta su memoria según
+# /proc/self/smaps_rollup: "privada" es lo que no comparte con nadie (lo que
+# suma un worker más) y PSS reparte lo compartido entre quienes lo usan.
+_MEDICION_WORKERS = r"""
+import json, os, sys
+import app as app_modulo
+import arranque, catalogo
+
+compartir, workers = sys.argv[1] == "1", int(sys.argv[2])
+if compartir:
+    arranque.precargar(app_modulo.app)
+
+def memoria():
+    campos = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for linea in f:
+            partes = linea.split()
+            if len(partes) == 3 and partes[2] == "kB":
+                campos[partes[0].rstrip(":")] = int(partes[1])
+    return {
+        "privada_mb": round((campos["Private_Clean"] + campos["Private_Dirty"]) / 1024, 1),
+        "pss_mb": round(campos["Pss"] / 1024, 1),
+        "rss_mb": round(campos["Rss"] / 1024, 1),
+    }
+
+def trabajar():
+    cliente = app_modulo.app.test_client()
+    for url in ("/flujo_a", "/flujo_c/seleccion", "/flujo_d/seleccion", "/flujo_e/seleccion",
+                "/flujo_f/filtros", "/flujo_h/seleccion"):
+        cliente.get(url).get_data()
+    cliente.post("/flujo_g", data={"wo": "SI"})
+    cliente.get("/export_excel").get_data()
+    for nombre in catalogo.CATALOGOS:
+        catalogo.cargar_catalogo(nombre).to_html()
+
+lectores = []
+for _ in range(workers):
+    lectura, escritura = os.pipe()
+    if os.fork() == 0:
+        os.close(lectura)
+        trabajar()
+        with os.fdopen(escritura, "w") as f:
+            f.write(json.dumps(memoria()))
+        os._exit(0)
+    os.close(escritura)
+    lectores.append(lectura)
+# Los workers terminan uno por uno recién cuando todos midieron, así el PSS
+# refleja las páginas compartidas entre todos
+resultados = []
+for lectura in lectores:
+    with os.fdopen(lectura) as f:
+        resultados.append(json.loads(f.read()))
+    os.wait()
+print(json.dumps(resultados))
+"""
+
+
+def medir_workers(workers, compartir=True):
+    salida = subprocess.run(
+        [sys.executable, "-c", _MEDICION_WORKERS, "1" if compartir else "0", str(workers)],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=dict(os.environ, BM_PRECALENTAR="0"),
+        capture_output=True, text=True, check=True,
+    )
+    return json.loads(salida.stdout.strip().splitlines()[-1])
+
+
+def medir_arranque(snapshot_opciones=True):
+    entorno = dict(os.environ, BM_OPCIONES_SNAPSHOT="1" if snapshot_opciones else "0", BM_PRECALENTAR="0")
+    salida = subprocess.run(
+        [sys.executable, "-c", _MEDICION],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=entorno, capture_output=True, text=True, check=True,
+    )
+    return json.loads(salida.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Mide el arranque y la memoria de los workers.")
+    parser.add_argument("--workers", default=None,
+                        help="cantidades de workers separadas por coma, p. ej. 1,2,4 (mide memoria)")
+    args = parser.parse_args()
+
+    for snapshot in (True, False):
+        print(f"\nSnapshot de opciones: {'sí' if snapshot else 'no'}")
+        print(f"{'paso':<38} {'ms':>8} {'RSS MB':>8}  módulos cargados")
+        for paso in medir_arranque(snapshot):
+            print(f"{paso['paso']:<38} {paso['ms']:>8.1f} {paso['rss_mb']:>8.1f}  {', '.join(paso['cargados']) or '-'}")
+
+    if args.workers:
+        print(f"\n{'workers':>7} {'compartidos':>12} {'privada MB':>11} {'PSS MB':>8} {'RSS MB':>8}  (promedio por worker)")
+        for workers in [int(n) for n in args.workers.split(",")]:
+            for compartir in (True, False):
+                medidas = medir_workers(workers, compartir)
+                promedio = {k: sum(m[k] for m in medidas) / len(medidas) for k in medidas[0]}
+                print(f"{workers:>7} {'sí' if compartir else 'no':>12} {promedio['privada_mb']:>11.1f} "
+                      f"{promedio['pss_mb']:>8.1f} {promedio['rss_mb']:>8.1f}")
@@ -0,0 +1,419 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from urllib.parse import urlencode
+
+import pandas as pd
+
+import catalogo
+import exportar
+import flujos
+from busqueda import IndiceBusqueda
+from catalogo import CATALOGOS
+from indices import NIVELES_AJUSTE, TODOS, IndiceCascada, IndiceTubing, IndiceVarillas
+from indices import indice_ajuste, indice_tubing, indice_varillas
+from seleccion import COLUMNAS_REGLAS, IndiceReglas
+
+
+# ===================================
+# Benchmarks de los flujos y de la exportación
+# ===================================
+# Uso:
+#   python benchmark.py [--escalas 1,10,100,1000] [--repeticiones 5] [--salida benchmark.json]
+#   python benchmark.py --comparar base.json [--actual nuevo.json] [--tolerancia 0.25]
+#
+# La escala 1 usa los libros de materiales/. Para las demás se escriben en un
+# directorio temporal catálogos sintéticos: cada libro repetido N veces, con
+# Cód.SAP y MATERIAL distintos en cada copia (las columnas de filtro no
+# cambian, así que las selecciones devuelven N veces más filas). Por escala
+# se mide:
+#   - excel:   lectura y normalización de cada xlsx (leer_catalogo_excel)
+#   - indices: construcción de los índices de opciones y de reglas
+#   - directo: funciones de flujos.py, consolidar y generación de archivos
+#   - rutas:   cada request del asistente A→I y export_excel (test client)
+# La diferencia entre "rutas" y "directo" es el costo de HTTP + render.
+#
+# Con --comparar se marcan como regresión las mediciones cuya mediana supera
+# la de la base en más de --tolerancia (y en más de --minimo-ms).
+
+ESCALAS_DEFAULT = "1,10,100,1000"
+
+
+# ===================================
+# Catálogos sintéticos
+# ===================================
+
+def _columna(df, nombre):
+    for col in df.columns:
+        if str(col).strip() == nombre:
+            return col
+    return None
+
+
+def _escalar(df, factor):
+    col_sap = _columna(df, "1. Cód.SAP")
+    col_material = _columna(df, "2. MATERIAL")
+    copias = [df]
+    for j in range(1, factor):
+        copia = df.copy()
+        if col_sap is not None:
+            if pd.api.types.is_numeric_dtype(copia[col_sap]):
+                copia[col_sap] = copia[col_sap] + j * 10 ** 10
+            else:
+                copia[col_sap] = copia[col_sap].astype(str) + f"-{j}"
+        if col_material is not None:
+            copia[col_material] = copia[col_material].astype(str) + f" #{j}"
+        copias.append(copia)
+    return pd.concat(copias, ignore_index=True)
+
+
+def escribir_catalogos(factor, destino):
+    for nombre in CATALOGOS:
+        original = pd.read_excel(os.path.join(catalogo.BASE_DIR, nombre))
+        _escalar(original, factor).to_excel(
+            os.path.join(destino, nombre), index=False, engine="xlsxwriter"
+        )
+
+
+# ===================================
+# Medición
+# ===================================
+
+def _resumen(tiempos):
+    return {
+        "mediana_ms": round(statistics.median(tiempos), 3),
+        "min_ms": round(min(tiempos), 3),
+        "max_ms": round(max(tiempos), 3),
+        "n": len(tiempos),
+    }
+
+
+def medir(funcion, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return _resumen(tiempos)
+
+
+def _consumir(bloques):
+    for _ in bloques:
+        pass
+
+
+def elegir_selecciones():
+    """Selecciones fijas por flujo, tomadas de los catálogos cargados."""
+    sel = {}
+
+    indice = indice_ajuste()
+    diametros = indice.diametros[:2]
+    filtros = {}
+    for diam in diametros:
+        elegidos = []
+        for _ in range(len(NIVELES_AJUSTE) - 1):
+            elegidos.append(indice.opciones(diam, *elegidos)[-1])
+        filtros[diam] = dict(zip(("tipo", "acero", "acero_cup", "tipo_cup"), elegidos))
+    sel["a"] = {"diametros": diametros, "filtros": filtros}
+
+    df = catalogo.cargar_catalogo("saca tubing.xlsx")
+    diametros = sorted(d for d in df["DIÁMETRO"].dropna().unique() if d.upper() != TODOS)[:2]
+    sel["b"] = {"diametros": diametros, "cantidades": {d: 3.0 for d in diametros}}
+
+    indice = indice_tubing()
+    diametros = indice.diametros[:2]
+    tipos = {diam: indice.tipos(diam)[:2] for diam in diametros}
+    union = {TODOS}
+    for lista in tipos.values():
+        union.update(lista)
+    csg = indice.opciones_csg(diametros + [TODOS], union)
+    sel["c"] = {
+        "diametros": diametros,
+        "tipos": tipos,
+        "diacsg": csg[0] if csg else TODOS,
+        "cantidades": {(d, t): 7.0 for d in diametros for t in tipos[d]},
+    }
+
+    df = catalogo.cargar_catalogo("profundiza.xlsx")
+    col = flujos.columna_profundiza(df)
+    valores = sorted(df[col].dropna().unique().tolist())[:2]
+    sel["d"] = {"col": col, "valores": valores, "cantidades": {v: 5.0 for v in valores}}
+
+    indice = indice_varillas()
+    diametros = indice.diametros[:2]
+    filtros = {}
+    for diam in diametros:
+        op = indice.opciones(diam)
+        filtros[diam] = flujos.filtros_varillas(
+            op["tipos"][:1],
+            op["acero"][0] if op["acero"] else "",
+            op["acero_cup"][0] if op["acero_cup"] else "",
+            op["tipo_cup"][0] if op["tipo_cup"] else "",
+        )
+    sel["e"] = {"diametros": diametros, "filtros": filtros, "cantidades": {d: 11.0 for d in diametros}}
+
+    df = catalogo.cargar_catalogo("abandono-recupero.xlsx")
+    diametros = [d for d in df["DIÁMETRO"].dropna().unique() if d.upper() != TODOS][:2]
+    sel["f"] = {"diametros": diametros + [TODOS], "cantidades": {d: 2.0 for d in diametros}}
+
+    df = catalogo.cargar_catalogo("GENERAL(1).xlsx")
+    materiales = [m for m in df["2. MATERIAL"].astype(str).unique() if "," not in m][:2]
+    sel["h"] = {"materiales": materiales, "cantidades": {m: 4.0 for m in materiales}}
+    return sel
+
+
+def medir_directo(sel, repeticiones):
+    resultados = [
+        ("FLUJO A", flujos.flujo_a(sel["a"]["diametros"], sel["a"]["filtros"])),
+        ("FLUJO B", flujos.flujo_b(sel["b"]["diametros"], sel["b"]["cantidades"])),
+        ("FLUJO C", flujos.flujo_c(sel["c"]["tipos"], sel["c"]["diacsg"], sel["c"]["cantidades"])),
+        ("FLUJO D", flujos.flujo_d(sel["d"]["col"], sel["d"]["valores"], sel["d"]["cantidades"])),
+        ("FLUJO E", flujos.flujo_e(sel["e"]["diametros"], sel["e"]["filtros"], sel["e"]["cantidades"])),
+        ("FLUJO F", flujos.flujo_f(sel["f"]["diametros"], sel["f"]["cantidades"])),
+        ("FLUJO G", flujos.flujo_g()),
+        ("FLUJO H", flujos.flujo_h(sel["h"]["cantidades"])),
+        ("FLUJO I", flujos.flujo_i()),
+    ]
+    resultados = [(flujo, df) for flujo, df in resultados if df is not None]
+    consolidado = flujos.consolidar(resultados)
+    casos = {
+        "flujo_a": lambda: flujos.flujo_a(sel["a"]["diametros"], sel["a"]["filtros"]),
+        "flujo_b": lambda: flujos.flujo_b(sel["b"]["diametros"], sel["b"]["cantidades"]),
+        "flujo_c": lambda: flujos.flujo_c(sel["c"]["tipos"], sel["c"]["diacsg"], sel["c"]["cantidades"]),
+        "flujo_d": lambda: flujos.flujo_d(sel["d"]["col"], sel["d"]["valores"], sel["d"]["cantidades"]),
+        "flujo_e": lambda: flujos.flujo_e(sel["e"]["diametros"], sel["e"]["filtros"], sel["e"]["cantidades"]),
+        "flujo_f": lambda: flujos.flujo_f(sel["f"]["diametros"], sel["f"]["cantidades"]),
+        "flujo_g": flujos.flujo_g,
+        "flujo_h": lambda: flujos.flujo_h(sel["h"]["cantidades"]),
+        "flujo_i": flujos.flujo_i,
+        "consolidar": lambda: flujos.consolidar(resultados),
+        "generar_xlsx": lambda: _consumir(exportar.generar_xlsx(consolidado)),
+        "generar_csv": lambda: _consumir(exportar.generar_csv(consolidado)),
+    }
+    mediciones = {nombre: medir(funcion, repeticiones) for nombre, funcion in casos.items()}
+    filas = {flujo: len(df) for flujo, df in resultados}
+    filas["consolidado"] = len(consolidado)
+    return mediciones, filas
+
+
+def recorrido(sel):
+    """Requests del asistente A→I y exportación: (nombre, método, url, form)."""
+    a, c, e = sel["a"], sel["c"], sel["e"]
+    diam_a = ",".join(a["diametros"])
+    filtros_a = {}
+    pasos_a = []
+    for paso, clave in (("seleccion_acero", "tipo"), ("seleccion_acero_cup", "acero"),
+                        ("seleccion_tipo_cup", "acero_cup"), ("resumen", "tipo_cup")):
+        for diam in a["diametros"]:
+            filtros_a.setdefault(diam, {})[clave] = a["filtros"][diam][clave]
+        pasos_a.append((paso, json.dumps(filtros_a)))
+    tipos_c = json.dumps(c["tipos"])
+    diam_c = ",".join(c["diametros"])
+
+    pasos = [
+        ("GET /flujo_a/seleccion", "GET", "/flujo_a/seleccion", None),
+        ("GET /flujo_a/seleccion_tipo", "GET", "/flujo_a/seleccion_tipo?" + urlencode({"diametros": diam_a}), None),
+    ]
+    for paso, filtros in pasos_a:
+        pasos.append((f"GET /flujo_a/{paso}", "GET",
+                      f"/flujo_a/{paso}?" + urlencode({"diametros": diam_a, "filtros": filtros}), None))
+    pasos += [
+        ("GET /flujo_b/seleccion", "GET", "/flujo_b/seleccion", None),
+        ("POST /flujo_b/cantidades", "POST",
+         "/flujo_b/cantidades?" + urlencode({"diametros": ",".join(sel["b"]["diametros"])}),
+         {f"qty_{d}": q for d, q in sel["b"]["cantidades"].items()}),
+        ("GET /flujo_c/seleccion", "GET", "/flujo_c/seleccion", None),
+        ("GET /flujo_c/tipo", "GET", "/flujo_c/tipo?" + urlencode({"diametros": diam_c}), None),
+        ("GET /flujo_c/diacsg", "GET", "/flujo_c/diacsg?" + urlencode({"diametros": diam_c, "tipos": tipos_c}), None),
+        ("POST /flujo_c/cantidades", "POST",
+         "/flujo_c/cantidades?" + urlencode({"diametros": diam_c, "tipos": tipos_c, "diacsg": c["diacsg"]}),
+         {f"qty_{d}_{t}": q for (d, t), q in c["cantidades"].items()}),
+        ("GET /flujo_d/seleccion", "GET", "/flujo_d/seleccion", None),
+        ("POST /flujo_d/cantidades", "POST",
+         "/flujo_d/cantidades?" + urlencode({"valores": ",".join(sel["d"]["valores"]), "col": sel["d"]["col"]}),
+         {f"qty_{v}": q for v, q in sel["d"]["cantidades"].items()}),
+        ("GET /flujo_e/seleccion", "GET", "/flujo_e/seleccion", None),
+        ("GET /flujo_e/filtros", "GET", "/flujo_e/filtros?" + urlencode({"diametros": ",".join(e["diametros"])}), None),
+        ("POST /flujo_e/cantidades", "POST",
+         "/flujo_e/cantidades?" + urlencode({"diametros": ",".join(e["diametros"]), "filtros": json.dumps(e["filtros"])}),
+         {f"qty_{d}": q for d, q in e["cantidades"].items()}),
+        ("GET /flujo_f/filtros", "GET", "/flujo_f/filtros", None),
+        ("POST /flujo_f/cantidades", "POST",
+         "/flujo_f/cantidades?" + urlencode({"diametros": ",".join(sel["f"]["diametros"]), "filtros": "{}"}),
+         {f"qty_{d}": q for d, q in sel["f"]["cantidades"].items()}),
+        ("POST /flujo_g", "POST", "/flujo_g", {"wo": "SI"}),
+        ("GET /flujo_h/seleccion", "GET", "/flujo_h/seleccion", None),
+        ("GET /flujo_h/buscar", "GET",
+         "/flujo_h/buscar?" + urlencode({"q": sel["h"]["materiales"][0].split()[0]}), None),
+        ("POST /flujo_h/cantidades", "POST",
+         "/flujo_h/cantidades?" + urlencode({"materiales": ",".join(sel["h"]["materiales"])}),
+         {f"qty_{m}": q for m, q in sel["h"]["cantidades"].items()}),
+        ("POST /flujo_i", "POST", "/flujo_i", {"valvulas": "SI"}),
+        ("GET /flujo_final", "GET", "/flujo_final", None),
+        ("GET /export_excel", "GET", "/export_excel", None),
+        ("GET /export_excel?formato=csv", "GET", "/export_excel?formato=csv", None),
+        ("GET /export_excel (en cache)", "GET", "/export_excel", None),
+    ]
+    return pasos
+
+
+def medir_rutas(app_modulo, sel, repeticiones):
+    pasos = recorrido(sel)
+    tiempos = {nombre: [] for nombre, _, _, _ in pasos}
+    for _ in range(repeticiones):
+        # Cada repetición es un técnico nuevo y la exportación se vuelve a codificar
+        cliente = app_modulo.app.test_client()
+        cliente.get("/")
+        app_modulo.cache_exportaciones.limpiar()
+        for nombre, metodo, url, form in pasos:
+            inicio = time.perf_counter()
+            if metodo == "GET":
+                respuesta = cliente.get(url)
+            else:
+                respuesta = cliente.post(url, data=form)
+            respuesta.get_data()
+            tiempos[nombre].append((time.perf_counter() - inicio) * 1000)
+            if respuesta.status_code not in (200, 302):
+                raise RuntimeError(f"{nombre}: HTTP {respuesta.status_code}")
+    return {nombre: _resumen(valores) for nombre, valores in tiempos.items()}
+
+
+def medir_escala(app_modulo, factor, repeticiones):
+    directorio_original = catalogo.BASE_DIR
+    temporal = None
+    try:
+        if factor > 1:
+            temporal = tempfile.mkdtemp(prefix=f"bm_benchmark_x{factor}_")
+            escribir_catalogos(factor, temporal)
+            catalogo.BASE_DIR = temporal
+        catalogo.limpiar_cache()
+
+        excel = {}
+        for nombre in CATALOGOS:
+            excel[nombre] = medir(lambda: catalogo.leer_catalogo_excel(nombre), 1)
+        filas_catalogos = {nombre: len(catalogo.cargar_catalogo(nombre)) for nombre in CATALOGOS}
+
+        indices = {
+            "cascada ajuste": medir(lambda: IndiceCascada(
+                catalogo.cargar_catalogo("ajuste de medida.xlsx"), NIVELES_AJUSTE), repeticiones),
+            "opciones varillas": medir(lambda: IndiceVarillas(
+                catalogo.cargar_catalogo("baja varillas.xlsx")), repeticiones),
+            "opciones tubing": medir(lambda: IndiceTubing(
+                catalogo.cargar_catalogo("baja tubing.xlsx")), repeticiones),
+            "busqueda general": medir(lambda: IndiceBusqueda(
+                catalogo.cargar_catalogo("GENERAL(1).xlsx")), repeticiones),
+        }
+        for nombre, columnas in COLUMNAS_REGLAS.items():
+            indices[f"reglas {nombre}"] = medir(
+                lambda: IndiceReglas(catalogo.cargar_catalogo(nombre), columnas), repeticiones)
+
+        sel = elegir_selecciones()
+        directo, filas_resultados = medir_directo(sel, repeticiones)
+        rutas = medir_rutas(app_modulo, sel, repeticiones)
+        return {
+            "filas": {"catalogos": filas_catalogos, "resultados": filas_resultados},
+            "excel": excel,
+            "indices": indices,
+            "directo": directo,
+            "rutas": rutas,
+        }
+    finally:
+        catalogo.BASE_DIR = directorio_original
+        catalogo.limpiar_cache()
+        if temporal is not None:
+            shutil.rmtree(temporal, ignore_errors=True)
+
+
+def correr(escalas, repeticiones):
+    import app as app_modulo
+    import arranque
+
+    # Que el precalentamiento en segundo plano no se superponga con las mediciones
+    arranque.esperar_precalentamiento()
+    informe = {
+        "meta": {
+            "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "repeticiones": repeticiones,
+        },
+        "escalas": {},
+    }
+    for factor in escalas:
+        inicio = time.perf_counter()
+        informe["escalas"][f"x{factor}"] = medir_escala(app_modulo, factor, repeticiones)
+        print(f"x{factor}: {time.perf_counter() - inicio:.1f}s", file=sys.stderr)
+    return informe
+
+
+# ===================================
+# Comparación contra una base
+# ===================================
+
+def comparar(base, actual, tolerancia, minimo_ms):
+    """Lista de (escala, sección, medición, base_ms, actual_ms, es_regresion)."""
+    filas = []
+    for escala, secciones in actual["escalas"].items():
+        secciones_base = base.get("escalas", {}).get(escala)
+        if secciones_base is None:
+            continue
+        for seccion in ("excel", "indices", "directo", "rutas"):
+            for nombre, medicion in secciones.get(seccion, {}).items():
+                previa = secciones_base.get(seccion, {}).get(nombre)
+                if previa is None:
+                    continue
+                antes, ahora = previa["mediana_ms"], medicion["mediana_ms"]
+                regresion = ahora > antes * (1 + tolerancia) and ahora - antes > minimo_ms
+                filas.append((escala, seccion, nombre, antes, ahora, regresion))
+    return filas
+
+
+def imprimir_comparacion(filas):
+    for escala, seccion, nombre, antes, ahora, regresion in filas:
+        cambio = (ahora / antes - 1) * 100 if antes else 0.0
+        marca = "REGRESIÓN" if regresion else ""
+        print(f"{escala:>6} {seccion:<8} {nombre:<40} {antes:>10.2f} {ahora:>10.2f} {cambio:>+7.1f}% {marca}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Mide los flujos del asistente y la exportación con catálogos reales y sintéticos."
+    )
+    parser.add_argument("--escalas", default=ESCALAS_DEFAULT,
+                        help=f"factores de escala separados por coma (default: {ESCALAS_DEFAULT})")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--salida", default="benchmark.json")
+    parser.add_argument("--comparar", metavar="BASE",
+                        help="JSON de una corrida anterior contra el que se buscan regresiones")
+    parser.add_argument("--actual", metavar="JSON",
+                        help="con --comparar: usa este JSON en lugar de correr los benchmarks")
+    parser.add_argument("--tolerancia", type=float, default=0.25,
+                        help="aumento relativo de la mediana que cuenta como regresión (default 0.25)")
+    parser.add_argument("--minimo-ms", type=float, default=1.0,
+                        help="diferencia absoluta mínima para marcar una regresión (default 1 ms)")
+    args = parser.parse_args()
+
+    if args.actual:
+        with open(args.actual, encoding="utf-8") as f:
+            informe = json.load(f)
+    else:
+        escalas = [int(x) for x in args.escalas.split(",") if x.strip()]
+        informe = correr(escalas, args.repeticiones)
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(informe, f, ensure_ascii=False, indent=2)
+        print(f"Resultados en {args.salida}", file=sys.stderr)
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            base = json.load(f)
+        filas = comparar(base, informe, args.tolerancia, args.minimo_ms)
+        imprimir_comparacion(filas)
+        regresiones = sum(1 for fila in filas if fila[-1])
+        print(f"{regresiones} regresiones sobre {len(filas)} mediciones")
+        sys.exit(1 if regresiones else 0)
@@ -0,0 +1,149 @@
+import bisect
+import re
+import unicodedata
+
+
+# ===================================
+# Búsqueda de materiales (Flujo H)
+# ===================================
+# Índice sobre GENERAL(1).xlsx para elegir materiales escribiendo, en lugar de
+# mandar la lista entera en cada página. Un documento por "2. MATERIAL"
+# distinto (en el orden del Excel), con su descripción y sus Cód.SAP.
+#
+# El texto se normaliza (minúsculas, sin acentos) y se parte en palabras
+# alfanuméricas. Cada término de la consulta tiene que aparecer en el
+# documento (AND), como:
+#   - palabra exacta o prefijo de una palabra: lista ordenada de palabras y
+#     bisect, así "weath" encuentra "weatherf" y "10005" un Cód.SAP;
+#   - o, desde 3 letras, por trigramas: alcanza con compartir
+#     SIMILITUD_MINIMA de los trigramas del término, así se encuentran
+#     pedazos del medio de una palabra y errores de tipeo.
+# El puntaje suma, por término, la mejor coincidencia según el campo
+# (material > Cód.SAP > descripción) y el tipo (exacta > prefijo > trigrama);
+# los empates quedan en el orden del Excel. Todo el índice son listas y dicts
+# de Python: va en el snapshot de opciones y se consulta sin pandas.
+
+PESOS_CAMPOS = {"material": 3.0, "sap": 2.0, "descripcion": 1.0}
+PESO_EXACTA = 1.0
+PESO_PREFIJO = 0.8
+PESO_TRIGRAMA = 0.6
+SIMILITUD_MINIMA = 0.6
+
+POR_PAGINA = 20
+MAX_POR_PAGINA = 100
+
+
+def normalizar(texto):
+    texto = unicodedata.normalize("NFKD", str(texto))
+    return "".join(c for c in texto if not unicodedata.combining(c)).lower()
+
+
+def palabras(texto):
+    return re.findall(r"[a-z0-9]+", normalizar(texto))
+
+
+def trigramas(palabra):
+    relleno = f" {palabra} "
+    return {relleno[i:i + 3] for i in range(len(relleno) - 2)}
+
+
+def _texto_celda(valor):
+    if valor is None or valor != valor:   # NaN
+        return ""
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)
+    return str(valor).strip()
+
+
+class IndiceBusqueda:
+    def __init__(self, df):
+        columnas = {
+            "material": "2. MATERIAL",
+            "descripcion": "3. Descripción",
+            "sap": "1. Cód.SAP",
+        }
+        self.documentos = []
+        posicion = {}
+        textos = []   # por documento: {campo: set de textos}
+        for fila in df.to_dict("records"):
+            material = str(fila.get(columnas["material"]))
+            doc = posicion.get(material)
+            if doc is None:
+                doc = posicion[material] = len(self.documentos)
+                self.documentos.append({"material": material, "descripcion": "", "sap": ""})
+                textos.append({campo: [] for campo in columnas})
+            for campo, col in columnas.items():
+                texto = _texto_celda(fila.get(col))
+                if texto and texto not in textos[doc][campo]:
+                    textos[doc][campo].append(texto)
+
+        postings = {}     # palabra -> {doc: peso}
+        por_trigrama = {}  # trigrama -> {doc: peso}
+        for doc, campos in enumerate(textos):
+            documento = self.documentos[doc]
+            documento["descripcion"] = " / ".join(campos["descripcion"])
+            documento["sap"] = " / ".join(campos["sap"])
+            for campo, valores in campos.items():
+                peso = PESOS_CAMPOS[campo]
+                for palabra in {p for valor in valores for p in palabras(valor)}:
+                    _maximo(postings.setdefault(palabra, {}), doc, peso)
+                    for trigrama in trigramas(palabra):
+                        _maximo(por_trigrama.setdefault(trigrama, {}), doc, peso)
+        self._palabras = sorted(postings)
+        self._postings = {p: list(docs.items()) for p, docs in postings.items()}
+        self._trigramas = {t: list(docs.items()) for t, docs in por_trigrama.items()}
+
+    def _puntajes(self, termino):
+        puntajes = {}
+        i = bisect.bisect_left(self._palabras, termino)
+        while i < len(self._palabras) and self._palabras[i].startswith(termino):
+            palabra = self._palabras[i]
+            calidad = PESO_EXACTA if palabra == termino else PESO_PREFIJO
+            for doc, peso in self._postings[palabra]:
+                _maximo(puntajes, doc, peso * calidad)
+            i += 1
+        if len(termino) >= 3:
+            propios = trigramas(termino)
+            # (doc, peso del campo) -> trigramas del término que tiene
+            comunes = {}
+            for trigrama in propios:
+                for item in self._trigramas.get(trigrama, ()):
+                    comunes[item] = comunes.get(item, 0) + 1
+            for (doc, peso), n in comunes.items():
+                similitud = n / len(propios)
+                if similitud >= SIMILITUD_MINIMA:
+                    _maximo(puntajes, doc, peso * PESO_TRIGRAMA * similitud)
+        return puntajes
+
+    def buscar(self, consulta, pagina=1, por_pagina=POR_PAGINA):
+        """Página `pagina` de los documentos que coinciden con `consulta`, del más relevante al menos."""
+        por_pagina = max(1, min(por_pagina, MAX_POR_PAGINA))
+        pagina = max(1, pagina)
+        terminos = palabras(consulta or "")
+        if not terminos:
+            ids = range(len(self.documentos))
+        else:
+            puntajes = None
+            for termino in dict.fromkeys(terminos):
+                del_termino = self._puntajes(termino)
+                if puntajes is None:
+                    puntajes = del_termino
+                else:
+                    puntajes = {doc: p + del_termino[doc] for doc, p in puntajes.items() if doc in del_termino}
+                if not puntajes:
+                    break
+            ids = sorted(puntajes, key=lambda doc: (-puntajes[doc], doc))
+        inicio = (pagina - 1) * por_pagina
+        return {
+            "consulta": consulta or "",
+            "total": len(ids),
+            "pagina": pagina,
+            "por_pagina": por_pagina,
+            "paginas": max(1, -(-len(ids) // por_pagina)),
+            "resultados": [self.documentos[doc] for doc in ids[inicio:inicio + por_pagina]],
+        }
+
+
+def _maximo(puntajes, doc, valor):
+    if valor > puntajes.get(doc, 0.0):
+        puntajes[doc] = valor
@@ -0,0 +1,89 @@
+import itertools
+
+import metricas
+from arranque import importar_perezoso
+from seleccion import TODOS
+
+np = importar_perezoso("numpy")
+pd = importar_perezoso("pandas")
+
+
+# ===================================
+# Asignación de cantidades
+# ===================================
+# Los flujos reciben las cantidades que tipeó el usuario como entradas
+# (valores de las columnas clave -> cantidad), en orden. En vez de una máscara
+# sobre toda la columna por entrada, las entradas se arman como una tabla
+# chica y se cruzan con las filas pendientes en una sola pasada (lookup por
+# hash con get_indexer), así el costo no depende de cuántas entradas haya.
+#
+# Precedencia, la misma que tenían los loops de cada flujo:
+#   - una fila que ya trae cantidad en el catálogo la conserva (con
+#     reemplazar_no_positivas también se pisan las <= 0, como en el Flujo H);
+#   - en las columnas `comodines`, una fila "TODOS" coincide con cualquier
+#     valor, y si coincide con varias entradas gana la primera; en el resto de
+#     las columnas la coincidencia es exacta (una fila "TODOS" sólo toma la
+#     entrada cuyo valor sea "TODOS");
+#   - una entrada sin cantidad (None) no asigna nada.
+
+
+def _claves(arrays):
+    """Clave por fila: el valor si es una sola columna, si no la tupla de valores."""
+    if len(arrays) == 1:
+        return arrays[0]
+    claves = np.empty(len(arrays[0]), dtype=object)
+    claves[:] = list(zip(*arrays))
+    return claves
+
+
+def asignar_cantidades(df, columnas, entradas, comodines=(), reemplazar_no_positivas=False, como_texto=False):
+    """Completa "4.CANTIDAD" de `df` (en el lugar) con las cantidades de `entradas`.
+
+    `entradas` es una lista [(valores, cantidad)], con `valores` una tupla
+    alineada con `columnas`, en orden de precedencia. Con `como_texto` las
+    columnas clave se comparan como str.
+    """
+    with metricas.etapa("cantidades"):
+        entradas = [(tuple(valores), float(cantidad)) for valores, cantidad in entradas
+                    if cantidad is not None and cantidad == cantidad]
+        actual = df["4.CANTIDAD"]
+        pendientes = actual.isna().to_numpy()
+        if reemplazar_no_positivas:
+            pendientes = pendientes | (actual <= 0).to_numpy()
+        posiciones = np.flatnonzero(pendientes)
+        if not entradas or not len(posiciones):
+            return df
+
+        valores_filas = {}
+        for col in columnas:
+            serie = df[col].iloc[posiciones]
+            valores_filas[col] = (serie.astype(str) if como_texto else serie).to_numpy(dtype=object)
+        es_todos = {col: valores_filas[col] == TODOS for col in comodines}
+        cantidades = np.full(len(posiciones), np.nan)
+        # Un cruce por combinación de columnas comodín en "TODOS": esas
+        # columnas no se comparan y, entre las entradas que coinciden en las
+        # demás, queda la primera
+        for patron in itertools.product((False, True), repeat=len(comodines)):
+            mascara = np.ones(len(posiciones), dtype=bool)
+            for col, todos in zip(comodines, patron):
+                mascara &= es_todos[col] == todos
+            if not mascara.any():
+                continue
+            libres = {col for col, todos in zip(comodines, patron) if todos}
+            usadas = [i for i, col in enumerate(columnas) if col not in libres]
+            if not usadas:
+                cantidades[mascara] = entradas[0][1]
+                continue
+            primeras = {}
+            for valores, cantidad in entradas:
+                primeras.setdefault(_claves([[valores[i]] for i in usadas])[0], cantidad)
+            indice = pd.Index(list(primeras), dtype=object, tupleize_cols=False)
+            encontradas = indice.get_indexer(_claves([valores_filas[columnas[i]][mascara] for i in usadas]))
+            en_mascara = np.flatnonzero(mascara)
+            cantidades[en_mascara[encontradas >= 0]] = np.fromiter(primeras.values(), dtype=float)[
+                encontradas[encontradas >= 0]]
+
+        asignadas = ~np.isnan(cantidades)
+        if asignadas.any():
+            df.iloc[posiciones[asignadas], df.columns.get_loc("4.CANTIDAD")] = cantidades[asignadas]
+    return df
@@ -0,0 +1,491 @@
+import argparse
+import csv
+import html
+import io
+import json
+import random
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.cookiejar import CookieJar
+
+
+# ===================================
+# Prueba de carga: muchos técnicos recorriendo el asistente a la vez
+# ===================================
+# Uso (con la app corriendo, p. ej. gunicorn app:app --workers 1):
+#   python carga.py --url http://127.0.0.1:8000 --usuarios 20 --recorridos 3
+#
+# Cada usuario virtual es un thread con su propio cookie jar (su propia
+# sesión). En cada recorrido entra por "/", decide al azar SI/NO en cada flujo
+# de A a I, elige opciones válidas leyendo los formularios de cada página,
+# ve el resumen y descarga la exportación (xlsx y CSV).
+#
+# Verificación: las cantidades que carga cada usuario son únicas
+# (usuario * 100000 + n), y al final de cada recorrido el CSV exportado se
+# compara con el consolidado que devuelve /api/materiales para la misma
+# especificación. Si una sesión ve materiales de otra, o le faltan los suyos,
+# el recorrido cuenta como inconsistente.
+#
+# Informe: throughput, p50/p95/p99 y tasa de errores por ruta (método + path
+# sin query string). Sale con código 1 si hubo errores o inconsistencias.
+
+PROBABILIDAD_SI = 0.6
+# En A y E, cuántos recorridos usan la página única con el paquete de opciones
+# (como un navegador con JavaScript) en lugar de ir paso a paso
+PROBABILIDAD_UNA_PAGINA = 0.5
+
+
+# ===================================
+# Lectura de formularios
+# ===================================
+
+def _selects(texto):
+    """{nombre: [valores]} de cada <select> de la página."""
+    selects = {}
+    for nombre, cuerpo in re.findall(r'<select name="([^"]*)"[^>]*>(.*?)</select>', texto, re.S):
+        selects[html.unescape(nombre)] = [
+            html.unescape(v) for v in re.findall(r'<option value="([^"]*)"', cuerpo)
+        ]
+    return selects
+
+
+def _percentil(valores, p):
+    # Rango más cercano sobre la lista ordenada
+    indice = max(0, min(len(valores) - 1, int(round(p / 100 * len(valores) + 0.5)) - 1))
+    return valores[indice]
+
+
+def _normalizar(valor):
+    if valor is None or valor == "":
+        return ""
+    try:
+        return round(float(valor), 6)
+    except (TypeError, ValueError):
+        return str(valor).strip()
+
+
+def _hijo(paquete, nodo, nivel, valor):
+    # Como en flujo_a_seleccion.html: el centinela va al final si no está entre las opciones
+    for i, posicion in enumerate(nodo[0]):
+        if paquete["valores"][posicion] == valor:
+            return nodo[1][i]
+    return nodo[1][len(nodo[0])] if valor == paquete["niveles"][nivel]["centinela"] else None
+
+
+class _SinRedirecciones(urllib.request.HTTPRedirectHandler):
+    # Cada salto se mide como un request propio
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class Respuesta:
+    def __init__(self, url, estado, cuerpo, encabezados):
+        self.url = url
+        self.estado = estado
+        self.cuerpo = cuerpo
+        self.encabezados = encabezados
+
+    @property
+    def texto(self):
+        return self.cuerpo.decode("utf-8", errors="replace")
+
+
+class ErrorRecorrido(Exception):
+    pass
+
+
+# ===================================
+# Usuario virtual
+# ===================================
+
+class Tecnico:
+    def __init__(self, numero, base, estadisticas, semilla, timeout, pausa):
+        self.numero = numero
+        self.base = base.rstrip("/")
+        self.estadisticas = estadisticas
+        self.azar = random.Random(semilla * 1000003 + numero)
+        self.timeout = timeout
+        self.pausa = pausa
+        self.cantidades_usadas = 0
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(CookieJar()), _SinRedirecciones()
+        )
+
+    # ---------- HTTP ----------
+
+    def _pedir(self, metodo, url, datos=None, json_cuerpo=None):
+        if not url.startswith("http"):
+            url = self.base + url
+        cuerpo, encabezados = None, {}
+        if datos is not None:
+            cuerpo = urllib.parse.urlencode(datos, doseq=True).encode("utf-8")
+            encabezados["Content-Type"] = "application/x-www-form-urlencoded"
+        elif json_cuerpo is not None:
+            cuerpo = json.dumps(json_cuerpo).encode("utf-8")
+            encabezados["Content-Type"] = "application/json"
+        peticion = urllib.request.Request(url, data=cuerpo, headers=encabezados, method=metodo)
+        ruta = f"{metodo} {urllib.parse.urlsplit(url).path}"
+        inicio = time.perf_counter()
+        try:
+            try:
+                with self.opener.open(peticion, timeout=self.timeout) as r:
+                    respuesta = Respuesta(url, r.status, r.read(), r.headers)
+            except urllib.error.HTTPError as e:
+                respuesta = Respuesta(url, e.code, e.read(), e.headers)
+        except Exception as e:
+            self.estadisticas.registrar(ruta, time.perf_counter() - inicio, error=True)
+            raise ErrorRecorrido(f"{ruta}: {e}") from e
+        error = respuesta.estado >= 400
+        self.estadisticas.registrar(ruta, time.perf_counter() - inicio, error=error)
+        if error:
+            raise ErrorRecorrido(f"{ruta}: HTTP {respuesta.estado}")
+        if self.pausa:
+            time.sleep(self.azar.uniform(0, self.pausa))
+        return respuesta
+
+    def get(self, url):
+        return self._pedir("GET", url)
+
+    def post(self, url, datos):
+        return self._pedir("POST", url, datos=datos)
+
+    def seguir(self, respuesta):
+        if respuesta.estado not in (301, 302, 303, 307):
+            return respuesta
+        destino = urllib.parse.urljoin(respuesta.url, respuesta.encabezados["Location"])
+        return self.get(destino)
+
+    # ---------- Elecciones ----------
+
+    def si(self):
+        return self.azar.random() < PROBABILIDAD_SI
+
+    def algunos(self, opciones, minimo=1, maximo=2):
+        if not opciones:
+            return []
+        cantidad = self.azar.randint(min(minimo, len(opciones)), min(maximo, len(opciones)))
+        return self.azar.sample(opciones, cantidad)
+
+    def cantidad(self):
+        # Única por usuario: si aparece en la exportación de otro, hubo fuga
+        self.cantidades_usadas += 1
+        return float(self.numero * 100000 + self.cantidades_usadas)
+
+    # ---------- Flujos ----------
+
+    def flujo_a(self, spec):
+        if not self.si():
+            self.post("/flujo_a/decidir", {"ajuste": "NO"})
+            return
+        r = self.seguir(self.post("/flujo_a/decidir", {"ajuste": "SI"}))
+        diametros = self.algunos(_selects(r.texto).get("diametros", []))
+        filtros = {d: {} for d in diametros}
+        if self.azar.random() < PROBABILIDAD_UNA_PAGINA:
+            paquete = self.paquete(r.texto)
+            valores, niveles = paquete["valores"], paquete["niveles"]
+            datos = {"diametros": diametros, "cascada": "1"}
+            for diam in diametros:
+                nodo = _hijo(paquete, paquete["arbol"], 0, diam)
+                for nivel, clave in enumerate(("tipo", "acero", "acero_cup", "tipo_cup"), start=1):
+                    valor = valores[self.azar.choice(nodo[0])]
+                    datos[f"{clave}_{diam}"] = filtros[diam][clave] = valor
+                    nodo = _hijo(paquete, nodo, nivel, valor) if nivel + 1 < len(niveles) else None
+            self.post(r.url, datos)
+            spec["ajuste"] = {"diametros": filtros}
+            return
+        r = self.seguir(self.post(r.url, {"diametros": diametros}))
+        for clave in ("tipo", "acero", "acero_cup", "tipo_cup"):
+            selects = _selects(r.texto)
+            datos = {}
+            for diam in diametros:
+                opciones = selects.get(f"{clave}_{diam}", [])
+                if opciones:
+                    datos[f"{clave}_{diam}"] = filtros[diam][clave] = self.azar.choice(opciones)
+            r = self.seguir(self.post(r.url, datos))
+        # La última redirección (resumen) guarda el flujo y redirige a H
+        spec["ajuste"] = {"diametros": filtros}
+
+    def flujo_b(self, spec):
+        if not self.si():
+            self.post("/flujo_b", {"saca_tubing": "NO"})
+            return
+        r = self.seguir(self.post("/flujo_b", {"saca_tubing": "SI"}))
+        diametros = self.algunos(_selects(r.texto).get("diametros", []))
+        r = self.seguir(self.post(r.url, {"diametros": diametros}))
+        cantidades = {d: self.cantidad() for d in diametros}
+        self.post(r.url, {f"qty_{d}": q for d, q in cantidades.items()})
+        spec["saca_tubing"] = {"cantidades": cantidades}
+
+    def flujo_c(self, spec):
+        if not self.si():
+            self.post("/flujo_c/decidir", {"baja_tubing": "NO"})
+            return
+        r = self.seguir(self.post("/flujo_c/decidir", {"baja_tubing": "SI"}))
+        diametros = self.algunos(_selects(r.texto).get("diametros", []))
+        r = self.seguir(self.post(r.url, {"diametros": diametros}))
+        selects = _selects(r.texto)
+        tipos = {d: self.algunos(selects.get(f"tipo_{d}", []), minimo=0) for d in diametros}
+        # Si no hay DIÁMETRO CSG para elegir, la página redirige directo a cantidades
+        r = self.seguir(self.post(r.url, {f"tipo_{d}": t for d, t in tipos.items()}))
+        diacsg = "TODOS"
+        if r.estado == 200:
+            opciones = _selects(r.texto).get("diacsg", [])
+            diacsg = self.azar.choice(opciones) if opciones else "TODOS"
+            r = self.post(r.url, {"diacsg": diacsg})
+        r = self.seguir(r)
+        por_diametro = {d: {t: self.cantidad() for t in (tipos[d] or ["TODOS"])} for d in diametros}
+        self.post(r.url, {
+            f"qty_{d}_{t}": q for d, por_tipo in por_diametro.items() for t, q in por_tipo.items()
+        })
+        spec["baja_tubing"] = {"diametros": por_diametro, "diacsg": diacsg}
+
+    def flujo_d(self, spec):
+        if not self.si():
+            self.post("/flujo_d/decidir", {"profundizar": "NO"})
+            return
+        r = self.seguir(self.post("/flujo_d/decidir", {"profundizar": "SI"}))
+        valores = self.algunos(_selects(r.texto).get("valores", []))
+        r = self.seguir(self.post(r.url, {"valores": valores}))
+        cantidades = {v: self.cantidad() for v in valores}
+        self.post(r.url, {f"qty_{v}": q for v, q in cantidades.items()})
+        spec["profundiza"] = {"cantidades": cantidades}
+
+    def flujo_e(self, spec):
+        if not self.si():
+            self.post("/flujo_e/decidir", {"baja_varilla": "NO"})
+            return
+        r = self.seguir(self.post("/flujo_e/decidir", {"baja_varilla": "SI"}))
+        diametros = self.algunos(_selects(r.texto).get("diametros", []))
+        if self.azar.random() < PROBABILIDAD_UNA_PAGINA:
+            # Los mismos desplegables que arma la página, desde el paquete
+            paquete = self.paquete(r.texto)
+            selects = {
+                f"{campo}_{diam}": [paquete["valores"][i] for i in paquete["filtros"][diam][clave]]
+                for diam in diametros
+                for campo, clave in (("tipo", "tipos"), ("acero", "acero"),
+                                     ("acero_cup", "acero_cup"), ("tipo_cup", "tipo_cup"))
+            }
+            extra = {"diametros": diametros, "cascada": "1"}
+        else:
+            r = self.seguir(self.post(r.url, {"diametros": diametros}))
+            selects = _selects(r.texto)
+            extra = {}
+        datos, por_diametro = {}, {}
+        for diam in diametros:
+            filtros = {"tipos": self.algunos(selects.get(f"tipo_{diam}", []), minimo=0)}
+            datos[f"tipo_{diam}"] = filtros["tipos"]
+            for clave in ("acero", "acero_cup", "tipo_cup"):
+                opciones = selects.get(f"{clave}_{diam}", [])
+                if opciones:
+                    datos[f"{clave}_{diam}"] = filtros[clave] = self.azar.choice(opciones)
+            por_diametro[diam] = filtros
+        r = self.seguir(self.post(r.url, dict(datos, **extra)))
+        for diam in diametros:
+            por_diametro[diam]["cantidad"] = self.cantidad()
+        self.post(r.url, {f"qty_{d}": f["cantidad"] for d, f in por_diametro.items()})
+        spec["baja_varillas"] = {"diametros": por_diametro}
+
+    def flujo_f(self, spec):
+        if not self.si():
+            self.post("/flujo_f/decidir", {"abandono": "NO"})
+            return
+        r = self.seguir(self.post("/flujo_f/decidir", {"abandono": "SI"}))
+        selects = _selects(r.texto)
+        diametros = self.algunos(selects.get("diametros", []))
+        datos = {"diametros": diametros}
+        if selects.get("diacsg"):
+            datos["diacsg"] = self.azar.choice(selects["diacsg"])
+        r = self.seguir(self.post(r.url, datos))
+        cantidades = {d: self.cantidad() for d in diametros}
+        self.post(r.url, {f"qty_{d}": q for d, q in cantidades.items()})
+        spec["abandono"] = {"cantidades": cantidades}
+
+    def flujo_g(self, spec):
+        wo = self.si()
+        self.post("/flujo_g", {"wo": "SI" if wo else "NO"})
+        if wo:
+            spec["wo"] = True
+
+    def flujo_h(self, spec):
+        if not self.si():
+            self.post("/flujo_h/decidir", {"agregar_material": "NO"})
+            return
+        r = self.seguir(self.post("/flujo_h/decidir", {"agregar_material": "SI"}))
+        # Como un técnico: busca una palabra de un material de la primera página
+        primera = self.buscar_materiales("")
+        palabras = re.findall(r"\w{3,}", self.azar.choice(primera)) if primera else []
+        encontrados = self.buscar_materiales(self.azar.choice(palabras)) if palabras else primera
+        # La ruta de cantidades separa los materiales por coma
+        opciones = [m for m in encontrados if "," not in m] or [m for m in primera if "," not in m]
+        materiales = self.algunos(opciones, maximo=3)
+        r = self.seguir(self.post(r.url, {"materiales": materiales}))
+        cantidades = {m: self.cantidad() for m in materiales}
+        self.post(r.url, {f"qty_{m}": q for m, q in cantidades.items()})
+        spec["general"] = {"cantidades": cantidades}
+
+    def paquete(self, texto):
+        url = html.unescape(re.search(r'fetch\("([^"]*/opciones/[^"]*)"\)', texto).group(1))
+        return json.loads(self.get(url).cuerpo)
+
+    def buscar_materiales(self, consulta):
+        r = self.get("/flujo_h/buscar?" + urllib.parse.urlencode({"q": consulta, "por_pagina": 50}))
+        return [item["material"] for item in json.loads(r.cuerpo)["resultados"]]
+
+    def flujo_i(self, spec):
+        valvulas = self.si()
+        self.post("/flujo_i", {"valvulas": "SI" if valvulas else "NO"})
+        if valvulas:
+            spec["valvulas"] = True
+
+    # ---------- Recorrido completo ----------
+
+    def recorrido(self):
+        """Un recorrido A→I + exportación. Devuelve None si la exportación es correcta."""
+        spec = {}
+        self.get("/")
+        for paso in (self.flujo_a, self.flujo_b, self.flujo_c, self.flujo_d, self.flujo_e,
+                     self.flujo_f, self.flujo_g, self.flujo_h, self.flujo_i):
+            paso(spec)
+        self.get("/flujo_final")
+        self.get("/export_excel")
+        exportado = self.get("/export_excel?formato=csv").texto.lstrip("\ufeff")
+        esperado = json.loads(self._pedir("POST", "/api/materiales", json_cuerpo=spec).cuerpo)
+        return self.comparar(exportado, esperado["consolidado"])
+
+    def comparar(self, csv_texto, consolidado):
+        lineas = list(csv.reader(io.StringIO(csv_texto)))
+        if not consolidado and len(lineas) <= 1:
+            return None
+        columnas = lineas[0] if lineas else []
+        exportadas = sorted((tuple(_normalizar(v) for v in fila) for fila in lineas[1:]), key=repr)
+        esperadas = sorted(
+            (tuple(_normalizar(registro.get(c)) for c in columnas) for registro in consolidado), key=repr
+        )
+        if exportadas == esperadas:
+            return None
+        sobran = len(set(exportadas) - set(esperadas))
+        faltan = len(set(esperadas) - set(exportadas))
+        return f"usuario {self.numero}: {sobran} filas de más y {faltan} de menos en la exportación"
+
+
+# ===================================
+# Estadísticas
+# ===================================
+
+class Estadisticas:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.tiempos = {}
+        self.errores = {}
+        self.recorridos = 0
+        self.fallidos = []
+        self.inconsistentes = []
+
+    def registrar(self, ruta, segundos, error=False):
+        with self._lock:
+            self.tiempos.setdefault(ruta, []).append(segundos)
+            if error:
+                self.errores[ruta] = self.errores.get(ruta, 0) + 1
+
+    def terminar_recorrido(self, fallo=None, inconsistencia=None):
+        with self._lock:
+            self.recorridos += 1
+            if fallo:
+                self.fallidos.append(fallo)
+            if inconsistencia:
+                self.inconsistentes.append(inconsistencia)
+
+    def informe(self, duracion):
+        rutas = {}
+        total = 0
+        for ruta, tiempos in sorted(self.tiempos.items()):
+            ordenados = sorted(tiempos)
+            total += len(ordenados)
+            rutas[ruta] = {
+                "requests": len(ordenados),
+                "errores": self.errores.get(ruta, 0),
+                "tasa_error": round(self.errores.get(ruta, 0) / len(ordenados), 4),
+                "p50_ms": round(_percentil(ordenados, 50) * 1000, 2),
+                "p95_ms": round(_percentil(ordenados, 95) * 1000, 2),
+                "p99_ms": round(_percentil(ordenados, 99) * 1000, 2),
+                "max_ms": round(ordenados[-1] * 1000, 2),
+            }
+        return {
+            "duracion_s": round(duracion, 2),
+            "requests": total,
+            "requests_por_s": round(total / duracion, 2) if duracion else 0.0,
+            "recorridos": self.recorridos,
+            "recorridos_por_s": round(self.recorridos / duracion, 3) if duracion else 0.0,
+            "recorridos_fallidos": len(self.fallidos),
+            "recorridos_inconsistentes": len(self.inconsistentes),
+            "rutas": rutas,
+            "fallos": self.fallidos[:20],
+            "inconsistencias": self.inconsistentes[:20],
+        }
+
+
+def correr_carga(url, usuarios, recorridos, semilla=0, timeout=130.0, pausa=0.0, rampa=0.0):
+    estadisticas = Estadisticas()
+
+    def usuario(numero):
+        if rampa:
+            time.sleep(rampa * numero / usuarios)
+        tecnico = Tecnico(numero, url, estadisticas, semilla, timeout, pausa)
+        for _ in range(recorridos):
+            try:
+                estadisticas.terminar_recorrido(inconsistencia=tecnico.recorrido())
+            except ErrorRecorrido as e:
+                estadisticas.terminar_recorrido(fallo=f"usuario {numero}: {e}")
+
+    hilos = [threading.Thread(target=usuario, args=(n,), daemon=True) for n in range(1, usuarios + 1)]
+    inicio = time.perf_counter()
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    return estadisticas.informe(time.perf_counter() - inicio)
+
+
+def imprimir_informe(informe):
+    print(f"{'ruta':<40} {'reqs':>6} {'err%':>6} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+    for ruta, datos in informe["rutas"].items():
+        print(f"{ruta:<40} {datos['requests']:>6} {datos['tasa_error'] * 100:>5.1f}% "
+              f"{datos['p50_ms']:>8.1f}ms {datos['p95_ms']:>7.1f}ms {datos['p99_ms']:>7.1f}ms "
+              f"{datos['max_ms']:>7.1f}ms")
+    print(f"\n{informe['requests']} requests en {informe['duracion_s']}s "
+          f"({informe['requests_por_s']} req/s, {informe['recorridos_por_s']} recorridos/s)")
+    print(f"Recorridos: {informe['recorridos']}, fallidos: {informe['recorridos_fallidos']}, "
+          f"inconsistentes: {informe['recorridos_inconsistentes']}")
+    for linea in informe["fallos"] + informe["inconsistencias"]:
+        print(f"  {linea}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Simula técnicos concurrentes recorriendo el asistente A→I hasta la exportación."
+    )
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--usuarios", type=int, default=10, help="usuarios virtuales concurrentes")
+    parser.add_argument("--recorridos", type=int, default=3, help="recorridos por usuario")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=130.0,
+                        help="segundos de espera por request (gunicorn corta a los 120)")
+    parser.add_argument("--pausa", type=float, default=0.0,
+                        help="pausa máxima al azar entre clicks, en segundos")
+    parser.add_argument("--rampa", type=float, default=0.0,
+                        help="segundos en los que se reparten los arranques de los usuarios")
+    parser.add_argument("--json", metavar="ARCHIVO", help="guarda también el informe en JSON")
+    args = parser.parse_args()
+
+    informe = correr_carga(args.url, args.usuarios, args.recorridos, args.semilla,
+                           args.timeout, args.pausa, args.rampa)
+    imprimir_informe(informe)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(informe, f, ensure_ascii=False, indent=2)
+    sys.exit(1 if informe["recorridos_fallidos"] or informe["recorridos_inconsistentes"] else 0)
@@ -0,0 +1,515 @@
+import argparse
+import hashlib
+import os
+import pickle
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import metricas
+from arranque import importar_perezoso
+
+pd = importar_perezoso("pandas")
+
+
+# Directorio de archivos Excel
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "materiales")
+# Snapshot precompilado con todos los catálogos ya normalizados
+SNAPSHOT_PATH = os.path.join(BASE_DIR, "catalogos.snapshot")
+SNAPSHOT_FORMATO = 1
+
+
+class CatalogoInvalido(ValueError):
+    pass
+
+
+# ===================================
+# Normalización de cada libro
+# ===================================
+# Cada función recibe el DataFrame tal como lo devuelve pd.read_excel y aplica
+# la misma limpieza que antes hacía cada ruta al leer el archivo.
+
+def _limpiar_texto(serie):
+    return serie.map(lambda v: v.strip() if isinstance(v, str) else v)
+
+
+def _normalizar_base(df):
+    df.columns = df.columns.str.strip()
+    for col in ("DIÁMETRO", "TIPO", "DIÁMETRO CSG"):
+        if col in df.columns:
+            df[col] = _limpiar_texto(df[col])
+    if "4.CANTIDAD" in df.columns:
+        df["4.CANTIDAD"] = pd.to_numeric(df["4.CANTIDAD"], errors="coerce")
+    return df
+
+
+def _normalizar_diametro(df):
+    df = _normalizar_base(df)
+    df["DIÁMETRO"] = df["DIÁMETRO"].astype(str).str.strip()
+    return df
+
+
+def _normalizar_profundiza(df):
+    df = _normalizar_base(df)
+    for col in df.columns:
+        if df[col].dtype == object:
+            df[col] = df[col].astype(str).str.strip()
+    # Reemplazar valores 'nan'
+    if "TIPO" in df.columns:
+        df["TIPO"] = df["TIPO"].replace("nan", "").fillna("")
+    if "DIÁMETRO CSG" in df.columns:
+        df["DIÁMETRO CSG"] = df["DIÁMETRO CSG"].replace("nan", "").fillna("")
+    return df
+
+
+def _normalizar_general(df):
+    df = _normalizar_base(df)
+    # Si no existe la columna "4.CANTIDAD", se crea con 0
+    if "4.CANTIDAD" not in df.columns:
+        df["4.CANTIDAD"] = 0
+    return df
+
+
+CATALOGOS = {
+    "ajuste de medida.xlsx": _normalizar_diametro,
+    "saca tubing.xlsx": _normalizar_base,
+    "baja tubing.xlsx": _normalizar_base,
+    "profundiza.xlsx": _normalizar_profundiza,
+    "baja varillas.xlsx": _normalizar_diametro,
+    "abandono-recupero.xlsx": _normalizar_base,
+    "WO.xlsx": _normalizar_base,
+    "GENERAL(1).xlsx": _normalizar_general,
+}
+
+# Columnas que cada flujo necesita encontrar en su libro
+_COLUMNAS_MATERIAL = ["1. Cód.SAP", "2. MATERIAL", "3. Descripción", "4.CANTIDAD"]
+COLUMNAS_REQUERIDAS = {
+    "ajuste de medida.xlsx": _COLUMNAS_MATERIAL + [
+        "DIÁMETRO", "TIPO", "GRADO DE ACERO", "GRADO DE ACERO CUPLA", "TIPO DE CUPLA"],
+    "saca tubing.xlsx": _COLUMNAS_MATERIAL + ["DIÁMETRO"],
+    "baja tubing.xlsx": _COLUMNAS_MATERIAL + ["DIÁMETRO", "TIPO", "DIÁMETRO CSG"],
+    "profundiza.xlsx": _COLUMNAS_MATERIAL + ["DIÁMETRO"],
+    "baja varillas.xlsx": _COLUMNAS_MATERIAL + ["DIÁMETRO", "TIPO"],
+    "abandono-recupero.xlsx": _COLUMNAS_MATERIAL + ["DIÁMETRO", "DIÁMETRO CSG"],
+    "WO.xlsx": _COLUMNAS_MATERIAL,
+    "GENERAL(1).xlsx": _COLUMNAS_MATERIAL,
+}
+
+
+def validar_catalogo(nombre, df):
+    faltantes = [col for col in COLUMNAS_REQUERIDAS[nombre] if col not in df.columns]
+    if faltantes:
+        raise CatalogoInvalido(
+            f"{nombre}: faltan las columnas {', '.join(repr(c) for c in faltantes)}"
+        )
+
+
+def leer_catalogo_excel(nombre):
+    """Parsea, normaliza y valida materiales/<nombre> desde el xlsx."""
+    df = CATALOGOS[nombre](pd.read_excel(os.path.join(BASE_DIR, nombre)))
+    validar_catalogo(nombre, df)
+    return df
+
+
+# ===================================
+# Caché en memoria
+# ===================================
+# Cada libro se parsea una sola vez por proceso. Cada carga es una versión
+# inmutable del catálogo (_Entrada) con su firma (mtime, tamaño del xlsx) y
+# sus estructuras derivadas; publicar una versión nueva es reemplazar la
+# entrada en _cache, así un request ve la versión anterior o la nueva entera.
+#
+# Con la vigilancia activa (ver más abajo) los requests no miran el disco: un
+# thread detecta los cambios en materiales/ y publica la versión nueva. Sin
+# ella, cada acceso compara la firma del archivo y, si cambió, lo vuelve a
+# leer en el request, como antes.
+
+class _Entrada:
+    __slots__ = ("firma", "df", "version", "derivados")
+
+    def __init__(self, firma, df, version):
+        self.firma = firma
+        self.df = df
+        self.version = version
+        # clave -> estructura derivada de esta versión (ver derivado)
+        self.derivados = {}
+
+
+_cache = {}
+_lock = threading.Lock()
+# Un lock de lectura por libro, así el precalentamiento lee varios a la vez
+_locks_lectura = {nombre: threading.Lock() for nombre in CATALOGOS}
+_version = 0
+
+# Versiones anteriores que se conservan para las sesiones fijadas a ellas
+VERSIONES_RETENIDAS = int(os.environ.get("BM_VERSIONES_RETENIDAS", 3))
+_historial = {nombre: OrderedDict() for nombre in CATALOGOS}   # nombre -> {firma: _Entrada}
+
+# clave de derivado -> construir(df), para armar los derivados de una versión
+# nueva antes de publicarla
+_constructores = {nombre: {} for nombre in CATALOGOS}
+
+
+def _firma(path):
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def firma_catalogo(nombre):
+    return _firma(os.path.join(BASE_DIR, nombre))
+
+
+def _publicar(nombre, firma, df, derivados=None):
+    global _version
+    with _lock:
+        _version += 1
+        entrada = _Entrada(firma, df, _version)
+        entrada.derivados.update(derivados or {})
+        historial = _historial[nombre]
+        historial[firma] = entrada
+        historial.move_to_end(firma)
+        while len(historial) > VERSIONES_RETENIDAS:
+            historial.popitem(last=False)
+        _cache[nombre] = entrada
+    return entrada
+
+
+# El snapshot precompilado se lee recién cuando se pide el primer catálogo,
+# así importar este módulo no carga pandas
+_snapshot_pendiente = True
+_lock_snapshot = threading.Lock()
+
+
+def _leer_snapshot_pendiente():
+    with _lock_snapshot:
+        if _snapshot_pendiente:
+            cargar_snapshot()
+
+
+def _entrada_actual(nombre):
+    if nombre not in CATALOGOS:
+        raise KeyError(f"Catálogo desconocido: {nombre}")
+    entrada = _cache.get(nombre)
+    if entrada is None and _snapshot_pendiente:
+        _leer_snapshot_pendiente()
+        entrada = _cache.get(nombre)
+    if entrada is not None and (vigilando() or entrada.firma == firma_catalogo(nombre)):
+        metricas.contar_cache(nombre, "hit")
+        return entrada
+    with _locks_lectura[nombre]:
+        firma = firma_catalogo(nombre)
+        entrada = _cache.get(nombre)
+        if entrada is not None and entrada.firma == firma:
+            metricas.contar_cache(nombre, "hit")
+            return entrada
+        metricas.contar_cache(nombre, "miss")
+        with metricas.etapa("carga_catalogo"):
+            df = leer_catalogo_excel(nombre)
+        return _publicar(nombre, firma, df)
+
+
+def _entrada(nombre):
+    """Versión del catálogo que corresponde al request actual (ver fijar_versiones)."""
+    fijadas = getattr(_fijadas, "firmas", None)
+    if fijadas is not None:
+        firma = fijadas.get(nombre)
+        if firma is not None:
+            entrada = _historial[nombre].get(firma)
+            if entrada is not None:
+                return entrada
+    entrada = _entrada_actual(nombre)
+    if fijadas is not None and fijadas.get(nombre) != entrada.firma:
+        # Primer uso en la sesión, o una versión que este proceso ya no tiene
+        fijadas[nombre] = entrada.firma
+        _fijadas.cambio = True
+    return entrada
+
+
+def cargar_catalogo(nombre):
+    """Devuelve el DataFrame normalizado de materiales/<nombre>.
+
+    El DataFrame es compartido entre requests: quien necesite modificarlo debe
+    trabajar sobre una copia.
+    """
+    return _entrada(nombre).df
+
+
+def catalogo_en_version(nombre, firma):
+    """DataFrame de la versión `firma` de materiales/<nombre>, o None si este proceso ya no la tiene."""
+    entrada = _historial[nombre].get(firma)
+    if entrada is None:
+        entrada = _entrada_actual(nombre)
+        if entrada.firma != firma:
+            return None
+    return entrada.df
+
+
+def version_catalogo(nombre):
+    """Versión del catálogo cargado en memoria (cambia con cada recarga)."""
+    return _entrada(nombre).version
+
+
+def versiones_cargadas():
+    """{nombre: versión} de los catálogos ya cargados, sin leer ni verificar archivos."""
+    fijadas = getattr(_fijadas, "firmas", None) or {}
+    versiones = {}
+    for nombre, entrada in list(_cache.items()):
+        fijada = _historial[nombre].get(fijadas.get(nombre))
+        versiones[nombre] = (fijada or entrada).version
+    return versiones
+
+
+# Estructuras derivadas de un catálogo (índices, opciones precalculadas).
+# Se construyen una vez por versión y se guardan en la entrada de esa versión.
+
+def registrar_derivado(nombre, clave, construir):
+    """Declara un derivado para que la vigilancia lo arme antes de publicar cada versión."""
+    _constructores[nombre][clave] = construir
+
+
+def derivado(nombre, clave, construir):
+    registrar_derivado(nombre, clave, construir)
+    entrada = _entrada(nombre)
+    valor = entrada.derivados.get(clave)
+    if valor is None:
+        valor = construir(entrada.df)
+        entrada.derivados[clave] = valor
+    return valor
+
+
+def limpiar_cache():
+    with _lock:
+        _cache.clear()
+        for historial in _historial.values():
+            historial.clear()
+
+
+# ===================================
+# Versiones fijadas por sesión
+# ===================================
+# Una corrida del asistente usa siempre la misma versión de cada catálogo: la
+# primera vez que un request de la sesión lee un catálogo se anota su firma,
+# y los requests siguientes de esa sesión leen esa versión aunque ya se haya
+# publicado otra (mientras siga en el historial del proceso; si no, pasan a la
+# actual). La app guarda las firmas en una cookie y las fija al empezar cada
+# request; fuera de un request no hay nada fijado y se usa la versión actual.
+
+_fijadas = threading.local()
+
+
+def fijar_versiones(firmas, cambio=False):
+    _fijadas.firmas = dict(firmas)
+    _fijadas.cambio = cambio
+
+
+def soltar_versiones():
+    """Firmas fijadas durante el request y si cambiaron; deja de fijarlas."""
+    firmas = getattr(_fijadas, "firmas", None)
+    cambio = getattr(_fijadas, "cambio", False)
+    _fijadas.firmas = None
+    _fijadas.cambio = False
+    return firmas, cambio
+
+
+def firma_en_uso(nombre):
+    """Firma de la versión que ve el request actual, sin cargar el catálogo si no está cargado."""
+    fijadas = getattr(_fijadas, "firmas", None)
+    if fijadas is not None and nombre in fijadas:
+        return fijadas[nombre]
+    entrada = _cache.get(nombre)
+    firma = entrada.firma if entrada is not None and vigilando() else firma_catalogo(nombre)
+    if fijadas is not None:
+        fijadas[nombre] = firma
+        _fijadas.cambio = True
+    return firma
+
+
+def codificar_versiones(firmas):
+    nombres = list(CATALOGOS)
+    return ".".join(
+        f"{nombres.index(nombre)}_{mtime:x}_{tamano:x}"
+        for nombre, (mtime, tamano) in sorted(firmas.items()) if nombre in CATALOGOS
+    )
+
+
+def decodificar_versiones(texto):
+    nombres = list(CATALOGOS)
+    firmas = {}
+    for parte in (texto or "").split("."):
+        try:
+            indice, mtime, tamano = parte.split("_")
+            firmas[nombres[int(indice)]] = (int(mtime, 16), int(tamano, 16))
+        except (ValueError, IndexError):
+            continue
+    return firmas
+
+
+# ===================================
+# Vigilancia de materiales/
+# ===================================
+# Un thread por proceso revisa cada BM_VIGILAR_SEGUNDOS (default 2; 0 la
+# desactiva) la firma de cada xlsx. Un cambio se toma recién cuando la firma
+# se repite en dos revisiones seguidas, así no se lee un archivo a medio
+# copiar; además se vuelve a verificar la firma después de leerlo. La
+# versión nueva se lee, normaliza y valida fuera del camino de los requests,
+# se le arman los mismos derivados que tenía la anterior y recién entonces
+# se publica. Si el libro nuevo es inválido se sigue sirviendo el anterior.
+
+INTERVALO_VIGILANCIA = float(os.environ.get("BM_VIGILAR_SEGUNDOS", 2))
+
+_vigilante_pid = None
+_lock_vigilante = threading.Lock()
+
+
+def vigilando():
+    # Los threads no sobreviven a un fork: en un worker nuevo hay que lanzarlo de nuevo
+    return _vigilante_pid == os.getpid()
+
+
+def iniciar_vigilancia(intervalo=INTERVALO_VIGILANCIA):
+    global _vigilante_pid
+    if intervalo <= 0 or vigilando():
+        return
+    with _lock_vigilante:
+        if vigilando():
+            return
+        _vigilante_pid = os.getpid()
+        threading.Thread(target=_vigilar, args=(intervalo,), name="vigilar-materiales", daemon=True).start()
+
+
+def recargar_catalogo(nombre, firma):
+    """Lee la versión `firma` del libro y la publica. Devuelve la entrada o None si no es estable."""
+    with _locks_lectura[nombre]:
+        actual = _cache.get(nombre)
+        if actual is not None and actual.firma == firma:
+            return actual
+        with metricas.etapa("carga_catalogo"):
+            df = leer_catalogo_excel(nombre)
+        if firma_catalogo(nombre) != firma:
+            # Se modificó mientras se leía: se toma en la próxima revisión
+            return None
+        derivados = {clave: construir(df) for clave, construir in list(_constructores[nombre].items())}
+        return _publicar(nombre, firma, df, derivados)
+
+
+def _vigilar(intervalo):
+    candidatas = {}
+    while True:
+        time.sleep(intervalo)
+        for nombre in CATALOGOS:
+            try:
+                firma = firma_catalogo(nombre)
+            except OSError:
+                continue
+            actual = _cache.get(nombre)
+            if actual is None or actual.firma == firma:
+                # Los que nunca se cargaron se leen en el primer uso
+                candidatas.pop(nombre, None)
+                continue
+            if candidatas.get(nombre) != firma:
+                candidatas[nombre] = firma
+                continue
+            try:
+                if recargar_catalogo(nombre, firma) is not None:
+                    candidatas.pop(nombre, None)
+            except Exception as e:
+                print(f"No se pudo recargar {nombre}: {e}", file=sys.stderr)
+                candidatas.pop(nombre, None)
+
+
+# ===================================
+# Snapshot precompilado
+# ===================================
+# `python catalogo.py` lee todos los libros una vez, los normaliza y valida, y
+# escribe un único pickle con los DataFrames listos. Al arrancar, la app toma
+# del snapshot cada catálogo cuyo xlsx no cambió desde la compilación (mismo
+# sha1); el resto se sigue leyendo del Excel. El Procfile lo corre antes de
+# gunicorn pero ignora su error: con un libro inválido la app arranca igual y
+# sólo falla el flujo que usa ese catálogo.
+
+def sha1_catalogo(nombre):
+    return _sha1(os.path.join(BASE_DIR, nombre))
+
+
+def _sha1(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 16), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def compilar_snapshot(salida=SNAPSHOT_PATH):
+    catalogos = {}
+    errores = []
+    for nombre in CATALOGOS:
+        path = os.path.join(BASE_DIR, nombre)
+        try:
+            df = leer_catalogo_excel(nombre)
+        except CatalogoInvalido as e:
+            errores.append(str(e))
+            continue
+        except Exception as e:
+            errores.append(f"{nombre}: {e}")
+            continue
+        catalogos[nombre] = {"sha1": _sha1(path), "df": df}
+    if errores:
+        raise CatalogoInvalido("\n".join(errores))
+    tmp = salida + ".tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump({"formato": SNAPSHOT_FORMATO, "catalogos": catalogos}, f,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, salida)
+    return catalogos
+
+
+def cargar_snapshot(path=SNAPSHOT_PATH):
+    """Precarga la caché desde el snapshot. Devuelve los catálogos tomados de él."""
+    global _snapshot_pendiente
+    _snapshot_pendiente = False
+    try:
+        with open(path, "rb") as f:
+            snapshot = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return []
+    if snapshot.get("formato") != SNAPSHOT_FORMATO:
+        return []
+    cargados = []
+    for nombre, datos in snapshot["catalogos"].items():
+        path_xlsx = os.path.join(BASE_DIR, nombre)
+        if nombre not in CATALOGOS or not os.path.exists(path_xlsx):
+            continue
+        # Snapshot desactualizado para este libro: se leerá del xlsx
+        if _sha1(path_xlsx) != datos["sha1"]:
+            continue
+        _publicar(nombre, _firma(path_xlsx), datos["df"])
+        cargados.append(nombre)
+    return cargados
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compila materiales/*.xlsx en un snapshot normalizado."
+    )
+    parser.add_argument("--salida", default=SNAPSHOT_PATH)
+    parser.add_argument("--opciones", default=None,
+                        help="snapshot de opciones sin pandas (default: materiales/opciones.snapshot)")
+    args = parser.parse_args()
+    try:
+        compilados = compilar_snapshot(args.salida)
+    except CatalogoInvalido as e:
+        print(f"Error en los catálogos:\n{e}", file=sys.stderr)
+        sys.exit(1)
+    for nombre, datos in compilados.items():
+        print(f"{nombre}: {len(datos['df'])} filas")
+    print(f"Snapshot escrito en {args.salida}")
+
+    # Opciones de las páginas de selección, en tipos de Python (ver indices.py).
+    # indices importa "catalogo" como módulo aparte: se le pasa el snapshot
+    # recién escrito para no volver a leer los Excel.
+    import catalogo as modulo_catalogo
+    import indices
+    modulo_catalogo.cargar_snapshot(args.salida)
+    salida_opciones = indices.compilar_opciones(args.opciones or indices.OPCIONES_PATH)
+    print(f"Opciones escritas en {salida_opciones}")
@@ -0,0 +1,99 @@
+import zlib
+
+try:
+    import brotli
+except ImportError:  # Sin el paquete brotli se comprime sólo con gzip
+    brotli = None
+
+
+# ===================================
+# Compresión de respuestas
+# ===================================
+# Las respuestas de texto (HTML, JSON, CSS, JS, /metrics) salen comprimidas
+# con brotli o gzip según el Accept-Encoding del cliente; en los enlaces
+# lentos de campo el HTML de flujo_final y de la selección del Flujo H se
+# reduce a una fracción. Las respuestas en streaming se comprimen bloque por
+# bloque con un flush de sincronización después de cada uno, así cada bloque
+# llega al navegador apenas se genera en lugar de quedar en el buffer del
+# compresor.
+#
+# No se tocan: las que ya traen Content-Encoding (el paquete de opciones), las
+# que tienen ETag (la misma ETag no puede nombrar dos codificaciones, y las
+# exportaciones se revalidan con ella), los archivos enviados con send_file y
+# las respuestas chicas, donde la compresión no ahorra nada.
+
+TIPOS = {
+    "text/html",
+    "text/css",
+    "text/plain",
+    "text/javascript",
+    "application/javascript",
+    "application/json",
+}
+MINIMO_BYTES = 512
+NIVEL_GZIP = 6
+CALIDAD_BROTLI = 5  # calidad 11 es mucho más lenta y casi no achica más el HTML
+
+
+def elegir(aceptadas):
+    """Codificación a usar según el Accept-Encoding ya parseado, o None."""
+    if brotli is not None and aceptadas["br"]:
+        return "br"
+    if aceptadas["gzip"]:
+        return "gzip"
+    return None
+
+
+def _compresor(codificacion):
+    # (comprimir, vaciar, terminar)
+    if codificacion == "br":
+        compresor = brotli.Compressor(quality=CALIDAD_BROTLI)
+        return compresor.process, compresor.flush, compresor.finish
+    # wbits=31: formato gzip, con mtime 0 (el mismo cuerpo da los mismos bytes)
+    compresor = zlib.compressobj(NIVEL_GZIP, zlib.DEFLATED, 31)
+    return compresor.compress, lambda: compresor.flush(zlib.Z_SYNC_FLUSH), compresor.flush
+
+
+def comprimir(datos, codificacion):
+    comprimir_, _, terminar = _compresor(codificacion)
+    return comprimir_(datos) + terminar()
+
+
+def comprimir_bloques(bloques, codificacion):
+    comprimir_, vaciar, terminar = _compresor(codificacion)
+    for bloque in bloques:
+        salida = comprimir_(bloque) + vaciar()
+        if salida:
+            yield salida
+    yield terminar()
+
+
+def comprimir_respuesta(response, aceptadas):
+    """Comprime `response` en el lugar si corresponde (ver arriba)."""
+    if response.mimetype not in TIPOS:
+        return response
+    response.vary.add("Accept-Encoding")
+    if (
+        response.status_code != 200
+        or response.direct_passthrough
+        or "Content-Encoding" in response.headers
+        or "ETag" in response.headers
+    ):
+        return response
+    codificacion = elegir(aceptadas)
+    if codificacion is None:
+        return response
+    if response.is_streamed:
+        original = response.response
+        response.response = comprimir_bloques(response.iter_encoded(), codificacion)
+        # Cerrar el original termina la generación (y su medición en métricas)
+        if hasattr(original, "close"):
+            response.call_on_close(original.close)
+        response.headers.pop("Content-Length", None)
+    else:
+        datos = response.get_data()
+        if len(datos) < MINIMO_BYTES:
+            return response
+        response.set_data(comprimir(datos, codificacion))
+    response.headers["Content-Encoding"] = codificacion
+    return response
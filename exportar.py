@@ -0,0 +1,215 @@
+import csv
+import hashlib
+import io
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from arranque import importar_perezoso
+
+pd = importar_perezoso("pandas")
+xlsxwriter = importar_perezoso("xlsxwriter")
+
+
+# ===================================
+# Exportación en streaming
+# ===================================
+# Cada función devuelve un generador de bloques de bytes para usar como
+# cuerpo de la respuesta. El CSV/TSV se va emitiendo a medida que se escriben
+# las filas. El xlsx se escribe con xlsxwriter en modo constant_memory (cada
+# fila va directo a disco, sin armar el libro en memoria) y el archivo se
+# envía por bloques; como un xlsx es un zip, recién se puede enviar cuando
+# el libro está cerrado.
+
+HOJA_CONSOLIDADA = "Materiales Consolidados"
+TAMANO_BLOQUE = 64 * 1024
+FILAS_POR_BLOQUE = 500
+
+FORMATOS = {
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx"),
+    "csv": ("text/csv", "csv"),
+    "tsv": ("text/tab-separated-values", "tsv"),
+}
+
+
+def _celda(valor):
+    if valor is None:
+        return None
+    try:
+        if pd.isna(valor):
+            return None
+    except (TypeError, ValueError):
+        pass
+    # Tipos de numpy -> tipos de Python que xlsxwriter/csv entienden
+    return valor.item() if hasattr(valor, "item") else valor
+
+
+def _nombre_hoja(flujo, usados):
+    nombre = flujo[:31]
+    n = 2
+    while nombre in usados:
+        sufijo = f" ({n})"
+        nombre = flujo[:31 - len(sufijo)] + sufijo
+        n += 1
+    usados.add(nombre)
+    return nombre
+
+
+def _escribir_hoja(workbook, nombre, df, formato_encabezado, progreso=None):
+    hoja = workbook.add_worksheet(nombre)
+    hoja.write_row(0, 0, [str(c) for c in df.columns], formato_encabezado)
+    for fila, valores in enumerate(df.itertuples(index=False, name=None), start=1):
+        for col, valor in enumerate(valores):
+            valor = _celda(valor)
+            if valor is None:
+                continue
+            hoja.write(fila, col, valor)
+        if progreso is not None and fila % FILAS_POR_BLOQUE == 0:
+            progreso(FILAS_POR_BLOQUE)
+    if progreso is not None:
+        progreso(len(df) % FILAS_POR_BLOQUE)
+
+
+def generar_xlsx(consolidado, resultados=None, progreso=None):
+    """Libro con la hoja consolidada y, si se pasan `resultados`, una hoja por flujo.
+
+    `progreso(n)`, si se pasa, se llama a medida que se escriben las filas.
+    """
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        workbook = xlsxwriter.Workbook(path, {"constant_memory": True})
+        encabezado = workbook.add_format({"bold": True, "border": 1, "align": "center"})
+        _escribir_hoja(workbook, HOJA_CONSOLIDADA, consolidado, encabezado, progreso)
+        usados = {HOJA_CONSOLIDADA}
+        for flujo, df in resultados or []:
+            _escribir_hoja(workbook, _nombre_hoja(flujo, usados), df, encabezado, progreso)
+        workbook.close()
+    except Exception:
+        os.remove(path)
+        raise
+
+    def bloques():
+        try:
+            with open(path, "rb") as f:
+                for bloque in iter(lambda: f.read(TAMANO_BLOQUE), b""):
+                    yield bloque
+        finally:
+            os.remove(path)
+
+    return bloques()
+
+
+def generar_csv(consolidado, separador=",", progreso=None):
+    """Filas del consolidado en CSV/TSV, emitidas de a bloques."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=separador, lineterminator="\r\n")
+    # BOM para que Excel abra el archivo como UTF-8
+    buffer.write("\ufeff")
+    writer.writerow([str(c) for c in consolidado.columns])
+    for i, valores in enumerate(consolidado.itertuples(index=False, name=None), start=1):
+        celdas = [_celda(v) for v in valores]
+        writer.writerow(["" if v is None else v for v in celdas])
+        if i % FILAS_POR_BLOQUE == 0:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+            if progreso is not None:
+                progreso(FILAS_POR_BLOQUE)
+    yield buffer.getvalue().encode("utf-8")
+    if progreso is not None:
+        progreso(len(consolidado) % FILAS_POR_BLOQUE)
+
+
+# ===================================
+# Cache de exportaciones
+# ===================================
+# Apretar "Exportar a Excel" varias veces con la misma lista no debería volver
+# a consolidar ni a codificar el archivo. La huella de una lista de resultados
+# sale de las claves de sus resultados compactos, que incluyen la versión de
+# catálogo de cada uno; con ella se guardan los bytes de cada formato y se
+# arma el ETag de la descarga. La app guarda en el mismo cache el consolidado
+# de cada lista (ver flujos.Consolidado). Las entradas se desalojan por LRU al
+# superar el tope de bytes (BM_EXPORTACIONES_MAX_BYTES, default 64 MB).
+
+MAX_BYTES_CACHE_DEFAULT = 64 * 1024 * 1024
+
+
+def huella(resultados):
+    """Hash de los resultados compactos de la sesión (ver resultados.Resultado).
+
+    La clave de cada resultado ya incluye la firma de la versión de catálogo
+    de la que sale.
+    """
+    h = hashlib.sha1()
+    for resultado in resultados:
+        h.update(resultado.clave.encode("utf-8"))
+    return h.hexdigest()
+
+
+class CacheExportaciones:
+    def __init__(self, max_bytes=MAX_BYTES_CACHE_DEFAULT):
+        self.max_bytes = max_bytes
+        # clave -> (tamaño, valor), ordenado de menos a más reciente
+        self._datos = OrderedDict()
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def obtener(self, clave):
+        with self._lock:
+            item = self._datos.get(clave)
+            if item is None:
+                return None
+            self._datos.move_to_end(clave)
+            return item[1]
+
+    def guardar(self, clave, valor, tamano):
+        if tamano > self.max_bytes:
+            return
+        with self._lock:
+            anterior = self._datos.pop(clave, None)
+            if anterior is not None:
+                self._total -= anterior[0]
+            self._datos[clave] = (tamano, valor)
+            self._total += tamano
+            while self._total > self.max_bytes:
+                _, (tamano_viejo, _) = self._datos.popitem(last=False)
+                self._total -= tamano_viejo
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
+            self._total = 0
+
+    def archivo(self, clave, generar):
+        """Bloques del archivo: los guardados o, si no hay, los de `generar()`.
+
+        En el segundo caso los bloques se van enviando a medida que se
+        generan y el archivo completo se guarda recién al terminar (si el
+        cliente corta la descarga, no se guarda nada).
+        """
+        contenido = self.obtener(clave)
+        if contenido is not None:
+            return iter([contenido])
+        return self._guardar_al_terminar(clave, generar())
+
+    def _guardar_al_terminar(self, clave, bloques):
+        acumulado = []
+        tamano = 0
+        for bloque in bloques:
+            if acumulado is not None:
+                tamano += len(bloque)
+                if tamano <= self.max_bytes:
+                    acumulado.append(bloque)
+                else:
+                    acumulado = None
+            yield bloque
+        if acumulado is not None:
+            self.guardar(clave, b"".join(acumulado), tamano)
+
+
+def crear_cache_desde_entorno():
+    return CacheExportaciones(
+        int(os.environ.get("BM_EXPORTACIONES_MAX_BYTES", MAX_BYTES_CACHE_DEFAULT))
+    )
@@ -0,0 +1,422 @@
+import metricas
+from arranque import importar_perezoso
+from cantidades import asignar_cantidades
+from catalogo import CatalogoInvalido, cargar_catalogo
+from seleccion import seleccionar_filas
+
+np = importar_perezoso("numpy")
+pd = importar_perezoso("pandas")
+
+
+# ===================================
+# Lógica de cada flujo, independiente de los formularios
+# ===================================
+# Las rutas del asistente y la API JSON (/api/materiales) calculan el
+# resultado de cada flujo con estas funciones, así ambos caminos aplican
+# exactamente los mismos filtros. Cada función devuelve el DataFrame ya
+# renombrado, listo para guardar en la sesión.
+
+COLUMNAS_CLAVE = ["Cód.SAP", "MATERIAL", "Descripción", "CONDICIÓN"]
+
+VALVULAS_PRODUCCION = [
+    {
+        "Cód.SAP": "1000578615",
+        "MATERIAL": "VÁLVULA RETENCIÓN",
+        "Descripción": "V.RET. 2\" NPTHH DURALIT.302009",
+        "4.CANTIDAD": 2,
+        "CONDICIÓN": "NUEVO"
+    },
+    {
+        "Cód.SAP": "230100395",
+        "MATERIAL": "VÁLVULA",
+        "Descripción": "V.ESF.ROS.2\" NPT  2000 A105/316   PT PAL",
+        "4.CANTIDAD": 2,
+        "CONDICIÓN": "NUEVO"
+    }
+]
+
+
+# Función auxiliar para renombrar columnas
+@metricas.medido("renombrar")
+def renombrar_columnas(df):
+    df_renombrado = df.rename(
+        columns={
+            "1. Cód.SAP": "Cód.SAP",
+            "2. MATERIAL": "MATERIAL",
+            "3. Descripción": "Descripción",
+            "5.CONDICIÓN": "CONDICIÓN"
+        }
+    )
+    columnas = ["Cód.SAP", "MATERIAL", "Descripción", "4.CANTIDAD", "CONDICIÓN"]
+    columnas_presentes = [col for col in columnas if col in df_renombrado.columns]
+    return df_renombrado[columnas_presentes]
+
+
+# FLUJO A: Ajuste de medida
+# filtros: {diam: {"tipo", "acero", "acero_cup", "tipo_cup"}}; "TODOS"/"Seleccionar" no filtran
+def flujo_a(diametros, filtros):
+    df = cargar_catalogo("ajuste de medida.xlsx")
+    reglas = []
+    for diam in diametros:
+        f = filtros.get(diam, {})
+        regla = {"DIÁMETRO": [diam]}
+        if f.get("tipo", "TODOS") != "TODOS":
+            regla["TIPO"] = [f["tipo"]]
+        if f.get("acero", "Seleccionar") != "Seleccionar":
+            regla["GRADO DE ACERO"] = [f["acero"]]
+        if f.get("acero_cup", "Seleccionar") != "Seleccionar":
+            regla["GRADO DE ACERO CUPLA"] = [f["acero_cup"]]
+        if f.get("tipo_cup", "Seleccionar") != "Seleccionar":
+            regla["TIPO DE CUPLA"] = [f["tipo_cup"]]
+        reglas.append(regla)
+    return renombrar_columnas(seleccionar_filas("ajuste de medida.xlsx", df, reglas))
+
+
+# FLUJO B: Saca Tubing
+# cantidades: {diam: cantidad}
+def flujo_b(diametros, cantidades):
+    df = cargar_catalogo("saca tubing.xlsx")
+    with metricas.etapa("filtrado"):
+        df_filtered = df[(df["DIÁMETRO"].isin(diametros)) | (df["DIÁMETRO"].str.upper() == "TODOS")].copy()
+    asignar_cantidades(df_filtered, ["DIÁMETRO"], [((diam,), qty) for diam, qty in cantidades.items()])
+    return renombrar_columnas(df_filtered)
+
+
+# FLUJO C: Baja Tubing
+# tipos: {diam: [tipos]}; cantidades: {(diam, tipo): cantidad}
+def flujo_c(tipos, diacsg, cantidades):
+    df = cargar_catalogo("baja tubing.xlsx")
+    reglas = [
+        {"DIÁMETRO": [diam], "TIPO": [tipo], "DIÁMETRO CSG": [diacsg]}
+        for diam, lista in tipos.items()
+        for tipo in lista
+    ]
+    # Copia: las cantidades se asignan directamente sobre las filas elegidas.
+    # Las tres columnas aceptan "TODOS"; una fila que coincide con varios
+    # pares (diámetro, tipo) toma la cantidad del primero
+    filtered_df = seleccionar_filas("baja tubing.xlsx", df, reglas).copy()
+    asignar_cantidades(
+        filtered_df,
+        ["DIÁMETRO", "TIPO", "DIÁMETRO CSG"],
+        [((diam, tipo, diacsg), qty) for (diam, tipo), qty in cantidades.items()],
+        comodines=["DIÁMETRO", "TIPO", "DIÁMETRO CSG"],
+    )
+    return renombrar_columnas(filtered_df)
+
+
+# FLUJO D: Profundiza
+COLUMNAS_PROFUNDIZA = ["DIÁMETRO", "DIÁMETRO CSG"]
+
+
+def columna_profundiza(df):
+    # Si existe "DIÁMETRO", se usa; sino, "DIÁMETRO CSG"
+    for col in COLUMNAS_PROFUNDIZA:
+        if col in df.columns:
+            return col
+    return None
+
+
+# cantidades: {valor: cantidad}
+def flujo_d(col, valores, cantidades):
+    df = cargar_catalogo("profundiza.xlsx")
+    # Filtrar el DataFrame según la columna y los valores seleccionados
+    with metricas.etapa("filtrado"):
+        filtered_df = df[df[col].isin(valores)].copy()
+    asignar_cantidades(filtered_df, [col], [((val,), qty) for val, qty in cantidades.items()])
+    return renombrar_columnas(filtered_df)
+
+
+# FLUJO E: Baja Varilla
+def filtros_varillas(tipos, acero, acero_cup, tipo_cup):
+    # Cada filtro elegido se amplía con "TODOS"; una lista vacía no filtra
+    def con_todos(valor):
+        return [valor, "TODOS"] if valor and valor != "Seleccionar" else []
+    return {
+        "tipo_list": list(tipos) + ["TODOS"] if tipos else [],
+        "acero_list": con_todos(acero),
+        "acero_cup_list": con_todos(acero_cup),
+        "tipo_cup_list": con_todos(tipo_cup),
+    }
+
+
+# filtros: {diam: filtros_varillas(...)}; cantidades: {diam: cantidad}
+def flujo_e(diametros, filtros, cantidades):
+    df = cargar_catalogo("baja varillas.xlsx")
+    # Filtros adicionales de cada DIÁMETRO (el valor "TODOS" siempre se incluye).
+    # Las filas que cumplen para más de un DIÁMETRO aparecen una sola vez.
+    reglas = []
+    for diam in diametros:
+        filtros_diam = filtros.get(diam, {})
+        reglas.append({
+            "DIÁMETRO": [diam],
+            "TIPO": filtros_diam.get("tipo_list", []),
+            "GRADO DE ACERO": filtros_diam.get("acero_list", []),
+            "GRADO DE ACERO CUPLA": filtros_diam.get("acero_cup_list", []),
+            "TIPO DE CUPLA": filtros_diam.get("tipo_cup_list", []),
+        })
+    filtered_df = seleccionar_filas("baja varillas.xlsx", df, reglas).copy()
+    # Actualizar la columna "4.CANTIDAD" donde la celda es NaN
+    asignar_cantidades(filtered_df, ["DIÁMETRO"], [((diam,), qty) for diam, qty in cantidades.items()])
+    return renombrar_columnas(filtered_df)
+
+
+# FLUJO F: Abandono/Recupero
+# diametros incluye "TODOS" para el filtrado interno; cantidades: {diam: cantidad}
+def flujo_f(diametros, cantidades):
+    df = cargar_catalogo("abandono-recupero.xlsx")
+    with metricas.etapa("filtrado"):
+        filtered_df = df[df["DIÁMETRO"].isin(diametros)].copy()
+    asignar_cantidades(filtered_df, ["DIÁMETRO"], [((diam,), qty) for diam, qty in cantidades.items()])
+    return renombrar_columnas(filtered_df)
+
+
+# FLUJO G: WO
+def flujo_g():
+    return renombrar_columnas(cargar_catalogo("WO.xlsx"))
+
+
+# FLUJO H: Material de agregación
+# cantidades: {material: cantidad}; devuelve None si no quedó ninguna cantidad asignada
+def flujo_h(cantidades):
+    df_H = cargar_catalogo("GENERAL(1).xlsx").copy()
+    # Para cada material seleccionado, asignar la cantidad en filas sin valor (o <= 0)
+    asignar_cantidades(
+        df_H, ["2. MATERIAL"], [((mat,), qty) for mat, qty in cantidades.items()],
+        reemplazar_no_positivas=True, como_texto=True,
+    )
+    # Solo los materiales con cantidad mayor que 0
+    with metricas.etapa("filtrado"):
+        assigned_df = df_H[df_H["2. MATERIAL"].astype(str).isin(list(cantidades)) & (df_H["4.CANTIDAD"] > 0)]
+    if assigned_df.empty:
+        return None
+    return renombrar_columnas(assigned_df)
+
+
+# FLUJO I: Válvulas de puente de producción
+def flujo_i():
+    return renombrar_columnas(pd.DataFrame(VALVULAS_PRODUCCION))
+
+
+# ===================================
+# Consolidación
+# ===================================
+# La lista consolidada une los resultados de todos los flujos: las filas
+# repetidas (mismas cinco columnas, aunque vengan de flujos distintos) cuentan
+# una sola vez, se suma "4.CANTIDAD" por COLUMNAS_CLAVE y "Flujo" es el último
+# flujo, en el orden de la lista, que incluye el material.
+#
+# Consolidado mantiene ese resultado a medida que se guardan los flujos, en
+# lugar de rehacerlo desde cero en cada exportación. Por clave guarda qué
+# flujos aportan cada cantidad distinta; guardar un flujo que ya estaba
+# reemplaza sólo su aporte (y conserva su lugar en la lista), y sólo se
+# recalculan las claves que tocó. `tabla` arma el DataFrame para mostrar o
+# exportar la primera vez que se pide después de un cambio.
+
+COLUMNAS_CONSOLIDADO = COLUMNAS_CLAVE + ["4.CANTIDAD", "Flujo"]
+
+
+def _valor(v):
+    # NaN -> None, así sirve como clave de dict
+    return None if v != v else v
+
+
+class Consolidado:
+    def __init__(self):
+        self.flujos = []      # en el orden en que se guardaron por primera vez
+        self._aportes = {}    # flujo -> [(clave, cantidad)] distintos
+        self._tipos = {}      # flujo -> dtype de su "4.CANTIDAD"
+        self._cantidades = {}  # clave -> {cantidad: {flujos}}
+        self._filas = {}      # clave -> (suma, último flujo)
+        self._tabla = None
+
+    @classmethod
+    def desde(cls, resultados):
+        consolidado = cls()
+        for flujo, df in resultados:
+            consolidado.reemplazar(flujo, df)
+        return consolidado
+
+    def __len__(self):
+        return len(self._filas)
+
+    def copiar(self):
+        """Copia independiente: reemplazar en ella no cambia esta (ni su tabla)."""
+        copia = Consolidado()
+        copia.flujos = list(self.flujos)
+        copia._aportes = dict(self._aportes)
+        copia._tipos = dict(self._tipos)
+        copia._cantidades = {
+            clave: {cantidad: set(aportantes) for cantidad, aportantes in cantidades.items()}
+            for clave, cantidades in self._cantidades.items()
+        }
+        copia._filas = dict(self._filas)
+        copia._tabla = self._tabla
+        return copia
+
+    @property
+    def tabla(self):
+        tabla = self._tabla
+        if tabla is None:
+            tabla = self._tabla = self._materializar()
+        return tabla
+
+    def reemplazar(self, flujo, df):
+        """Guarda (o reemplaza) el aporte de `flujo` con las filas de `df`."""
+        with metricas.etapa("consolidar"):
+            tocadas = set()
+            if flujo in self._aportes:
+                for clave, cantidad in self._aportes[flujo]:
+                    aportantes = self._cantidades[clave][cantidad]
+                    aportantes.discard(flujo)
+                    if not aportantes:
+                        del self._cantidades[clave][cantidad]
+                    tocadas.add(clave)
+            else:
+                self.flujos.append(flujo)
+
+            columnas = [df[col] if col in df.columns else pd.Series(None, index=df.index, dtype=object)
+                        for col in COLUMNAS_CLAVE + ["4.CANTIDAD"]]
+            aporte = list(dict.fromkeys(
+                (tuple(_valor(v) for v in fila[:-1]), _valor(fila[-1])) for fila in zip(*columnas)
+            ))
+            for clave, cantidad in aporte:
+                self._cantidades.setdefault(clave, {}).setdefault(cantidad, set()).add(flujo)
+                tocadas.add(clave)
+            self._aportes[flujo] = aporte
+            self._tipos[flujo] = df["4.CANTIDAD"].dtype if "4.CANTIDAD" in df.columns else np.dtype(float)
+
+            posicion = {f: i for i, f in enumerate(self.flujos)}
+            for clave in tocadas:
+                cantidades = self._cantidades[clave]
+                if not cantidades:
+                    del self._cantidades[clave]
+                    self._filas.pop(clave, None)
+                    continue
+                ultimo = max((f for aportantes in cantidades.values() for f in aportantes), key=posicion.get)
+                self._filas[clave] = (sum(c for c in cantidades if c is not None), ultimo)
+            self._tabla = None
+
+    def _materializar(self):
+        if not self._filas:
+            return pd.DataFrame(columns=COLUMNAS_CONSOLIDADO)
+        df = pd.DataFrame(
+            [clave + fila for clave, fila in self._filas.items()],
+            columns=COLUMNAS_CONSOLIDADO,
+        )
+        df["4.CANTIDAD"] = df["4.CANTIDAD"].astype(np.result_type(*self._tipos.values()))
+        # Una fila por clave: el groupby sólo da el mismo orden (y el mismo
+        # manejo de claves vacías) que tenía la consolidación completa
+        return df.groupby(COLUMNAS_CLAVE, as_index=False, dropna=False).agg({
+            "4.CANTIDAD": "sum",
+            "Flujo":      "last"
+        })
+
+
+def consolidar(resultados):
+    """Une los resultados [(flujo, df)] en la lista consolidada que se exporta."""
+    return Consolidado.desde(resultados).tabla
+
+
+# ===================================
+# Especificación completa de una orden de trabajo
+# ===================================
+# Usada por /api/materiales. Cada clave es opcional; sólo se calculan los
+# flujos presentes, en el mismo orden que el asistente:
+#
+# {
+#   "ajuste":        {"diametros": {diam: {"tipo", "acero", "acero_cup", "tipo_cup"}}},
+#   "saca_tubing":   {"cantidades": {diam: cantidad}},
+#   "baja_tubing":   {"diametros": {diam: {tipo: cantidad}}, "diacsg": "TODOS"},
+#   "profundiza":    {"cantidades": {valor: cantidad}, "columna": "DIÁMETRO"},
+#   "baja_varillas": {"diametros": {diam: {"tipos": [...], "acero", "acero_cup",
+#                                          "tipo_cup", "cantidad"}}},
+#   "abandono":      {"cantidades": {diam: cantidad}},
+#   "wo":            true,
+#   "general":       {"cantidades": {material: cantidad}},
+#   "valvulas":      true
+# }
+
+class EspecificacionInvalida(ValueError):
+    pass
+
+
+def _cantidad(valor):
+    return None if valor is None else float(valor)
+
+
+def _mapa(spec, clave):
+    valor = spec.get(clave, {})
+    if not isinstance(valor, dict):
+        raise EspecificacionInvalida(f"'{clave}' debe ser un objeto")
+    return valor
+
+
+def calcular_materiales(spec):
+    """Calcula los resultados [(flujo, df)] de una orden de trabajo completa."""
+    if not isinstance(spec, dict):
+        raise EspecificacionInvalida("La especificación debe ser un objeto JSON")
+    resultados = []
+    try:
+        if "ajuste" in spec:
+            diametros = _mapa(_mapa(spec, "ajuste"), "diametros")
+            resultados.append(("FLUJO A", flujo_a(list(diametros), diametros)))
+
+        if "saca_tubing" in spec:
+            cantidades = _mapa(_mapa(spec, "saca_tubing"), "cantidades")
+            resultados.append(("FLUJO B", flujo_b(
+                list(cantidades), {d: _cantidad(q) for d, q in cantidades.items()})))
+
+        if "baja_tubing" in spec:
+            datos = _mapa(spec, "baja_tubing")
+            diametros = _mapa(datos, "diametros")
+            tipos = {d: list(por_tipo) or ["TODOS"] for d, por_tipo in diametros.items()}
+            cantidades = {
+                (d, t): _cantidad(q)
+                for d, por_tipo in diametros.items()
+                for t, q in por_tipo.items()
+            }
+            resultados.append(("FLUJO C", flujo_c(tipos, datos.get("diacsg") or "TODOS", cantidades)))
+
+        if "profundiza" in spec:
+            datos = _mapa(spec, "profundiza")
+            cantidades = _mapa(datos, "cantidades")
+            df_D = cargar_catalogo("profundiza.xlsx")
+            col = datos.get("columna") or columna_profundiza(df_D)
+            validas = [c for c in COLUMNAS_PROFUNDIZA if c in df_D.columns]
+            if col not in validas:
+                raise EspecificacionInvalida(
+                    f"'profundiza.columna' debe ser una de: {', '.join(validas)} (se recibió {col!r})")
+            resultados.append(("FLUJO D", flujo_d(
+                col, list(cantidades), {v: _cantidad(q) for v, q in cantidades.items()})))
+
+        if "baja_varillas" in spec:
+            diametros = _mapa(_mapa(spec, "baja_varillas"), "diametros")
+            filtros = {
+                d: filtros_varillas(f.get("tipos", []), f.get("acero", ""),
+                                    f.get("acero_cup", ""), f.get("tipo_cup", ""))
+                for d, f in diametros.items()
+            }
+            cantidades = {d: _cantidad(f.get("cantidad")) for d, f in diametros.items()}
+            resultados.append(("FLUJO E", flujo_e(list(diametros), filtros, cantidades)))
+
+        if "abandono" in spec:
+            cantidades = _mapa(_mapa(spec, "abandono"), "cantidades")
+            resultados.append(("FLUJO F", flujo_f(
+                list(cantidades) + ["TODOS"], {d: _cantidad(q) for d, q in cantidades.items()})))
+
+        if spec.get("wo"):
+            resultados.append(("FLUJO G", flujo_g()))
+
+        if "general" in spec:
+            cantidades = _mapa(_mapa(spec, "general"), "cantidades")
+            df_H = flujo_h({m: _cantidad(q) for m, q in cantidades.items()})
+            if df_H is not None:
+                resultados.append(("FLUJO H", df_H))
+
+        if spec.get("valvulas"):
+            resultados.append(("FLUJO I", flujo_i()))
+    except (EspecificacionInvalida, CatalogoInvalido):
+        raise
+    except (AttributeError, TypeError, ValueError) as e:
+        raise EspecificacionInvalida(str(e)) from e
+    return resultados
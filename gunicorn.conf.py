@@ -0,0 +1,38 @@
+import os
+
+
+# ===================================
+# Configuración de gunicorn
+# ===================================
+# La app se importa una vez en el master (preload_app) y ahí se precalientan
+# los catálogos, sus índices, las opciones y las plantillas; los workers los
+# heredan por fork sin duplicarlos y nacen listos (ver arranque.precargar).
+# WEB_CONCURRENCY fija la cantidad de workers (el buildpack de Python de
+# Heroku lo pone en 2 o más según el dyno).
+#
+# Con más de un worker cada POST de un flujo puede caer en uno distinto: las
+# sesiones tienen que estar en un backend compartido. Si BM_SESIONES no está
+# definido se usa "sqlite" (archivo local, ver sesiones.py), y con "memoria"
+# explícito no se arranca. Las cachés por proceso (páginas, consolidado,
+# exportaciones) sólo se rearman en cada worker.
+
+workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+if workers > 1:
+    if os.environ.setdefault("BM_SESIONES", "sqlite") == "memoria":
+        raise RuntimeError(
+            f"BM_SESIONES=memoria no sirve con {workers} workers: cada uno tendría sus propias "
+            "sesiones. Usá BM_SESIONES=sqlite (o sqlite:/ruta.db) o WEB_CONCURRENCY=1."
+        )
+timeout = 120
+preload_app = True
+
+
+def when_ready(server):
+    # Corre en el master, después de importar la app y antes del primer fork
+    import arranque
+
+    errores = arranque.precargar(server.app.wsgi())
+    for error in errores:
+        # Un catálogo inválido no impide arrancar: cada worker lo reporta al pedirlo
+        server.log.warning("No se pudo precargar %s", error)
+    server.log.info("Catálogos precargados en el master para %s workers", server.num_workers)
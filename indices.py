@@ -0,0 +1,419 @@
+import gzip
+import json
+import os
+import pickle
+import threading
+
+from arranque import importar_perezoso
+from busqueda import IndiceBusqueda
+from catalogo import BASE_DIR, derivado, firma_catalogo, firma_en_uso, registrar_derivado, sha1_catalogo
+from flujos import columna_profundiza
+
+np = importar_perezoso("numpy")
+pd = importar_perezoso("pandas")
+
+
+# ===================================
+# Índices de opciones para las cascadas de selección
+# ===================================
+# Las páginas de selección de los flujos A, C y E calculaban las opciones del
+# paso siguiente filtrando el Excel con máscaras isin([valor, "TODOS"]) en cada
+# request. Estos índices resuelven las filas "TODOS" una sola vez por versión
+# del catálogo, y cada paso pasa a ser una búsqueda en un diccionario.
+
+TODOS = "TODOS"
+SELECCIONAR = "Seleccionar"
+
+
+def _sin_todos(valores, mayusculas=True):
+    if mayusculas:
+        return sorted(x for x in valores if str(x).upper() != TODOS)
+    return sorted(x for x in valores if x != TODOS)
+
+
+def _unicos(valores):
+    return pd.Series(valores, dtype=object).dropna().unique()
+
+
+class IndiceCascada:
+    """Opciones de cada nivel de una cascada DIÁMETRO → TIPO → ... (Flujo A).
+
+    `niveles` es una lista de (columna, centinela). El centinela es el valor que
+    significa "sin filtro" en ese nivel; el primer nivel (DIÁMETRO) siempre
+    filtra. Las opciones de un nivel se buscan con la tupla de valores elegidos
+    en los niveles anteriores.
+    """
+
+    # En la copia del snapshot de opciones no están las columnas del catálogo;
+    # las combinaciones no precalculadas se piden al índice completo
+    respaldo = None
+
+    def __init__(self, df, niveles):
+        self.niveles = niveles
+        self._valores = [
+            df[col].to_numpy(dtype=object) if col in df.columns else None
+            for col, _ in niveles
+        ]
+        self.diametros = _sin_todos(_unicos(self._valores[0]))
+        self._opciones = {}
+        todas = np.arange(len(df))
+        for diam in self.diametros:
+            self._construir((diam,), self._filtrar(todas, 0, diam))
+
+    def _filtrar(self, filas, nivel, valor):
+        valores = self._valores[nivel][filas]
+        return filas[(valores == valor) | (valores == TODOS)]
+
+    def _opciones_nivel(self, filas, nivel):
+        valores = self._valores[nivel]
+        if valores is None:
+            return [SELECCIONAR]
+        opciones = _sin_todos(_unicos(valores[filas]))
+        return opciones or [TODOS]
+
+    def _construir(self, prefijo, filas):
+        nivel = len(prefijo)
+        opciones = self._opciones_nivel(filas, nivel)
+        self._opciones[prefijo] = opciones
+        if nivel + 1 >= len(self.niveles):
+            return
+        centinela = self.niveles[nivel][1]
+        for valor in set(opciones) | {centinela}:
+            sub = filas if valor == centinela else self._filtrar(filas, nivel, valor)
+            self._construir(prefijo + (valor,), sub)
+
+    def __getstate__(self):
+        estado = dict(self.__dict__)
+        estado["_valores"] = None
+        estado.pop("respaldo", None)
+        return estado
+
+    def opciones(self, *prefijo):
+        """Opciones del nivel len(prefijo) dados los valores elegidos antes."""
+        opciones = self._opciones.get(prefijo)
+        if opciones is not None:
+            return opciones
+        if self._valores is None:
+            return self.respaldo().opciones(*prefijo)
+        # Combinación que no sale de las opciones ofrecidas: se calcula al vuelo
+        filas = np.arange(len(self._valores[0]))
+        for nivel, valor in enumerate(prefijo):
+            if nivel == 0 or valor != self.niveles[nivel][1]:
+                filas = self._filtrar(filas, nivel, valor)
+        return self._opciones_nivel(filas, len(prefijo))
+
+
+NIVELES_AJUSTE = [
+    ("DIÁMETRO", None),
+    ("TIPO", TODOS),
+    ("GRADO DE ACERO", SELECCIONAR),
+    ("GRADO DE ACERO CUPLA", SELECCIONAR),
+    ("TIPO DE CUPLA", SELECCIONAR),
+]
+
+
+class IndiceVarillas:
+    """Opciones de TIPO / GRADO DE ACERO / ... por DIÁMETRO (Flujo E).
+
+    En este flujo las opciones de cada columna se toman sólo de las filas del
+    DIÁMETRO elegido (sin las filas "TODOS") y no se encadenan entre sí.
+    """
+
+    COLUMNAS = {
+        "acero": "GRADO DE ACERO",
+        "acero_cup": "GRADO DE ACERO CUPLA",
+        "tipo_cup": "TIPO DE CUPLA",
+    }
+
+    def __init__(self, df):
+        self.diametros = _sin_todos(df["DIÁMETRO"].dropna().unique())
+        self._por_diametro = {
+            diam: self._filtros(subset) for diam, subset in df.groupby("DIÁMETRO", sort=False)
+        }
+        self._vacio = self._filtros(df.iloc[0:0])
+
+    def _filtros(self, subset):
+        filtros = {"tipos": _sin_todos(subset["TIPO"].dropna().unique()) or [TODOS]}
+        for clave, col in self.COLUMNAS.items():
+            if col in subset.columns:
+                filtros[clave] = _sin_todos(subset[col].dropna().unique())
+            else:
+                filtros[clave] = [SELECCIONAR]
+        return filtros
+
+    def opciones(self, diam):
+        return self._por_diametro.get(diam, self._vacio)
+
+
+class IndiceTubing:
+    """Opciones de TIPO por DIÁMETRO y de DIÁMETRO CSG por (DIÁMETRO, TIPO) (Flujo C)."""
+
+    def __init__(self, df):
+        self.diametros = _sin_todos(df["DIÁMETRO"].dropna().unique(), mayusculas=False)
+        self._tipos = {
+            diam: _sin_todos(subset["TIPO"].dropna().unique(), mayusculas=False) or [TODOS]
+            for diam, subset in df.groupby("DIÁMETRO", sort=False)
+        }
+        self._csg = {}
+        for (diam, tipo), subset in df.groupby(["DIÁMETRO", "TIPO"], sort=False):
+            self._csg[(diam, tipo)] = set(subset["DIÁMETRO CSG"].dropna().unique())
+
+    def tipos(self, diam):
+        return self._tipos.get(diam, [TODOS])
+
+    def opciones_csg(self, diametros, tipos):
+        valores = set()
+        for diam in diametros:
+            for tipo in tipos:
+                valores |= self._csg.get((diam, tipo), set())
+        return _sin_todos(valores, mayusculas=False)
+
+
+# Opciones de los flujos sin índice propio (se leían del DataFrame en cada request)
+
+def _plano(valor):
+    # Escalares de numpy -> tipos de Python, para que el snapshot no dependa de numpy
+    return valor.item() if hasattr(valor, "item") else valor
+
+
+def _diametros_saca(df):
+    return sorted(_plano(d) for d in df["DIÁMETRO"].dropna().unique() if d.upper() != TODOS)
+
+
+def _opciones_profundiza(df):
+    col = columna_profundiza(df)
+    valores = sorted(_plano(v) for v in df[col].dropna().unique().tolist()) if col else []
+    return {"columna": col, "valores": valores}
+
+
+def _opciones_abandono(df):
+    # None: la columna no está en el Excel
+    opciones = {}
+    for clave, col in (("diametros", "DIÁMETRO"), ("diacsg", "DIÁMETRO CSG")):
+        if col in df.columns:
+            opciones[clave] = [_plano(d) for d in df[col].dropna().unique() if d.upper() != TODOS]
+        else:
+            opciones[clave] = None
+    return opciones
+
+
+# Qué se precalcula de cada catálogo: {nombre: {clave: construir(df)}}
+OPCIONES = {
+    "ajuste de medida.xlsx": {"cascada": lambda df: IndiceCascada(df, NIVELES_AJUSTE)},
+    "saca tubing.xlsx": {"diametros": _diametros_saca},
+    "baja tubing.xlsx": {"opciones": IndiceTubing},
+    "profundiza.xlsx": {"opciones": _opciones_profundiza},
+    "baja varillas.xlsx": {"filtros": IndiceVarillas},
+    "abandono-recupero.xlsx": {"opciones": _opciones_abandono},
+    "GENERAL(1).xlsx": {"busqueda": IndiceBusqueda},
+}
+
+for _nombre, _claves in OPCIONES.items():
+    for _clave, _construir in _claves.items():
+        registrar_derivado(_nombre, _clave, _construir)
+
+
+# ===================================
+# Snapshot de opciones sin pandas
+# ===================================
+# `python catalogo.py` guarda además, por catálogo, las opciones de sus páginas
+# de selección (listas, dicts e índices sin las columnas del DataFrame). Leerlo
+# no importa pandas ni numpy, así un worker recién arrancado sirve las páginas
+# de selección sin cargar el stack de datos. Cada catálogo del snapshot vale
+# mientras su xlsx no cambie (mismo sha1 al leerlo, misma firma que la versión
+# en uso después); si cambió, sus opciones se calculan del DataFrame como
+# siempre.
+# BM_OPCIONES_SNAPSHOT=0 lo desactiva.
+
+OPCIONES_PATH = os.path.join(BASE_DIR, "opciones.snapshot")
+OPCIONES_FORMATO = 2
+
+_opciones_snapshot = {}   # nombre -> (firma del xlsx, {clave: opciones})
+_opciones_pendiente = os.environ.get("BM_OPCIONES_SNAPSHOT", "1") != "0"
+_lock_opciones = threading.Lock()
+
+
+def compilar_opciones(salida=OPCIONES_PATH):
+    catalogos = {}
+    for nombre, claves in OPCIONES.items():
+        catalogos[nombre] = {
+            "sha1": sha1_catalogo(nombre),
+            "opciones": {clave: derivado(nombre, clave, construir) for clave, construir in claves.items()},
+        }
+    tmp = salida + ".tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump({"formato": OPCIONES_FORMATO, "catalogos": catalogos}, f,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, salida)
+    return salida
+
+
+def cargar_opciones(path=OPCIONES_PATH):
+    """Toma del snapshot las opciones de los catálogos que no cambiaron. Devuelve sus nombres."""
+    global _opciones_pendiente
+    _opciones_pendiente = False
+    try:
+        with open(path, "rb") as f:
+            snapshot = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        return []
+    if snapshot.get("formato") != OPCIONES_FORMATO:
+        return []
+    cargados = []
+    for nombre, datos in snapshot["catalogos"].items():
+        if nombre not in OPCIONES:
+            continue
+        try:
+            if sha1_catalogo(nombre) != datos["sha1"]:
+                continue
+            firma = firma_catalogo(nombre)
+        except OSError:
+            continue
+        for clave, valor in datos["opciones"].items():
+            if isinstance(valor, IndiceCascada):
+                construir = OPCIONES[nombre][clave]
+                valor.respaldo = lambda nombre=nombre, clave=clave, construir=construir: derivado(nombre, clave, construir)
+        _opciones_snapshot[nombre] = (firma, datos["opciones"])
+        cargados.append(nombre)
+    return cargados
+
+
+def opciones_catalogo(nombre, clave):
+    """Opciones precalculadas `clave` del catálogo: del snapshot si sigue vigente, si no del DataFrame."""
+    if _opciones_pendiente:
+        with _lock_opciones:
+            if _opciones_pendiente:
+                cargar_opciones()
+    item = _opciones_snapshot.get(nombre)
+    if item is not None:
+        try:
+            vigente = item[0] == firma_en_uso(nombre)
+        except OSError:
+            vigente = False
+        if vigente and clave in item[1]:
+            return item[1][clave]
+    return derivado(nombre, clave, OPCIONES[nombre][clave])
+
+
+def indice_ajuste():
+    return opciones_catalogo("ajuste de medida.xlsx", "cascada")
+
+
+def indice_varillas():
+    return opciones_catalogo("baja varillas.xlsx", "filtros")
+
+
+def indice_tubing():
+    return opciones_catalogo("baja tubing.xlsx", "opciones")
+
+
+def diametros_saca():
+    return opciones_catalogo("saca tubing.xlsx", "diametros")
+
+
+def opciones_profundiza():
+    return opciones_catalogo("profundiza.xlsx", "opciones")
+
+
+def opciones_abandono():
+    return opciones_catalogo("abandono-recupero.xlsx", "opciones")
+
+
+def busqueda_general():
+    return opciones_catalogo("GENERAL(1).xlsx", "busqueda")
+
+
+# ===================================
+# Paquetes de opciones para el navegador (Flujos A y E)
+# ===================================
+# Todas las opciones de la cascada de un catálogo en un solo JSON, así la
+# página de selección encadena los desplegables sin volver al servidor y se
+# envía una sola vez. Los textos van una vez en "valores"; el resto los
+# referencia por posición.
+#   ajuste:   "arbol" es un nodo [opciones, hijos]. hijos[i] es el nodo que
+#             sigue a elegir opciones[i] y, si el centinela del nivel no está
+#             entre las opciones, el último hijo es el del centinela ("TODOS" o
+#             "Seleccionar" no filtran). Los nodos del último nivel no tienen
+#             hijos. La raíz tiene los DIÁMETRO.
+#   varillas: "filtros" es {diámetro: {tipos, acero, acero_cup, tipo_cup}}.
+# Cada paquete se arma y se comprime una vez por versión del catálogo. La URL
+# lleva la versión, así el navegador lo guarda sin volver a pedirlo hasta que
+# cambie el Excel.
+
+VERSIONES_PAQUETE = 3
+
+
+class _Valores:
+    def __init__(self):
+        self.lista = []
+        self._posicion = {}
+
+    def __call__(self, valor):
+        posicion = self._posicion.get(valor)
+        if posicion is None:
+            posicion = self._posicion[valor] = len(self.lista)
+            self.lista.append(valor)
+        return posicion
+
+
+def _paquete_ajuste(indice):
+    valores = _Valores()
+
+    def nodo(prefijo):
+        opciones = indice.opciones(*prefijo) if prefijo else indice.diametros
+        nivel = len(prefijo)
+        if nivel + 1 >= len(indice.niveles):
+            return [[valores(o) for o in opciones]]
+        siguientes = list(opciones)
+        centinela = indice.niveles[nivel][1]
+        if centinela is not None and centinela not in siguientes:
+            siguientes.append(centinela)
+        return [[valores(o) for o in opciones], [nodo(prefijo + (v,)) for v in siguientes]]
+
+    arbol = nodo(())
+    return {
+        "niveles": [{"columna": col, "centinela": centinela} for col, centinela in indice.niveles],
+        "valores": valores.lista,
+        "arbol": arbol,
+    }
+
+
+def _paquete_varillas(indice):
+    valores = _Valores()
+    filtros = {
+        diam: {clave: [valores(v) for v in lista] for clave, lista in indice.opciones(diam).items()}
+        for diam in indice.diametros
+    }
+    return {"diametros": indice.diametros, "valores": valores.lista, "filtros": filtros}
+
+
+PAQUETES = {
+    "ajuste": ("ajuste de medida.xlsx", indice_ajuste, _paquete_ajuste),
+    "varillas": ("baja varillas.xlsx", indice_varillas, _paquete_varillas),
+}
+
+_paquetes = {}   # (nombre, firma) -> paquete
+_lock_paquetes = threading.Lock()
+
+
+def version_paquete(firma):
+    return f"{firma[0]:x}-{firma[1]:x}"
+
+
+def paquete_opciones(clave):
+    """{"version", "json", "gzip"} del paquete `clave` para la versión del catálogo en uso."""
+    nombre, indice, armar = PAQUETES[clave]
+    firma = firma_en_uso(nombre)
+    paquete = _paquetes.get((nombre, firma))
+    if paquete is not None:
+        return paquete
+    version = version_paquete(firma)
+    contenido = dict(armar(indice()), version=version)
+    texto = json.dumps(contenido, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    paquete = {"version": version, "json": texto, "gzip": gzip.compress(texto, 9)}
+    with _lock_paquetes:
+        _paquetes[(nombre, firma)] = paquete
+        viejos = [k for k in _paquetes if k[0] == nombre]
+        for k in viejos[:-VERSIONES_PAQUETE]:
+            del _paquetes[k]
+    return paquete
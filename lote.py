@@ -0,0 +1,152 @@
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+
+import flujos
+from arranque import importar_perezoso
+from catalogo import CATALOGOS, cargar_catalogo
+from seleccion import COLUMNAS_REGLAS, indice_reglas
+
+pd = importar_perezoso("pandas")
+
+
+# ===================================
+# Corrida por lotes: listas de materiales para muchos pozos
+# ===================================
+# Uso:
+#   python lote.py campaña.json --salida campaña.xlsx [--procesos N]
+#
+# El archivo de entrada es una lista JSON (o JSON Lines, un pozo por línea)
+# de objetos {"pozo": "...", "especificacion": {...}}, donde la
+# especificación tiene el mismo formato que /api/materiales.
+#
+# Los catálogos y sus índices se cargan en el proceso principal antes de
+# crear el pool; con "fork" los workers los heredan sin volver a leer los
+# Excel, y cada uno sólo evalúa los flujos de los pozos que le tocan.
+
+HOJA_CAMPANA = "Campaña Consolidada"
+
+
+def leer_especificaciones(path):
+    with open(path, encoding="utf-8") as f:
+        contenido = f.read()
+    try:
+        datos = json.loads(contenido)
+    except json.JSONDecodeError:
+        datos = [json.loads(linea) for linea in contenido.splitlines() if linea.strip()]
+    return especificaciones(datos)
+
+
+def especificaciones(datos):
+    """[(pozo, especificación)] de la lista ya leída de {"pozo", "especificacion"}."""
+    if isinstance(datos, dict):
+        datos = [datos]
+    pozos = []
+    for i, item in enumerate(datos, 1):
+        if not isinstance(item, dict) or "especificacion" not in item:
+            raise ValueError(f"Entrada {i}: se esperaba {{'pozo': ..., 'especificacion': {{...}}}}")
+        pozos.append((str(item.get("pozo") or f"Pozo {i}"), item["especificacion"]))
+    return pozos
+
+
+def precargar():
+    for nombre in CATALOGOS:
+        cargar_catalogo(nombre)
+    for nombre in COLUMNAS_REGLAS:
+        indice_reglas(nombre)
+
+
+def _procesar(item):
+    pozo, spec = item
+    try:
+        resultados = flujos.calcular_materiales(spec)
+        if resultados:
+            consolidado = flujos.consolidar(resultados)
+        else:
+            consolidado = pd.DataFrame(columns=flujos.COLUMNAS_CLAVE + ["4.CANTIDAD", "Flujo"])
+        return pozo, consolidado, None
+    except Exception as e:
+        return pozo, None, str(e)
+
+
+def _nombre_hoja(pozo, usados):
+    # Excel limita los nombres de hoja a 31 caracteres y prohíbe []:*?/\
+    base = re.sub(r"[\[\]:*?/\\]", "_", pozo).strip() or "Pozo"
+    base = base[:31]
+    nombre, n = base, 2
+    while nombre.lower() in usados or nombre == HOJA_CAMPANA:
+        sufijo = f" ({n})"
+        nombre = base[:31 - len(sufijo)] + sufijo
+        n += 1
+    usados.add(nombre.lower())
+    return nombre
+
+
+def consolidar_campana(por_pozo):
+    """Suma las cantidades de todos los pozos por material."""
+    if not por_pozo:
+        return pd.DataFrame(columns=flujos.COLUMNAS_CLAVE + ["4.CANTIDAD", "Pozos"])
+    combinado = pd.concat(
+        [df.assign(Pozo=pozo) for pozo, df in por_pozo], ignore_index=True
+    )
+    return (
+        combinado
+        .groupby(flujos.COLUMNAS_CLAVE, as_index=False, dropna=False)
+        .agg(**{"4.CANTIDAD": ("4.CANTIDAD", "sum"), "Pozos": ("Pozo", "nunique")})
+    )
+
+
+def correr_lote(pozos, salida, procesos=None, progreso=None):
+    """Escribe el libro de la campaña en `salida`; `progreso(n)` se llama por cada pozo calculado."""
+    precargar()
+    procesos = procesos or os.cpu_count() or 1
+    chunksize = max(1, len(pozos) // (procesos * 4))
+    resultados = []
+    if procesos > 1 and len(pozos) > 1:
+        with multiprocessing.get_context("fork").Pool(procesos) as pool:
+            for resultado in pool.imap(_procesar, pozos, chunksize=chunksize):
+                resultados.append(resultado)
+                if progreso is not None:
+                    progreso(1)
+    else:
+        for item in pozos:
+            resultados.append(_procesar(item))
+            if progreso is not None:
+                progreso(1)
+
+    por_pozo = [(pozo, df) for pozo, df, error in resultados if df is not None]
+    errores = [(pozo, error) for pozo, _, error in resultados if error]
+
+    usados = set()
+    with pd.ExcelWriter(salida, engine="xlsxwriter") as writer:
+        consolidar_campana(por_pozo).to_excel(writer, sheet_name=HOJA_CAMPANA, index=False)
+        for pozo, df in por_pozo:
+            df.to_excel(writer, sheet_name=_nombre_hoja(pozo, usados), index=False)
+    return len(por_pozo), errores
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Genera las listas de materiales de una campaña de pozos."
+    )
+    parser.add_argument("entrada", help="JSON o JSON Lines con {pozo, especificacion}")
+    parser.add_argument("--salida", default="campaña.xlsx")
+    parser.add_argument("--procesos", type=int, default=None,
+                        help="cantidad de procesos (default: todos los núcleos)")
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    try:
+        pozos = leer_especificaciones(args.entrada)
+    except (OSError, ValueError) as e:
+        print(f"Error al leer {args.entrada}: {e}", file=sys.stderr)
+        sys.exit(1)
+    generados, errores = correr_lote(pozos, args.salida, args.procesos)
+    for pozo, error in errores:
+        print(f"{pozo}: {error}", file=sys.stderr)
+    print(f"{generados}/{len(pozos)} pozos en {time.perf_counter() - inicio:.2f}s -> {args.salida}")
+    sys.exit(1 if errores else 0)
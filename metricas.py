@@ -0,0 +1,192 @@
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+
+# ===================================
+# Métricas de latencia en formato Prometheus
+# ===================================
+# Histogramas de duración por ruta y por etapa de cada request, y contadores
+# de aciertos/fallos de la caché de catálogos. Registrar una observación es
+# una búsqueda binaria y una suma bajo un lock, así que se puede dejar
+# siempre activo. Los valores son por proceso: con varios workers de
+# gunicorn cada uno expone los suyos.
+#
+# Etapas:
+#   carga_catalogo  lectura del xlsx cuando el catálogo no está en caché
+#   filtrado        selección de filas de cada flujo
+#   cantidades      asignación de "4.CANTIDAD"
+#   renombrar       renombrar_columnas
+#   consolidar      actualización de la lista consolidada (flujos.Consolidado)
+#   materializar    armado de un resultado guardado a partir del catálogo
+#   render          render_template y render_por_bloques (hasta el último bloque)
+#   exportar        codificación del xlsx/CSV
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+SIN_RUTA = "-"
+
+
+class Histograma:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.conteos = [0] * (len(buckets) + 1)
+        self.suma = 0.0
+        self.total = 0
+
+    def observar(self, valor):
+        self.conteos[bisect.bisect_left(self.buckets, valor)] += 1
+        self.suma += valor
+        self.total += 1
+
+
+_lock = threading.Lock()
+_duracion_requests = {}   # (ruta, método, estado) -> Histograma
+_duracion_etapas = {}     # (ruta, etapa) -> Histograma
+_cache_catalogos = {}     # (catálogo, "hit" | "miss") -> contador
+_estado = threading.local()
+
+
+def _observar(tabla, clave, segundos):
+    with _lock:
+        histograma = tabla.get(clave)
+        if histograma is None:
+            histograma = tabla[clave] = Histograma()
+        histograma.observar(segundos)
+
+
+def iniciar_request(ruta):
+    _estado.ruta = ruta
+    _estado.inicio = time.perf_counter()
+
+
+def terminar_request(metodo, estado):
+    inicio = getattr(_estado, "inicio", None)
+    if inicio is None:
+        return
+    _observar(_duracion_requests, (_estado.ruta, metodo, str(estado)), time.perf_counter() - inicio)
+    _estado.ruta = SIN_RUTA
+    _estado.inicio = None
+
+
+def ruta_actual():
+    return getattr(_estado, "ruta", SIN_RUTA)
+
+
+def observar_etapa(etapa, segundos, ruta=None):
+    _observar(_duracion_etapas, (ruta or ruta_actual(), etapa), segundos)
+
+
+@contextmanager
+def etapa(nombre):
+    """Mide el bloque `with etapa("filtrado"): ...` como una etapa de la ruta actual."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        observar_etapa(nombre, time.perf_counter() - inicio)
+
+
+def medido(nombre):
+    """Decorador: cada llamada a la función se registra como la etapa `nombre`."""
+    def decorador(funcion):
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            with etapa(nombre):
+                return funcion(*args, **kwargs)
+        return envoltura
+    return decorador
+
+
+def medir_bloques(nombre, generar):
+    """Mide `generar()` más el tiempo de producir cada bloque que devuelve.
+
+    Para cuerpos de respuesta en streaming: los bloques se consumen después de
+    que la vista terminó, así que la ruta se toma al llamar a esta función.
+    """
+    ruta = ruta_actual()
+    inicio = time.perf_counter()
+    bloques = generar()
+    acumulado = time.perf_counter() - inicio
+
+    def medidos():
+        nonlocal acumulado
+        iterador = iter(bloques)
+        while True:
+            inicio = time.perf_counter()
+            try:
+                bloque = next(iterador)
+            except StopIteration:
+                acumulado += time.perf_counter() - inicio
+                observar_etapa(nombre, acumulado, ruta)
+                return
+            acumulado += time.perf_counter() - inicio
+            yield bloque
+
+    return medidos()
+
+
+def contar_cache(catalogo, resultado):
+    clave = (catalogo, resultado)
+    with _lock:
+        _cache_catalogos[clave] = _cache_catalogos.get(clave, 0) + 1
+
+
+def limpiar():
+    with _lock:
+        _duracion_requests.clear()
+        _duracion_etapas.clear()
+        _cache_catalogos.clear()
+
+
+# ===================================
+# Exposición en texto de Prometheus
+# ===================================
+
+def _etiquetas(pares):
+    def escapar(valor):
+        return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return ",".join(f'{k}="{escapar(v)}"' for k, v in pares)
+
+
+def _formato(valor):
+    return repr(float(valor)) if valor != float("inf") else "+Inf"
+
+
+def _histogramas(lineas, nombre, ayuda, tabla, etiquetas):
+    lineas.append(f"# HELP {nombre} {ayuda}")
+    lineas.append(f"# TYPE {nombre} histogram")
+    for clave, histograma in sorted(tabla.items()):
+        base = list(zip(etiquetas, clave))
+        acumulado = 0
+        for limite, conteo in zip(histograma.buckets + (float("inf"),), histograma.conteos):
+            acumulado += conteo
+            lineas.append(f"{nombre}_bucket{{{_etiquetas(base + [('le', _formato(limite))])}}} {acumulado}")
+        lineas.append(f"{nombre}_sum{{{_etiquetas(base)}}} {histograma.suma!r}")
+        lineas.append(f"{nombre}_count{{{_etiquetas(base)}}} {histograma.total}")
+
+
+def exposicion():
+    with _lock:
+        requests = {k: _copia(h) for k, h in _duracion_requests.items()}
+        etapas = {k: _copia(h) for k, h in _duracion_etapas.items()}
+        cache = dict(_cache_catalogos)
+    lineas = []
+    _histogramas(lineas, "bm_request_duracion_segundos", "Duración de cada request por ruta.",
+                 requests, ("ruta", "metodo", "estado"))
+    _histogramas(lineas, "bm_etapa_duracion_segundos", "Duración de cada etapa de un request.",
+                 etapas, ("ruta", "etapa"))
+    lineas.append("# HELP bm_catalogo_cache_total Accesos a la caché de catálogos.")
+    lineas.append("# TYPE bm_catalogo_cache_total counter")
+    for (catalogo, resultado), valor in sorted(cache.items()):
+        lineas.append(f"bm_catalogo_cache_total{{{_etiquetas([('catalogo', catalogo), ('resultado', resultado)])}}} {valor}")
+    return "\n".join(lineas) + "\n"
+
+
+def _copia(histograma):
+    copia = Histograma(histograma.buckets)
+    copia.conteos = list(histograma.conteos)
+    copia.suma = histograma.suma
+    copia.total = histograma.total
+    return copia
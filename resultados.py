@@ -0,0 +1,148 @@
+import hashlib
+
+import metricas
+from arranque import importar_perezoso
+from catalogo import cargar_catalogo, catalogo_en_version, derivado, firma_en_uso
+from flujos import flujo_i, renombrar_columnas
+
+np = importar_perezoso("numpy")
+pd = importar_perezoso("pandas")
+
+
+# ===================================
+# Resultados compactos de la sesión
+# ===================================
+# Lo que guarda cada flujo en la sesión no es una copia del DataFrame sino
+# de dónde sale: catálogo, firma de la versión usada, las filas elegidas (por
+# posición) y las cantidades que difieren de las del catálogo. El DataFrame
+# se arma recién al mostrarlo o exportarlo, con materializar(). Así una
+# sesión ocupa unos cientos de bytes por flujo en lugar de una copia del
+# texto del catálogo.
+#
+# Si el proceso ya no tiene esa versión del catálogo (la reemplazó la
+# vigilancia, o es otro worker que arrancó después del cambio), se usa la
+# versión actual sólo si las filas elegidas siguen siendo los mismos
+# materiales (se compara un hash de Cód.SAP y MATERIAL); si no, el resultado
+# está vencido y hay que volver a correr el flujo.
+#
+# Los flujos de lista fija (Flujo I) guardan sólo el nombre del flujo, y las
+# sesiones guardadas antes de este formato, el DataFrame tal cual.
+
+CATALOGO_FLUJO = {
+    "FLUJO A": "ajuste de medida.xlsx",
+    "FLUJO B": "saca tubing.xlsx",
+    "FLUJO C": "baja tubing.xlsx",
+    "FLUJO D": "profundiza.xlsx",
+    "FLUJO E": "baja varillas.xlsx",
+    "FLUJO F": "abandono-recupero.xlsx",
+    "FLUJO G": "WO.xlsx",
+    "FLUJO H": "GENERAL(1).xlsx",
+}
+
+FLUJOS_FIJOS = {
+    "FLUJO I": flujo_i,
+}
+
+_COLUMNAS_CONTROL = ["1. Cód.SAP", "2. MATERIAL"]
+
+
+class ResultadoVencido(ValueError):
+    pass
+
+
+def _hashes_filas(df):
+    columnas = [col for col in _COLUMNAS_CONTROL if col in df.columns]
+    return pd.util.hash_pandas_object(df[columnas], index=False).to_numpy()
+
+
+def _control(nombre, filas):
+    # Hash de Cód.SAP y MATERIAL de las filas elegidas; el de cada fila se
+    # calcula una vez por versión del catálogo
+    hashes = derivado(nombre, "hashes_filas", _hashes_filas)
+    if filas is not None:
+        hashes = hashes[filas]
+    return hashlib.sha1(hashes.tobytes()).hexdigest()[:16]
+
+
+class Resultado:
+    __slots__ = ("flujo", "catalogo", "firma", "filas", "posiciones", "cantidades", "control", "datos", "clave")
+
+    @classmethod
+    def desde(cls, flujo, df):
+        """Resultado compacto de `df`, la salida de un flujo sobre su catálogo (o el df tal cual)."""
+        resultado = cls()
+        resultado.flujo = flujo
+        resultado.catalogo = CATALOGO_FLUJO.get(flujo)
+        resultado.firma = resultado.filas = resultado.posiciones = resultado.cantidades = None
+        resultado.control = resultado.datos = None
+        if resultado.catalogo is None and flujo in FLUJOS_FIJOS:
+            resultado.clave = resultado._huella()
+            return resultado
+        base = cargar_catalogo(resultado.catalogo) if resultado.catalogo else None
+        filas = base.index.get_indexer(df.index) if base is not None else None
+        if filas is None or (filas < 0).any():
+            resultado.catalogo = None
+            resultado.datos = df
+        else:
+            resultado.firma = firma_en_uso(resultado.catalogo)
+            if len(filas) != len(base) or (filas != np.arange(len(base))).any():
+                resultado.filas = filas.astype(np.int32)
+            resultado.control = _control(resultado.catalogo, resultado.filas)
+            if "4.CANTIDAD" in df.columns:
+                originales = base["4.CANTIDAD"].to_numpy(dtype=float)[filas]
+                nuevas = df["4.CANTIDAD"].to_numpy(dtype=float)
+                distintas = (originales != nuevas) & ~(np.isnan(originales) & np.isnan(nuevas))
+                if distintas.any():
+                    resultado.posiciones = np.flatnonzero(distintas).astype(np.int32)
+                    resultado.cantidades = nuevas[distintas]
+        resultado.clave = resultado._huella()
+        return resultado
+
+    def _huella(self):
+        h = hashlib.sha1()
+        if self.datos is not None:
+            h.update(self.flujo.encode("utf-8"))
+            h.update(repr(list(self.datos.columns)).encode("utf-8"))
+            h.update(pd.util.hash_pandas_object(self.datos, index=False).to_numpy().tobytes())
+        else:
+            h.update(repr((self.flujo, self.catalogo, self.firma, self.control)).encode("utf-8"))
+            for arreglo in (self.filas, self.posiciones, self.cantidades):
+                h.update(b"-" if arreglo is None else arreglo.tobytes())
+        return h.hexdigest()
+
+    def _base(self):
+        base = catalogo_en_version(self.catalogo, self.firma)
+        if base is not None:
+            return base
+        base = cargar_catalogo(self.catalogo)
+        filas = self.filas
+        if filas is not None and len(filas) and filas.max() >= len(base) or _control(self.catalogo, filas) != self.control:
+            raise ResultadoVencido(
+                f"El catálogo {self.catalogo} cambió desde que se calculó el {self.flujo}: volvé a correr ese flujo."
+            )
+        return base
+
+    def materializar(self):
+        """DataFrame del resultado, igual al que devolvió el flujo."""
+        if self.datos is not None:
+            return self.datos
+        if self.catalogo is None:
+            return FLUJOS_FIJOS[self.flujo]()
+        with metricas.etapa("materializar"):
+            base = self._base()
+            df = base if self.filas is None else base.iloc[self.filas]
+            df = renombrar_columnas(df)
+            if self.posiciones is not None:
+                cantidades = df["4.CANTIDAD"].to_numpy(dtype=float, copy=True)
+                cantidades[self.posiciones] = self.cantidades
+                df = df.assign(**{"4.CANTIDAD": cantidades})
+            return df
+
+    def __eq__(self, otro):
+        return isinstance(otro, Resultado) and self.clave == otro.clave
+
+    def __hash__(self):
+        return hash(self.clave)
+
+    def __repr__(self):
+        return f"<Resultado {self.flujo} {self.catalogo or ('datos' if self.datos is not None else 'fijo')} {self.clave[:8]}>"
@@ -0,0 +1,171 @@
+import threading
+
+from catalogo import CATALOGOS, COLUMNAS_REQUERIDAS, derivado, registrar_derivado, version_catalogo
+from flujos import VALVULAS_PRODUCCION
+from resultados import CATALOGO_FLUJO
+
+
+# ===================================
+# Índice de Cód.SAP entre catálogos
+# ===================================
+# Los ocho libros comparten muchos Cód.SAP, y saber en qué flujos (y con qué
+# condición y filtros) aparece un material obligaba a recorrer cada
+# DataFrame. Este índice asocia cada Cód.SAP a sus filas en todos los
+# catálogos: MATERIAL, Descripción, CONDICIÓN, la cantidad del catálogo y los
+# valores de las columnas de filtro que eligen esa fila ("TODOS" = cualquier
+# valor). Las filas fijas del Flujo I (VALVULAS_PRODUCCION) se agregan sin
+# catálogo.
+#
+# Cada catálogo arma su parte como derivado de su versión (la vigilancia la
+# construye antes de publicar una versión nueva y el precalentamiento al
+# arrancar); la unión de los ocho se arma una vez por combinación de
+# versiones, así consultar un código es una búsqueda en un dict. Son dicts y
+# listas de Python, listos para devolver como JSON.
+
+_COLUMNAS = {
+    "codigo": "1. Cód.SAP",
+    "material": "2. MATERIAL",
+    "descripcion": "3. Descripción",
+    "cantidad": "4.CANTIDAD",
+    "condicion": "5.CONDICIÓN",
+}
+_COLUMNAS_MATERIAL = set(_COLUMNAS.values())
+
+# Columnas de filtro de cada catálogo: las que pide su flujo además de las del material
+FILTROS = {
+    nombre: [col for col in columnas if col not in _COLUMNAS_MATERIAL]
+    for nombre, columnas in COLUMNAS_REQUERIDAS.items()
+}
+FLUJO_CATALOGO = {catalogo: flujo for flujo, catalogo in CATALOGO_FLUJO.items()}
+
+# Uniones armadas, por combinación de versiones (pocas: la actual y las fijadas)
+UNIONES_EN_CACHE = 4
+
+
+def codigo_sap(valor):
+    """Cód.SAP como texto: sin espacios y sin ".0" si vino como float."""
+    if valor is None or valor != valor:   # NaN
+        return ""
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)
+    return str(valor).strip()
+
+
+def _texto(valor):
+    if valor is None or valor != valor:
+        return ""
+    return str(valor).strip()
+
+
+def _cantidad(valor):
+    if valor is None or valor != valor:
+        return None
+    valor = float(valor)
+    return int(valor) if valor.is_integer() else valor
+
+
+def _fila(flujo, catalogo, fila, registro, filtros):
+    return {
+        "flujo": flujo,
+        "catalogo": catalogo,
+        "fila": fila,
+        "material": _texto(registro.get(_COLUMNAS["material"])),
+        "descripcion": _texto(registro.get(_COLUMNAS["descripcion"])),
+        "condicion": _texto(registro.get(_COLUMNAS["condicion"])),
+        "cantidad": _cantidad(registro.get(_COLUMNAS["cantidad"])),
+        "filtros": {col: _texto(registro.get(col)) for col in filtros},
+    }
+
+
+def _indice_catalogo(nombre):
+    def construir(df):
+        flujo = FLUJO_CATALOGO.get(nombre)
+        filtros = [col for col in FILTROS[nombre] if col in df.columns]
+        columnas = [col for col in list(_COLUMNAS.values()) + filtros if col in df.columns]
+        indice = {}
+        for fila, registro in enumerate(df[columnas].to_dict("records")):
+            codigo = codigo_sap(registro.get(_COLUMNAS["codigo"]))
+            if codigo:
+                indice.setdefault(codigo, []).append(_fila(flujo, nombre, fila, registro, filtros))
+        return indice
+    return construir
+
+
+for _nombre in CATALOGOS:
+    registrar_derivado(_nombre, "sap", _indice_catalogo(_nombre))
+
+
+def indice_catalogo(nombre):
+    """{Cód.SAP: [filas]} del catálogo, en la versión del request actual."""
+    return derivado(nombre, "sap", _indice_catalogo(nombre))
+
+
+def _filas_fijas():
+    indice = {}
+    for fila, registro in enumerate(VALVULAS_PRODUCCION):
+        registro = {_COLUMNAS[campo]: registro.get(col) for campo, col in (
+            ("codigo", "Cód.SAP"), ("material", "MATERIAL"), ("descripcion", "Descripción"),
+            ("cantidad", "4.CANTIDAD"), ("condicion", "CONDICIÓN"))}
+        codigo = codigo_sap(registro[_COLUMNAS["codigo"]])
+        indice.setdefault(codigo, []).append(_fila("FLUJO I", None, fila, registro, []))
+    return indice
+
+
+_uniones = {}
+_lock = threading.Lock()
+
+
+def indice():
+    """{Cód.SAP: [filas de todos los catálogos]}, en las versiones del request actual."""
+    versiones = tuple(version_catalogo(nombre) for nombre in CATALOGOS)
+    union = _uniones.get(versiones)
+    if union is not None:
+        return union
+    union = {}
+    for parte in [indice_catalogo(nombre) for nombre in CATALOGOS] + [_filas_fijas()]:
+        for codigo, filas in parte.items():
+            union.setdefault(codigo, []).extend(filas)
+    with _lock:
+        _uniones[versiones] = union
+        while len(_uniones) > UNIONES_EN_CACHE:
+            _uniones.pop(next(iter(_uniones)))
+    return union
+
+
+def _unicos(valores):
+    return list(dict.fromkeys(v for v in valores if v))
+
+
+def buscar(codigo):
+    """Materiales y filas del Cód.SAP `codigo` en todos los catálogos, o None si no aparece."""
+    filas = indice().get(codigo_sap(codigo))
+    if not filas:
+        return None
+    return {
+        "codigo": codigo_sap(codigo),
+        "materiales": _unicos(fila["material"] for fila in filas),
+        "descripciones": _unicos(fila["descripcion"] for fila in filas),
+        "filas": filas,
+    }
+
+
+def flujos_que_usan(codigo):
+    """Por flujo: condiciones y combinaciones de filtros que incluyen el Cód.SAP, o None."""
+    filas = indice().get(codigo_sap(codigo))
+    if not filas:
+        return None
+    por_flujo = {}
+    for fila in filas:
+        uso = por_flujo.setdefault(fila["flujo"], {
+            "flujo": fila["flujo"],
+            "catalogo": fila["catalogo"],
+            "condiciones": [],
+            "selecciones": [],
+            "filas": 0,
+        })
+        uso["filas"] += 1
+        if fila["condicion"] and fila["condicion"] not in uso["condiciones"]:
+            uso["condiciones"].append(fila["condicion"])
+        if fila["filtros"] and fila["filtros"] not in uso["selecciones"]:
+            uso["selecciones"].append(fila["filtros"])
+    return {"codigo": codigo_sap(codigo), "flujos": list(por_flujo.values())}
@@ -0,0 +1,79 @@
+import metricas
+from arranque import importar_perezoso
+from catalogo import derivado
+
+np = importar_perezoso("numpy")
+pd = importar_perezoso("pandas")
+
+
+# ===================================
+# Selección de filas con reglas comodín ("TODOS")
+# ===================================
+# En los catálogos una fila con "TODOS" en una columna aplica a cualquier
+# valor elegido en esa columna. Para cada columna de filtro se guarda, por
+# valor, el bitmap de filas que lo aceptan (las del valor más las "TODOS").
+# Una selección es una lista de reglas (una por DIÁMETRO, por combinación
+# DIÁMETRO/TIPO, etc.); cada regla es un AND de bitmaps por columna y el
+# resultado es el OR de todas las reglas, sin filas repetidas.
+
+TODOS = "TODOS"
+
+
+class IndiceReglas:
+    def __init__(self, df, columnas):
+        self.n = len(df)
+        self._todas = np.packbits(np.ones(self.n, dtype=bool))
+        self._vacio = np.packbits(np.zeros(self.n, dtype=bool))
+        self._bitmaps = {}
+        self._comodin = {}
+        for col in columnas:
+            if col not in df.columns:
+                continue
+            codigos, valores = pd.factorize(df[col])
+            es_todos = np.asarray(df[col] == TODOS, dtype=bool)
+            self._comodin[col] = np.packbits(es_todos)
+            self._bitmaps[col] = {
+                valor: np.packbits((codigos == i) | es_todos)
+                for i, valor in enumerate(valores)
+            }
+
+    def bitmap(self, col, valores):
+        """Filas que aceptan alguno de `valores` en `col` (incluye las "TODOS")."""
+        por_valor = self._bitmaps[col]
+        resultado = self._comodin[col]
+        for valor in valores:
+            resultado = resultado | por_valor.get(valor, self._vacio)
+        return resultado
+
+    def seleccionar(self, reglas):
+        """Índices posicionales (ordenados, únicos) de las filas que cumplen alguna regla.
+
+        Cada regla es un dict {columna: [valores]}. Las columnas ausentes del
+        catálogo o con lista vacía no filtran.
+        """
+        acumulado = self._vacio
+        for regla in reglas:
+            bits = self._todas
+            for col, valores in regla.items():
+                if col in self._bitmaps and valores:
+                    bits = bits & self.bitmap(col, valores)
+            acumulado = acumulado | bits
+        return np.flatnonzero(np.unpackbits(acumulado, count=self.n))
+
+
+COLUMNAS_REGLAS = {
+    "ajuste de medida.xlsx": ["DIÁMETRO", "TIPO", "GRADO DE ACERO", "GRADO DE ACERO CUPLA", "TIPO DE CUPLA"],
+    "baja tubing.xlsx": ["DIÁMETRO", "TIPO", "DIÁMETRO CSG"],
+    "baja varillas.xlsx": ["DIÁMETRO", "TIPO", "GRADO DE ACERO", "GRADO DE ACERO CUPLA", "TIPO DE CUPLA"],
+}
+
+
+def indice_reglas(nombre):
+    return derivado(nombre, "reglas", lambda df: IndiceReglas(df, COLUMNAS_REGLAS[nombre]))
+
+
+def seleccionar_filas(nombre, df, reglas):
+    """Filas de `df` (el catálogo `nombre`) que cumplen alguna de las reglas."""
+    indice = indice_reglas(nombre)
+    with metricas.etapa("filtrado"):
+        return df.iloc[indice.seleccionar(reglas)]
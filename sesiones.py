@@ -0,0 +1,218 @@
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+# ===================================
+# Almacén de resultados por sesión
+# ===================================
+# Cada técnico tiene su propia lista de materiales, identificada por un token
+# de sesión (cookie). Las entradas vencen por TTL y, si se supera el tope de
+# memoria, se desalojan las usadas hace más tiempo (LRU).
+#
+# El backend es intercambiable:
+#   - MemoriaBackend: dict en el proceso (un solo worker, varios threads).
+#   - SQLiteBackend: archivo local compartido por todos los workers y threads.
+#
+# Configuración por entorno:
+#   BM_SESIONES            "memoria" (default), "sqlite" o "sqlite:/ruta/archivo.db";
+#                          con más de un worker gunicorn.conf.py usa "sqlite"
+#   BM_SESIONES_TTL        segundos de inactividad antes de vencer (default 8 h)
+#   BM_SESIONES_MAX_BYTES  tope de tamaño total de las sesiones (default 256 MB)
+
+TTL_DEFAULT = 8 * 60 * 60
+MAX_BYTES_DEFAULT = 256 * 1024 * 1024
+
+
+def nuevo_token():
+    return uuid.uuid4().hex
+
+
+def token_valido(token):
+    if not token or len(token) != 32:
+        return False
+    try:
+        int(token, 16)
+    except ValueError:
+        return False
+    return True
+
+
+class MemoriaBackend:
+    def __init__(self, ttl=TTL_DEFAULT, max_bytes=MAX_BYTES_DEFAULT):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        # token -> (último acceso, tamaño, valor), ordenado de menos a más reciente
+        self._datos = OrderedDict()
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def _vencer(self, ahora, conservar=None):
+        limite = ahora - self.ttl
+        while self._datos:
+            token, (accedido, tamano, _) = next(iter(self._datos.items()))
+            if token == conservar:
+                break
+            if accedido >= limite and self._total <= self.max_bytes:
+                break
+            del self._datos[token]
+            self._total -= tamano
+
+    def _leer(self, token, ahora):
+        item = self._datos.get(token)
+        if item is None:
+            return None
+        if item[0] < ahora - self.ttl:
+            del self._datos[token]
+            self._total -= item[1]
+            return None
+        return item[2]
+
+    def _escribir(self, token, valor, ahora):
+        tamano = len(pickle.dumps(valor, protocol=pickle.HIGHEST_PROTOCOL))
+        anterior = self._datos.pop(token, None)
+        if anterior is not None:
+            self._total -= anterior[1]
+        self._datos[token] = (ahora, tamano, valor)
+        self._total += tamano
+        self._vencer(ahora, conservar=token)
+
+    def obtener(self, token):
+        with self._lock:
+            ahora = time.time()
+            valor = self._leer(token, ahora)
+            if valor is not None:
+                accedido, tamano, _ = self._datos[token]
+                self._datos[token] = (ahora, tamano, valor)
+                self._datos.move_to_end(token)
+            return valor
+
+    def guardar(self, token, valor):
+        with self._lock:
+            self._escribir(token, valor, time.time())
+
+    def actualizar(self, token, funcion):
+        with self._lock:
+            ahora = time.time()
+            valor = funcion(self._leer(token, ahora))
+            self._escribir(token, valor, ahora)
+            return valor
+
+    def eliminar(self, token):
+        with self._lock:
+            item = self._datos.pop(token, None)
+            if item is not None:
+                self._total -= item[1]
+
+
+class SQLiteBackend:
+    def __init__(self, path=None, ttl=TTL_DEFAULT, max_bytes=MAX_BYTES_DEFAULT):
+        self.path = path or os.path.join(tempfile.gettempdir(), "bm_sesiones.db")
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        with self._conexion() as con:
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS sesiones ("
+                " token TEXT PRIMARY KEY,"
+                " accedido REAL NOT NULL,"
+                " tamano INTEGER NOT NULL,"
+                " datos BLOB NOT NULL)"
+            )
+            con.execute("CREATE INDEX IF NOT EXISTS sesiones_accedido ON sesiones (accedido)")
+
+    def _conexion(self):
+        # Una conexión por thread (y por proceso: se crea después del fork)
+        con = getattr(self._local, "con", None)
+        if con is None or getattr(self._local, "pid", None) != os.getpid():
+            con = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.con = con
+            self._local.pid = os.getpid()
+        return _Transaccion(con)
+
+    def _leer(self, con, token, ahora):
+        fila = con.execute(
+            "SELECT datos FROM sesiones WHERE token = ? AND accedido >= ?",
+            (token, ahora - self.ttl),
+        ).fetchone()
+        return pickle.loads(fila[0]) if fila else None
+
+    def _escribir(self, con, token, valor, ahora):
+        datos = pickle.dumps(valor, protocol=pickle.HIGHEST_PROTOCOL)
+        con.execute(
+            "INSERT OR REPLACE INTO sesiones (token, accedido, tamano, datos) VALUES (?, ?, ?, ?)",
+            (token, ahora, len(datos), sqlite3.Binary(datos)),
+        )
+        self._vencer(con, ahora, conservar=token)
+
+    def _vencer(self, con, ahora, conservar):
+        con.execute("DELETE FROM sesiones WHERE accedido < ?", (ahora - self.ttl,))
+        total = con.execute("SELECT COALESCE(SUM(tamano), 0) FROM sesiones").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # LRU: se borran las sesiones menos recientes hasta quedar bajo el tope
+        for token, tamano in con.execute(
+            "SELECT token, tamano FROM sesiones WHERE token != ? ORDER BY accedido",
+            (conservar,),
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            con.execute("DELETE FROM sesiones WHERE token = ?", (token,))
+            total -= tamano
+
+    def obtener(self, token):
+        with self._conexion() as con:
+            ahora = time.time()
+            valor = self._leer(con, token, ahora)
+            if valor is not None:
+                con.execute("UPDATE sesiones SET accedido = ? WHERE token = ?", (ahora, token))
+            return valor
+
+    def guardar(self, token, valor):
+        with self._conexion() as con:
+            self._escribir(con, token, valor, time.time())
+
+    def actualizar(self, token, funcion):
+        with self._conexion() as con:
+            ahora = time.time()
+            valor = funcion(self._leer(con, token, ahora))
+            self._escribir(con, token, valor, ahora)
+            return valor
+
+    def eliminar(self, token):
+        with self._conexion() as con:
+            con.execute("DELETE FROM sesiones WHERE token = ?", (token,))
+
+
+class _Transaccion:
+    # BEGIN IMMEDIATE toma el lock de escritura al inicio, así un
+    # leer-modificar-escribir no se pisa con otro worker
+    def __init__(self, con):
+        self.con = con
+
+    def __enter__(self):
+        self.con.execute("BEGIN IMMEDIATE")
+        return self.con
+
+    def __exit__(self, tipo, valor, traza):
+        self.con.execute("COMMIT" if tipo is None else "ROLLBACK")
+        return False
+
+
+def crear_backend_desde_entorno():
+    ttl = float(os.environ.get("BM_SESIONES_TTL", TTL_DEFAULT))
+    max_bytes = int(os.environ.get("BM_SESIONES_MAX_BYTES", MAX_BYTES_DEFAULT))
+    tipo = os.environ.get("BM_SESIONES", "memoria")
+    if tipo == "memoria":
+        return MemoriaBackend(ttl=ttl, max_bytes=max_bytes)
+    if tipo == "sqlite" or tipo.startswith("sqlite:"):
+        path = tipo.partition(":")[2] or None
+        return SQLiteBackend(path, ttl=ttl, max_bytes=max_bytes)
+    raise ValueError(f"Backend de sesiones desconocido: {tipo}")
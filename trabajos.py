@@ -0,0 +1,249 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+
+# ===================================
+# Exportaciones en segundo plano
+# ===================================
+# Una exportación grande (o una campaña de pozos, ver lote.py) no se genera
+# dentro del request: se crea un trabajo, la respuesta lleva su id y el
+# archivo se arma en un pool de procesos local. El cliente consulta el
+# estado (GET /exportaciones/<id>) hasta que está listo y recién ahí lo
+# descarga, así los requests interactivos nunca esperan detrás de una
+# exportación y ningún worker de gunicorn pasa el timeout.
+#
+# El estado de cada trabajo es un JSON en BM_TRABAJOS_DIR (default
+# <tmp>/bm_trabajos), junto al archivo generado; como es disco local,
+# cualquier worker del mismo host puede responder por un trabajo creado en
+# otro. El proceso que genera el archivo actualiza el progreso (filas o pozos
+# hechos sobre el total) a lo sumo cada INTERVALO_PROGRESO segundos.
+#
+# Los procesos del pool se crean con "spawn": no heredan los threads ni los
+# locks del worker y quedan vivos entre trabajos. Cada worker de gunicorn
+# tiene su propio pool de BM_TRABAJOS_PROCESOS procesos (default 1). Los
+# trabajos y sus archivos vencen a las BM_TRABAJOS_TTL segundos (default
+# 1 h); los vencidos se borran al crear uno nuevo.
+
+DIRECTORIO = os.environ.get("BM_TRABAJOS_DIR") or os.path.join(tempfile.gettempdir(), "bm_trabajos")
+PROCESOS = int(os.environ.get("BM_TRABAJOS_PROCESOS", 1))
+TTL = float(os.environ.get("BM_TRABAJOS_TTL", 60 * 60))
+INTERVALO_PROGRESO = 0.25
+
+PENDIENTE, CORRIENDO, LISTO, ERROR = "pendiente", "corriendo", "listo", "error"
+
+_pool = None
+_pool_pid = None
+_lock = threading.Lock()
+
+
+def _pool_actual():
+    global _pool, _pool_pid
+    with _lock:
+        # Un pool por proceso: los de un master de gunicorn no sirven en el worker
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ProcessPoolExecutor(max_workers=PROCESOS, mp_context=multiprocessing.get_context("spawn"))
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _ruta(directorio, id_trabajo, extension="json"):
+    return os.path.join(directorio, f"{id_trabajo}.{extension}")
+
+
+def _escribir_estado(directorio, estado):
+    fd, temporal = tempfile.mkstemp(dir=directorio, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(estado, f)
+    os.replace(temporal, _ruta(directorio, estado["id"]))
+
+
+def _leer_estado(directorio, id_trabajo):
+    try:
+        with open(_ruta(directorio, id_trabajo), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def duenio(token):
+    """Lo que se guarda del token de sesión para saber de quién es un trabajo."""
+    return hashlib.sha1(token.encode("utf-8")).hexdigest()
+
+
+def id_valido(id_trabajo):
+    return len(id_trabajo) == 32 and all(c in "0123456789abcdef" for c in id_trabajo)
+
+
+# ===================================
+# Lado del proceso que genera el archivo
+# ===================================
+
+class _Progreso:
+    def __init__(self, directorio, estado):
+        self.directorio = directorio
+        self.estado = estado
+        self._ultimo = 0.0
+
+    def __call__(self, n):
+        self.estado["hechas"] += n
+        ahora = time.monotonic()
+        if ahora - self._ultimo >= INTERVALO_PROGRESO:
+            self._ultimo = ahora
+            _escribir_estado(self.directorio, self.estado)
+
+
+def _correr(directorio, id_trabajo, generar):
+    estado = _leer_estado(directorio, id_trabajo)
+    estado.update(estado=CORRIENDO, iniciado=time.time())
+    _escribir_estado(directorio, estado)
+    destino = _ruta(directorio, id_trabajo, estado["extension"])
+    # La extensión al final: pandas elige el motor de Excel por ella
+    temporal = _ruta(directorio, id_trabajo, "parcial." + estado["extension"])
+    try:
+        generar(temporal, _Progreso(directorio, estado))
+        os.replace(temporal, destino)
+        estado.update(estado=LISTO, hechas=estado["total"])
+    except Exception as e:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        estado.update(estado=ERROR, error=str(e))
+    estado["terminado"] = time.time()
+    _escribir_estado(directorio, estado)
+
+
+def _exportar(directorio, id_trabajo, formato, consolidado, por_flujo):
+    import exportar
+
+    def generar(path, progreso):
+        if formato == "xlsx":
+            bloques = exportar.generar_xlsx(consolidado, por_flujo, progreso=progreso)
+        else:
+            bloques = exportar.generar_csv(consolidado, "," if formato == "csv" else "\t", progreso=progreso)
+        with open(path, "wb") as f:
+            for bloque in bloques:
+                f.write(bloque)
+
+    _correr(directorio, id_trabajo, generar)
+
+
+def _lote(directorio, id_trabajo, pozos):
+    import lote
+
+    def generar(path, progreso):
+        # Un solo proceso: este ya es un proceso aparte del pool
+        _, errores = lote.correr_lote(pozos, path, procesos=1, progreso=progreso)
+        if errores:
+            estado = progreso.estado
+            estado["errores_pozos"] = [f"{pozo}: {error}" for pozo, error in errores]
+
+    _correr(directorio, id_trabajo, generar)
+
+
+# ===================================
+# Lado de la app
+# ===================================
+
+def _nuevo(tipo, token, total, extension, nombre_descarga, mimetype):
+    os.makedirs(DIRECTORIO, exist_ok=True)
+    limpiar_vencidos()
+    estado = {
+        "id": uuid.uuid4().hex,
+        "tipo": tipo,
+        "duenio": duenio(token),
+        "estado": PENDIENTE,
+        "hechas": 0,
+        "total": total,
+        "extension": extension,
+        "nombre_descarga": nombre_descarga,
+        "mimetype": mimetype,
+        "error": None,
+        "creado": time.time(),
+    }
+    _escribir_estado(DIRECTORIO, estado)
+    return estado
+
+
+def _lanzar(estado, funcion, *args):
+    global _pool
+    try:
+        _pool_actual().submit(funcion, DIRECTORIO, estado["id"], *args)
+    except Exception as e:
+        # Un pool roto (p. ej. un proceso murió) no se recupera: el próximo trabajo crea otro
+        with _lock:
+            _pool = None
+        estado.update(estado=ERROR, error=f"No se pudo lanzar el trabajo: {e}", terminado=time.time())
+        _escribir_estado(DIRECTORIO, estado)
+    return estado["id"]
+
+
+def crear_exportacion(token, formato, mimetype, consolidado, por_flujo=None):
+    """Lanza la exportación del consolidado (y, en xlsx, una hoja por flujo); devuelve el id."""
+    total = len(consolidado) + sum(len(df) for _, df in por_flujo or [])
+    estado = _nuevo("exportacion", token, total, formato, f"materiales_consolidados.{formato}", mimetype)
+    return _lanzar(estado, _exportar, formato, consolidado, por_flujo)
+
+
+def crear_lote(token, pozos, mimetype):
+    """Lanza la corrida de una campaña [(pozo, especificación)]; devuelve el id."""
+    estado = _nuevo("lote", token, len(pozos), "xlsx", "campaña.xlsx", mimetype)
+    return _lanzar(estado, _lote, pozos)
+
+
+def consultar(id_trabajo, token):
+    """Estado del trabajo si existe, no venció y es de la sesión `token`; si no, None."""
+    if not id_valido(id_trabajo):
+        return None
+    actual = _leer_estado(DIRECTORIO, id_trabajo)
+    if actual is None or actual["duenio"] != duenio(token) or _vencido(actual, time.time()):
+        return None
+    return actual
+
+
+def archivo(estado_trabajo):
+    return _ruta(DIRECTORIO, estado_trabajo["id"], estado_trabajo["extension"])
+
+
+def publico(estado_trabajo):
+    """Campos del estado que se muestran al cliente."""
+    total = estado_trabajo["total"]
+    return {
+        "id": estado_trabajo["id"],
+        "tipo": estado_trabajo["tipo"],
+        "estado": estado_trabajo["estado"],
+        "hechas": estado_trabajo["hechas"],
+        "total": total,
+        "progreso": round(estado_trabajo["hechas"] / total, 3) if total else (1.0 if estado_trabajo["estado"] == LISTO else 0.0),
+        "error": estado_trabajo["error"],
+        "errores_pozos": estado_trabajo.get("errores_pozos", []),
+    }
+
+
+def _vencido(estado_trabajo, ahora):
+    # Uno sin terminar vence contando desde que se creó (su proceso pudo morir)
+    return estado_trabajo.get("terminado", estado_trabajo["creado"]) < ahora - TTL
+
+
+def limpiar_vencidos():
+    ahora = time.time()
+    try:
+        nombres = os.listdir(DIRECTORIO)
+    except OSError:
+        return
+    for nombre in nombres:
+        if not nombre.endswith(".json"):
+            continue
+        actual = _leer_estado(DIRECTORIO, nombre[:-len(".json")])
+        if actual is None or not _vencido(actual, ahora):
+            continue
+        for extension in ("json", actual["extension"], "parcial." + actual["extension"]):
+            try:
+                os.remove(_ruta(DIRECTORIO, actual["id"], extension))
+            except OSError:
+                pass